@@ -0,0 +1,201 @@
+"""
+Local stand-ins for the Ghost Admin API, the Telegram Bot API and the
+Instagram media CDN, used by the benchmark harness.
+
+Every service answers after a configurable latency and fails a configurable
+share of requests, so slow or flaky destinations can be reproduced without
+touching the live services. They run in their own process, so their CPU and
+memory do not count against the watcher being measured.
+"""
+import email.parser
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Prefixes that make generated media sniff as the right format
+MEDIA_MAGIC = {
+    'image': b'\xff\xd8\xff\xe0',
+    'video': b'\x00\x00\x00\x18ftypmp42',
+}
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Base handler: latency, random failures and JSON replies."""
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    error_rate = 0.0
+    counter = itertools.count(1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def _reply(self, status: int, body: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, payload):
+        self._reply(status, json.dumps(payload).encode())
+
+    def _simulate(self) -> bool:
+        """Wait for the configured latency; returns True if this request should fail."""
+        if self.latency:
+            time.sleep(self.latency)
+        return random.random() < self.error_rate
+
+
+class GhostHandler(FakeHandler):
+    """Ghost Admin API: image and media uploads, post creation and updates."""
+
+    def do_POST(self):
+        body = self._read_body()
+        if self._simulate():
+            self._json(500, {'errors': [{'message': 'Simulated Ghost failure'}]})
+            return
+
+        path = urlparse(self.path).path
+        item = next(self.counter)
+        if path.endswith('/images/upload/'):
+            self._json(201, {'images': [{'url': f'http://ghost.bench/content/images/{item}.jpg'}]})
+        elif path.endswith('/media/upload/'):
+            self._json(201, {'media': [{'url': f'http://ghost.bench/content/media/{item}.mp4'}]})
+        elif path.endswith('/posts/'):
+            title = json.loads(body)['posts'][0].get('title')
+            self._json(201, {'posts': [{
+                'id': f'post{item}', 'title': title, 'url': f'http://ghost.bench/p/{item}/',
+                'updated_at': f'2024-01-01T00:00:{item % 60:02d}.000Z',
+            }]})
+        else:
+            self._json(404, {'errors': [{'message': 'Not found'}]})
+
+    def _post_id(self) -> str:
+        return urlparse(self.path).path.rstrip('/').rsplit('/', 1)[-1]
+
+    def do_GET(self):
+        if self._simulate():
+            self._json(500, {'errors': [{'message': 'Simulated Ghost failure'}]})
+            return
+        self._json(200, {'posts': [{'id': self._post_id(), 'status': 'published', 'updated_at': '2024-01-01T00:00:00.000Z'}]})
+
+    def do_PUT(self):
+        body = self._read_body()
+        if self._simulate():
+            self._json(500, {'errors': [{'message': 'Simulated Ghost failure'}]})
+            return
+        post = json.loads(body)['posts'][0]
+        post_id = self._post_id()
+        self._json(200, {'posts': [{
+            'id': post_id, 'title': post.get('title'), 'status': post.get('status', 'published'),
+            'url': f'http://ghost.bench/p/{post_id}/', 'updated_at': f'2024-01-02T00:00:{next(self.counter) % 60:02d}.000Z',
+        }]})
+
+
+class TelegramHandler(FakeHandler):
+    """Telegram Bot API: getMe, the media sending methods, caption edits and deletions."""
+
+    retry_after = 1
+
+    def _form_fields(self, body: bytes) -> dict[str, str]:
+        """Text fields of a form or multipart body (uploaded files are skipped)."""
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            message = email.parser.BytesParser().parsebytes(
+                f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+            )
+            fields = {}
+            for part in message.get_payload():
+                name = part.get_param('name', header='content-disposition')
+                if not part.get_filename():
+                    fields[name] = part.get_payload(decode=True).decode()
+            return fields
+        if content_type.startswith('application/json'):
+            return {key: json.dumps(value) if not isinstance(value, str) else value
+                    for key, value in json.loads(body or b'{}').items()}
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    def _message(self, chat_id, kind: str) -> dict:
+        message_id = next(self.counter)
+        message = {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': int(chat_id), 'type': 'channel'}}
+        file = {'file_id': f'{kind}{message_id}', 'file_unique_id': f'u{kind}{message_id}', 'width': 1080, 'height': 1080}
+        if kind == 'photo':
+            message['photo'] = [file]
+        else:
+            message['video'] = {**file, 'duration': 10}
+        return message
+
+    def do_POST(self):
+        body = self._read_body()
+        method = urlparse(self.path).path.rsplit('/', 1)[-1]
+        if method == 'getMe':
+            self._json(200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}})
+            return
+        if self._simulate():
+            self._json(429, {
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            })
+            return
+
+        fields = self._form_fields(body)
+        chat_id = fields.get('chat_id', 0)
+        if method == 'sendMediaGroup':
+            result = [self._message(chat_id, item['type']) for item in json.loads(fields['media'])]
+        elif method in ('sendPhoto', 'sendVideo'):
+            result = self._message(chat_id, 'photo' if method == 'sendPhoto' else 'video')
+        elif method == 'editMessageCaption':
+            result = {**self._message(chat_id, 'photo'), 'message_id': int(fields['message_id']), 'caption': fields.get('caption')}
+        elif method == 'deleteMessages':
+            result = True
+        else:
+            self._json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+        self._json(200, {'ok': True, 'result': result})
+
+    do_GET = do_POST
+
+
+class CdnHandler(FakeHandler):
+    """Instagram media CDN: /media/<name>?size=<bytes>&kind=image|video."""
+
+    def do_GET(self):
+        if self._simulate():
+            self._reply(503, b'Simulated CDN failure', 'text/plain')
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        size = int(query.get('size', ['1024'])[0])
+        kind = query.get('kind', ['image'])[0]
+        # Unique bytes per URL, so the content-addressed store never dedupes them
+        head = MEDIA_MAGIC[kind] + url.path.encode()
+        body = head + b'\0' * max(0, size - len(head))
+        self._reply(200, body, 'image/jpeg' if kind == 'image' else 'video/mp4')
+
+
+def _serve(handler: type, port: int, latency_ms: float, error_rate: float) -> ThreadingHTTPServer:
+    configured = type(handler.__name__, (handler,), {'latency': latency_ms / 1000, 'error_rate': error_rate})
+    server = ThreadingHTTPServer(('127.0.0.1', port), configured)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_services(ports: dict[str, int], latency_ms: dict[str, float], error_rate: dict[str, float], ready=None):
+    """Serve the three stand-ins until the process is terminated."""
+    handlers = {'ghost': GhostHandler, 'telegram': TelegramHandler, 'cdn': CdnHandler}
+    for name, handler in handlers.items():
+        _serve(handler, ports[name], latency_ms.get(name, 0), error_rate.get(name, 0))
+    if ready is not None:
+        ready.set()
+    threading.Event().wait()
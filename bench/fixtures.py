@@ -0,0 +1,137 @@
+"""
+Instagram fixture source for the benchmark harness.
+
+Fixture posts stand in for instaloader.Post objects and are fed through the
+real Instagram.fetch_new_posts / download_post code (the two halves of
+download_new_posts); only the profile and post lookups are replaced, so the
+harness never reaches Instagram, and media URLs point at the local CDN
+stand-in.
+
+A fixture file is a JSON list of recorded posts:
+
+    [{"shortcode": "C1a2b3", "caption": "...", "timestamp": "2024-05-01T12:00:00",
+      "items": [{"kind": "image", "size": 350000}, {"kind": "video", "size": 4000000}]}]
+"""
+import json
+import random
+from datetime import datetime, timedelta
+
+import instaloader
+
+from instagram import Instagram
+
+
+class FixtureNode:
+    """A carousel item, as returned by Post.get_sidecar_nodes()."""
+
+    def __init__(self, is_video: bool, url: str):
+        self.is_video = is_video
+        self.display_url = url
+        self.video_url = url if is_video else None
+
+
+class FixturePost:
+    """The parts of instaloader.Post the watcher uses."""
+
+    def __init__(self, record: dict, cdn_url: str):
+        self.shortcode = record['shortcode']
+        self.caption = record.get('caption')
+        self.date_utc = datetime.fromisoformat(record['timestamp'])
+        self._nodes = [
+            FixtureNode(
+                item['kind'] == 'video',
+                f"{cdn_url}/media/{self.shortcode}-{index}?size={item['size']}&kind={item['kind']}",
+            )
+            for index, item in enumerate(record['items'], start=1)
+        ]
+        if len(self._nodes) > 1:
+            self.typename = 'GraphSidecar'
+        else:
+            self.typename = 'GraphVideo' if self._nodes[0].is_video else 'GraphImage'
+        self.is_video = self.typename == 'GraphVideo'
+        self.url = self._nodes[0].display_url
+        self.video_url = self._nodes[0].video_url
+
+    def get_sidecar_nodes(self):
+        return iter(self._nodes)
+
+    def _field(self, *keys):
+        # Only the carousel edges are read from the raw node
+        if keys == ('edge_sidecar_to_children', 'edges'):
+            return [{'node': {'is_video': node.is_video}} for node in self._nodes]
+        raise KeyError(keys)
+
+
+class FixtureFeed:
+    """The profile's post iterator, newest first."""
+
+    def __init__(self, posts: list[FixturePost], page_length: int = 12):
+        self._posts = posts
+        self._page_length = page_length
+        self.total_index = 0
+
+    def page_length(self) -> int:
+        return self._page_length
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> FixturePost:
+        if self.total_index >= len(self._posts):
+            raise StopIteration
+        post = self._posts[self.total_index]
+        self.total_index += 1
+        return post
+
+
+class FixtureProfile:
+    def __init__(self, posts: list[FixturePost]):
+        self._posts = posts
+
+    def get_posts(self) -> FixtureFeed:
+        return FixtureFeed(self._posts)
+
+
+class FixtureInstagram(Instagram):
+    """Instagram client whose feed is a list of fixture posts."""
+
+    def __init__(self, username: str, db, posts: list[FixturePost], downloader, **kwargs):
+        super().__init__(username, db, downloader=downloader, **kwargs)
+        self.fixture = sorted(posts, key=lambda post: post.date_utc, reverse=True)
+
+    def _get_profile(self):
+        return FixtureProfile(self.fixture)
+
+    def _lookup_post(self, shortcode: str) -> FixturePost:
+        for post in self.fixture:
+            if post.shortcode == shortcode:
+                return post
+        # What Instaloader raises for a deleted post
+        raise instaloader.BadResponseException("Fetching Post metadata failed.")
+
+
+def synthetic_records(username: str, count: int, items_per_post: int = 3, video_share: float = 0.2,
+                      image_kb: int = 300, video_kb: int = 3000, seed: int = 0) -> list[dict]:
+    """count recorded-looking posts for an account, with a fixed random seed."""
+    rng = random.Random(f'{username}:{seed}')
+    start = datetime(2024, 1, 1)
+    records = []
+    for index in range(count):
+        items = []
+        for _ in range(rng.randint(1, items_per_post * 2 - 1)):
+            kind = 'video' if rng.random() < video_share else 'image'
+            size_kb = image_kb if kind == 'image' else video_kb
+            items.append({'kind': kind, 'size': int(size_kb * 1024 * rng.uniform(0.5, 1.5))})
+        records.append({
+            'shortcode': f'{username}{index:05d}',
+            'caption': f'Post {index} di @{username} ' + 'lorem ipsum ' * rng.randint(0, 40),
+            'timestamp': (start + timedelta(hours=index)).isoformat(),
+            'items': items,
+        })
+    return records
+
+
+def load_records(path: str) -> list[dict]:
+    """Recorded posts from a fixture file."""
+    with open(path) as f:
+        return json.load(f)
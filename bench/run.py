@@ -0,0 +1,264 @@
+"""
+End-to-end benchmark of the watcher against local stand-ins for Instagram,
+Telegram and Ghost.
+
+N accounts with M fixture posts each are polled once through the real
+check_new_posts / outbox pipeline, and the outbox is then worked until
+every job is settled. Reports throughput, publish latency (post queued to
+job finished) and peak memory:
+
+    python bench/run.py --accounts 4 --posts 25
+    python bench/run.py --ghost-latency-ms 150 --ghost-error-rate 0.05 --json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import fakes  # noqa: E402
+
+SERVICES = ('cdn', 'telegram', 'ghost')
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=3, help="watched accounts (N)")
+    parser.add_argument('--posts', type=int, default=20, help="new posts per account (M)")
+    parser.add_argument('--fixture', help="JSON file of recorded posts, used for every account instead of synthetic ones")
+    parser.add_argument('--items-per-post', type=int, default=3, help="average media items per synthetic post")
+    parser.add_argument('--video-share', type=float, default=0.2, help="share of synthetic items that are videos")
+    parser.add_argument('--image-kb', type=int, default=300, help="average synthetic image size")
+    parser.add_argument('--video-kb', type=int, default=3000, help="average synthetic video size")
+    for service in SERVICES:
+        parser.add_argument(f'--{service}-latency-ms', type=float, default=20, help=f"{service} response latency")
+        parser.add_argument(f'--{service}-error-rate', type=float, default=0.0, help=f"share of failed {service} requests")
+    parser.add_argument('--telegram-spacing', type=float, default=0.0,
+                        help="seconds between messages to one chat (production uses 3; 0 measures the pipeline alone)")
+    parser.add_argument('--retry-backoff', type=int, default=1, help="outbox retry backoff in seconds")
+    parser.add_argument('--digest-threshold', type=int, default=0,
+                        help="publish an account's posts as digests when it has more new posts than this (0 disables)")
+    parser.add_argument('--timeout', type=float, default=900, help="give up on unsettled jobs after this many seconds")
+    parser.add_argument('--tracemalloc', action='store_true', help="also report the peak Python heap (slower)")
+    parser.add_argument('--profile', metavar='REPORT',
+                        help="poll the accounts one after the other under the cycle profiler and write its report to REPORT")
+    parser.add_argument('--profile-stacks', metavar='FILE', help="with --profile, also write collapsed stacks to FILE")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--verbose', action='store_true', help="keep the watcher's INFO logging")
+    args = parser.parse_args()
+    if args.profile and args.tracemalloc:
+        parser.error("--profile already traces allocations: drop --tracemalloc")
+    # The benchmark runs in a scratch directory
+    for name in ('profile', 'profile_stacks'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    return args
+
+
+def _configure_environment(args, ports: dict[str, int], workdir: Path, usernames: list[str]):
+    """Point the watcher's configuration at the stand-ins and a scratch directory."""
+    accounts_config = workdir / 'accounts.json'
+    # One channel per account, as in a multi-channel deployment
+    accounts_config.write_text(json.dumps({
+        username: {'channel_id': -1001000000000 - index, 'tags': ['bench']}
+        for index, username in enumerate(usernames)
+    }))
+    for name in ('INSTAGRAM_SESSION_USER', 'INSTAGRAM_SESSION_FILE', 'METRICS_PORT', 'IMAGE_FORMAT'):
+        os.environ.pop(name, None)
+    os.environ.update({
+        'BOT_TOKEN': '123456:bench',
+        'CHANNEL_ID': '-1001000000000',
+        'GHOST_URL': f"http://127.0.0.1:{ports['ghost']}",
+        'ADMIN_API_KEY': 'bench:' + '00' * 32,
+        'INSTAGRAM_PAGES': ','.join(usernames),
+        'ACCOUNTS_CONFIG': str(accounts_config),
+        'MEDIA_STORE_DIR': str(workdir / 'media_store'),
+        'OUTBOX_RETRY_BACKOFF_SECONDS': str(args.retry_backoff),
+        'DIGEST_THRESHOLD': str(args.digest_threshold),
+    })
+    # The database and download folders are relative to the working directory
+    os.chdir(workdir)
+
+
+async def _run(args, ports: dict[str, int], usernames: list[str]) -> dict:
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+    from fixtures import FixtureInstagram, FixturePost, load_records, synthetic_records
+
+    watcher = importlib.import_module('main')
+    watcher.init_services()
+    from metrics import STAGE_SECONDS
+    from profiling import CycleProfiler
+    if not args.verbose:
+        # Per-post INFO lines would drown the report
+        logging.disable(logging.INFO)
+    cdn_url = f"http://127.0.0.1:{ports['cdn']}"
+
+    # Feed every account its fixture posts; Instagram's own pacing is not measured
+    watcher.downloader.limiter = None
+    media_items = media_bytes = 0
+    for username in usernames:
+        if args.fixture:
+            records = [{**record, 'shortcode': f"{username}_{record['shortcode']}"} for record in load_records(args.fixture)]
+        else:
+            records = synthetic_records(username, args.posts, args.items_per_post, args.video_share, args.image_kb, args.video_kb)
+        media_items += sum(len(record['items']) for record in records)
+        media_bytes += sum(item['size'] for record in records for item in record['items'])
+        posts = [FixturePost(record, cdn_url) for record in records]
+        watcher.instagrams[username] = FixtureInstagram(username, watcher.db, posts, watcher.downloader)
+        # Everything in the fixture is newer than the high-water mark
+        watcher.db.update_high_water_mark(username, 'bench-seed', '2000-01-01T00:00:00')
+    for publisher in watcher.publishers:
+        if hasattr(publisher, 'sender'):
+            publisher.sender.seconds_per_message = args.telegram_spacing
+
+    # Publish latency: from the post entering the outbox to its job settling
+    queued_at, settled_at = {}, {}
+    given_up = set()
+    enqueue_job, finish_job, skip_posts = watcher.db.enqueue_job, watcher.db.finish_job, watcher.db.skip_posts
+
+    def timed_enqueue(shortcode, *a, **kw):
+        queued_at.setdefault(shortcode, time.perf_counter())
+        return enqueue_job(shortcode, *a, **kw)
+
+    def timed_finish(shortcode):
+        settled_at[shortcode] = time.perf_counter()
+        return finish_job(shortcode)
+
+    def counted_skip(shortcodes, username, reason):
+        shortcodes = list(shortcodes)
+        if reason == watcher.GIVEN_UP:
+            given_up.update(shortcodes)
+        return skip_posts(shortcodes, username, reason)
+
+    watcher.db.enqueue_job, watcher.db.finish_job, watcher.db.skip_posts = timed_enqueue, timed_finish, counted_skip
+
+    bot = Bot(
+        os.environ['BOT_TOKEN'],
+        base_url=f"http://127.0.0.1:{ports['telegram']}/bot",
+        request=HTTPXRequest(connection_pool_size=64),
+    )
+    await bot.initialize()
+    context = SimpleNamespace(bot=bot)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    # One poll per account, concurrently as the scheduler runs them, then
+    # keep working the outbox until every retry has settled
+    if args.profile:
+        profiler = CycleProfiler()
+        profiler.start()
+        for username in usernames:
+            await watcher.check_new_posts(context, username)
+        profiler.stop()
+        profiler.write_report(args.profile)
+        if args.profile_stacks:
+            profiler.write_stacks(args.profile_stacks)
+    else:
+        await asyncio.gather(*(watcher.check_new_posts(context, username) for username in usernames))
+    while watcher.db.get_jobs() and time.perf_counter() - started < args.timeout:
+        await asyncio.sleep(0.2)
+        await asyncio.gather(*(watcher.process_outbox(context, username) for username in usernames))
+    elapsed = time.perf_counter() - started
+    heap_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    tracemalloc.stop()
+
+    await bot.shutdown()
+    await watcher.close_services()
+
+    latencies = [settled_at[shortcode] - queued_at[shortcode] for shortcode in settled_at if shortcode in queued_at]
+    published = len(watcher.db.get_all_posts())
+    return {
+        'accounts': len(usernames),
+        'posts': len(queued_at),
+        'media_items': media_items,
+        'media_mb': round(media_bytes / (1024 * 1024), 1),
+        'published': published,
+        'given_up': len(given_up),
+        'unsettled': len(watcher.db.get_jobs()),
+        'seconds': round(elapsed, 2),
+        'posts_per_minute': round(len(settled_at) / elapsed * 60, 1) if elapsed else 0.0,
+        'latency_p50': round(_percentile(latencies, 50), 3),
+        'latency_p99': round(_percentile(latencies, 99), 3),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_heap_mb': round(heap_peak / (1024 * 1024), 1) if heap_peak is not None else None,
+        # Publishing requests, retries included
+        'telegram_requests': STAGE_SECONDS.count(stage='telegram_send'),
+        'ghost_requests': sum(
+            STAGE_SECONDS.count(stage=stage) for stage in ('ghost_upload_image', 'ghost_upload_media', 'ghost_post_create')
+        ),
+    }
+
+
+def _print_report(report: dict):
+    print(f"Benchmark: {report['accounts']} accounts x {report['posts'] // max(report['accounts'], 1)} posts "
+          f"({report['posts']} posts, {report['media_items']} media items, {report['media_mb']} MB)")
+    print(f"Settled:          {report['published']} published, {report['given_up']} given up, "
+          f"{report['unsettled']} unsettled in {report['seconds']} s")
+    print(f"Throughput:       {report['posts_per_minute']} posts/min")
+    print(f"Publish latency:  p50 {report['latency_p50']} s, p99 {report['latency_p99']} s")
+    print(f"Requests:         Telegram {report['telegram_requests']}, Ghost {report['ghost_requests']}")
+    heap = f", Python heap {report['peak_heap_mb']} MB" if report['peak_heap_mb'] is not None else ''
+    print(f"Peak memory:      RSS {report['peak_rss_mb']} MB{heap}")
+
+
+def main():
+    args = parse_args()
+    usernames = [f'bench_account_{index}' for index in range(args.accounts)]
+    ports = {service: _free_port() for service in SERVICES}
+    latency = {service: getattr(args, f'{service}_latency_ms') for service in SERVICES}
+    error_rate = {service: getattr(args, f'{service}_error_rate') for service in SERVICES}
+
+    # The stand-ins run in their own process, outside the measured memory and CPU
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    services = context.Process(target=fakes.run_services, args=(ports, latency, error_rate, ready), daemon=True)
+    services.start()
+    try:
+        if not ready.wait(30):
+            sys.exit("The stand-in services did not start")
+        with tempfile.TemporaryDirectory(prefix='igwatcher-bench-') as workdir:
+            cwd = os.getcwd()
+            _configure_environment(args, ports, Path(workdir), usernames)
+            try:
+                report = asyncio.run(_run(args, ports, usernames))
+            finally:
+                os.chdir(cwd)
+    finally:
+        services.terminate()
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        _print_report(report)
+    sys.exit(1 if report['unsettled'] else 0)
+
+
+if __name__ == '__main__':
+    main()
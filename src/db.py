@@ -1,77 +1,665 @@
+import json
+import re
 import sqlite3
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable
+
+# Default outbox stages, in the order they run for every post. The stages
+# between 'downloaded' and 'cleanup' are the publishers, one per destination.
+JOB_STAGES = ('fetched', 'downloaded', 'telegram', 'ghost', 'cleanup')
 
 class Database:
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # A single connection is shared by the event loop and the executor
+        # threads, so every access goes through this lock.
+        self._lock = threading.RLock()
+        self.conn = self._connect()
         self.init_database()
 
+    def _connect(self) -> sqlite3.Connection:
+        """Open the long-lived connection and apply the connection pragmas."""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=128,
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def close(self):
+        """Close the underlying connection."""
+        with self._lock:
+            self.conn.close()
+
     def init_database(self):
         """Initialize the database and create the posts table if it doesn't exist."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS posts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                shortcode TEXT UNIQUE NOT NULL,
-                publication_date TEXT NOT NULL,
-                description TEXT
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        with self._lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    shortcode TEXT UNIQUE NOT NULL,
+                    publication_date TEXT NOT NULL,
+                    description TEXT
+                )
+            ''')
+            # Older databases predate multi-account support
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(posts)')}
+            if 'username' not in columns:
+                self.conn.execute('ALTER TABLE posts ADD COLUMN username TEXT')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_posts_username ON posts (username, publication_date)')
+            # Keyset pagination of the archive, newest first
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_posts_publication_date ON posts (publication_date, id)')
+            # Full-text index of the captions. It stores no copy of the text
+            # (external content) and triggers keep it in sync with posts.
+            fts_exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'"
+            ).fetchone()
+            self.conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+                    description,
+                    content = 'posts',
+                    content_rowid = 'id',
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+                    INSERT INTO posts_fts (rowid, description) VALUES (new.id, new.description);
+                END
+            ''')
+            self.conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+                    INSERT INTO posts_fts (posts_fts, rowid, description) VALUES ('delete', old.id, old.description);
+                END
+            ''')
+            self.conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF description ON posts BEGIN
+                    INSERT INTO posts_fts (posts_fts, rowid, description) VALUES ('delete', old.id, old.description);
+                    INSERT INTO posts_fts (rowid, description) VALUES (new.id, new.description);
+                END
+            ''')
+            if not fts_exists:
+                # Index the captions stored before the index existed
+                self.conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+            # Outbox: one job per post, with the state of each stage kept
+            # separately so a retry resumes where the previous attempt stopped
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    shortcode TEXT PRIMARY KEY,
+                    username TEXT,
+                    description TEXT,
+                    timestamp TEXT,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+            # Jobs sharing a digest id are published together as one digest
+            job_columns = {row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+            if 'digest' not in job_columns:
+                self.conn.execute('ALTER TABLE jobs ADD COLUMN digest TEXT')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_stages (
+                    shortcode TEXT NOT NULL REFERENCES jobs(shortcode) ON DELETE CASCADE,
+                    stage TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at TEXT,
+                    last_error TEXT,
+                    result TEXT,
+                    PRIMARY KEY (shortcode, stage)
+                )
+            ''')
+            # Content-addressed media store: one row per blob, keyed by its
+            # SHA-256, with the remote copies it has already been uploaded to
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    ext TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored INTEGER NOT NULL DEFAULT 1,
+                    ghost_url TEXT,
+                    telegram_file_id TEXT,
+                    last_used TEXT NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_lru ON blobs (stored, last_used)')
+            # Instagram rate limiter buckets and circuit breaker, kept across restarts
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL,
+                    updated_at REAL,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    open_until REAL NOT NULL DEFAULT 0,
+                    trips INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            # Resolved Instagram profile metadata, so polls can skip the lookup
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS profiles (
+                    username TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    profile_pic_url TEXT,
+                    mediacount INTEGER,
+                    fetched_at TEXT NOT NULL
+                )
+            ''')
+            # Per-account high-water mark: the newest post that has been handled
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS accounts (
+                    username TEXT PRIMARY KEY,
+                    last_shortcode TEXT,
+                    last_timestamp TEXT,
+                    last_checked TEXT
+                )
+            ''')
+            # Where each published post lives at every destination, and the
+            # hash of its caption and media list when it was last synced, so
+            # edits and deletions on Instagram can be pushed there
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS publications (
+                    shortcode TEXT PRIMARY KEY,
+                    username TEXT,
+                    timestamp TEXT,
+                    content_hash TEXT NOT NULL,
+                    media TEXT NOT NULL,
+                    refs TEXT NOT NULL,
+                    synced_at TEXT NOT NULL,
+                    deleted_at TEXT
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_publications_username ON publications (username, timestamp)')
+            # Historical backfill of an account: the frozen feed iterator to
+            # resume from and how many posts have been scanned so far
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS backfills (
+                    username TEXT PRIMARY KEY,
+                    cursor TEXT,
+                    scanned INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT NOT NULL,
+                    finished_at TEXT
+                )
+            ''')
+            # Posts that are handled but not published from here (queued by
+            # another node, for one): never queued again, never listed
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS skipped_posts (
+                    shortcode TEXT PRIMARY KEY,
+                    username TEXT,
+                    reason TEXT NOT NULL,
+                    skipped_at TEXT NOT NULL
+                )
+            ''')
 
-    def insert_post(self, shortcode: str, description: str = None) -> bool:
+    def insert_post(self, shortcode: str, description: str = None, username: str = None) -> bool:
         """Insert a new post into the database."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             publication_date = datetime.now().isoformat()
-            cursor.execute('''
-                INSERT INTO posts (shortcode, publication_date, description)
-                VALUES (?, ?, ?)
-            ''', (shortcode, publication_date, description))
-            
-            conn.commit()
-            conn.close()
+            with self._lock, self.conn:
+                self.conn.execute('''
+                    INSERT INTO posts (shortcode, publication_date, description, username)
+                    VALUES (?, ?, ?, ?)
+                ''', (shortcode, publication_date, description, username))
             return True
         except sqlite3.IntegrityError:
             return False
 
+    def insert_posts(self, posts: Iterable[tuple[str, str | None, str | None]], username: str = None) -> int:
+        """Insert many (shortcode, description, publication_date) rows in a single transaction.
+
+        A missing publication date means now. Shortcodes that are already
+        stored are skipped. Returns the number of rows actually inserted.
+        """
+        now = datetime.now().isoformat()
+        rows = [
+            (shortcode, publication_date or now, description, username)
+            for shortcode, description, publication_date in posts
+        ]
+        if not rows:
+            return 0
+
+        # The cursor's rowcount leaves out the rows the FTS triggers write,
+        # which total_changes would count too
+        with self._lock, self.conn:
+            cursor = self.conn.executemany('''
+                INSERT OR IGNORE INTO posts (shortcode, publication_date, description, username)
+                VALUES (?, ?, ?, ?)
+            ''', rows)
+            return cursor.rowcount
+
     def post_exists(self, shortcode: str) -> bool:
         """Check if a post with the given shortcode already exists."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT 1 FROM posts WHERE shortcode = ?', (shortcode,))
-        result = cursor.fetchone()
-        conn.close()
-        
+        with self._lock:
+            result = self.conn.execute(
+                'SELECT 1 FROM posts WHERE shortcode = ?', (shortcode,)
+            ).fetchone()
+
         return result is not None
 
+    def existing_shortcodes(self, shortcodes: Iterable[str]) -> set[str]:
+        """Return the subset of the given shortcodes that are already stored, queued or skipped.
+
+        The whole batch is checked with one query, so a page of posts costs a
+        single round-trip instead of one lookup per post.
+        """
+        shortcodes = list(shortcodes)
+        if not shortcodes:
+            return set()
+
+        # Binding the batch as one JSON array keeps the SQL text constant, so
+        # the statement cache can reuse the prepared statement.
+        with self._lock:
+            rows = self.conn.execute(
+                '''
+                SELECT shortcode FROM posts WHERE shortcode IN (SELECT value FROM json_each(?1))
+                UNION
+                SELECT shortcode FROM jobs WHERE shortcode IN (SELECT value FROM json_each(?1))
+                UNION
+                SELECT shortcode FROM skipped_posts WHERE shortcode IN (SELECT value FROM json_each(?1))
+                ''',
+                (json.dumps(shortcodes),),
+            ).fetchall()
+
+        return {row[0] for row in rows}
+
+    def skip_posts(self, shortcodes: Iterable[str], username: str, reason: str) -> None:
+        """Record posts that must not be queued again, although they are not published from here."""
+        now = datetime.now().isoformat()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO skipped_posts (shortcode, username, reason, skipped_at) VALUES (?, ?, ?, ?)',
+                [(shortcode, username, reason, now) for shortcode in shortcodes],
+            )
+
     def delete_post(self, shortcode: str) -> bool:
         """Delete a post by shortcode."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM posts WHERE shortcode = ?', (shortcode,))
-        conn.commit()
-        
-        deleted = cursor.rowcount > 0
-        conn.close()
-        
+        with self._lock, self.conn:
+            cursor = self.conn.execute('DELETE FROM posts WHERE shortcode = ?', (shortcode,))
+            deleted = cursor.rowcount > 0
+
         return deleted
 
     def get_all_posts(self):
         """Retrieve all posts from the database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT shortcode, publication_date, description FROM posts')
-        posts = cursor.fetchall()
-        conn.close()
-        
-        return posts
\ No newline at end of file
+        with self._lock:
+            posts = self.conn.execute(
+                'SELECT shortcode, publication_date, description FROM posts'
+            ).fetchall()
+
+        return posts
+
+    def get_posts_page(self, limit: int = 10, cursor: int = None, newer: bool = False):
+        """One page of posts, newest first, as (id, shortcode, publication_date, description) rows.
+
+        Pages are keyed by (publication_date, id) rather than by offset, so
+        every page is a bounded index range scan however deep it is. cursor
+        is the id of the last post of the page before (or, with newer=True,
+        the first post of the page after). Returns (rows, has_newer, has_older).
+        """
+        if cursor is None:
+            where, params = '', ()
+        else:
+            op = '>' if newer else '<'
+            where = f'WHERE (publication_date, id) {op} (SELECT publication_date, id FROM posts WHERE id = ?)'
+            params = (cursor,)
+        order = 'ASC' if newer else 'DESC'
+
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT id, shortcode, publication_date, description FROM posts {where} '
+                f'ORDER BY publication_date {order}, id {order} LIMIT ?',
+                (*params, limit + 1),
+            ).fetchall()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if newer:
+            rows.reverse()
+            return rows, more, True
+        return rows, cursor is not None, more
+
+    def search(self, query: str, limit: int = 10, offset: int = 0):
+        """Posts whose caption matches every word of query, best match first.
+
+        Returns (shortcode, publication_date, snippet) rows, ranked by bm25;
+        the snippet is the matching part of the caption with the words
+        marked. The words are matched as whole tokens (accents and case are
+        ignored), the last one also as a prefix; FTS5 query syntax in query is
+        not interpreted.
+        """
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+        match = ' '.join(f'"{word}"' for word in words) + '*'
+
+        with self._lock:
+            return self.conn.execute('''
+                SELECT posts.shortcode, posts.publication_date,
+                       snippet(posts_fts, 0, '«', '»', '…', 12)
+                FROM posts_fts JOIN posts ON posts.id = posts_fts.rowid
+                WHERE posts_fts MATCH ?
+                ORDER BY bm25(posts_fts)
+                LIMIT ? OFFSET ?
+            ''', (match, limit, offset)).fetchall()
+
+    def recent_publication_dates(self, username: str, limit: int = 20) -> list[datetime]:
+        """Publication dates of the account's most recent posts, newest first."""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT publication_date FROM posts WHERE username = ? ORDER BY publication_date DESC LIMIT ?',
+                (username, limit),
+            ).fetchall()
+        return [datetime.fromisoformat(row[0]) for row in rows]
+
+    def get_high_water_mark(self, username: str):
+        """Return (last_shortcode, last_timestamp, last_checked) for an account, or None."""
+        with self._lock:
+            return self.conn.execute(
+                'SELECT last_shortcode, last_timestamp, last_checked FROM accounts WHERE username = ?',
+                (username,),
+            ).fetchone()
+
+    def update_high_water_mark(self, username: str, shortcode: str, timestamp: str) -> bool:
+        """Move the account's high-water mark forward; older timestamps are ignored."""
+        with self._lock, self.conn:
+            cursor = self.conn.execute('''
+                INSERT INTO accounts (username, last_shortcode, last_timestamp)
+                VALUES (?, ?, ?)
+                ON CONFLICT(username) DO UPDATE SET
+                    last_shortcode = excluded.last_shortcode,
+                    last_timestamp = excluded.last_timestamp
+                WHERE accounts.last_timestamp IS NULL OR excluded.last_timestamp > accounts.last_timestamp
+            ''', (username, shortcode, timestamp))
+            return cursor.rowcount > 0
+
+    def touch_account(self, username: str):
+        """Record that the account has just been checked."""
+        with self._lock, self.conn:
+            self.conn.execute('''
+                INSERT INTO accounts (username, last_checked) VALUES (?, ?)
+                ON CONFLICT(username) DO UPDATE SET last_checked = excluded.last_checked
+            ''', (username, datetime.now().isoformat()))
+
+    def save_publication(self, shortcode: str, username: str, timestamp: str, content_hash: str, media: list[dict], refs: dict[str, dict]):
+        """Record where a post has been published (refs: publisher name -> its stage result)."""
+        with self._lock, self.conn:
+            self.conn.execute('''
+                INSERT OR REPLACE INTO publications (shortcode, username, timestamp, content_hash, media, refs, synced_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (shortcode, username, timestamp, content_hash, json.dumps(media), json.dumps(refs), datetime.now().isoformat()))
+
+    def get_publications(self, username: str, since: str | None, shortcodes: Iterable[str] = ()) -> list[dict]:
+        """
+        The account's live publications whose post is newer than since (all of
+        them if since is None) or is one of shortcodes, with the caption
+        stored for the post.
+        """
+        with self._lock:
+            rows = self.conn.execute('''
+                SELECT publications.shortcode, publications.timestamp, content_hash, media, refs, posts.description
+                FROM publications LEFT JOIN posts ON posts.shortcode = publications.shortcode
+                WHERE publications.username = ?1 AND deleted_at IS NULL
+                  AND (?2 IS NULL OR publications.timestamp >= ?2
+                       OR publications.shortcode IN (SELECT value FROM json_each(?3)))
+            ''', (username, since, json.dumps(list(shortcodes)))).fetchall()
+        return [
+            {
+                'shortcode': shortcode,
+                'timestamp': timestamp,
+                'content_hash': content_hash,
+                'media': json.loads(media),
+                'refs': json.loads(refs),
+                'description': description,
+            }
+            for shortcode, timestamp, content_hash, media, refs, description in rows
+        ]
+
+    def update_publication(self, shortcode: str, content_hash: str, media: list[dict], refs: dict[str, dict], description: str = None):
+        """Store the synced state of a publication, and the post's new caption."""
+        with self._lock, self.conn:
+            self.conn.execute('''
+                UPDATE publications SET content_hash = ?, media = ?, refs = ?, synced_at = ? WHERE shortcode = ?
+            ''', (content_hash, json.dumps(media), json.dumps(refs), datetime.now().isoformat(), shortcode))
+            # The full-text index follows through its update trigger
+            self.conn.execute(
+                'UPDATE posts SET description = ? WHERE shortcode = ? AND description IS NOT ?',
+                (description, shortcode, description),
+            )
+
+    def mark_publication_deleted(self, shortcode: str):
+        """Record that a post was removed from Instagram and from its destinations."""
+        with self._lock, self.conn:
+            self.conn.execute(
+                'UPDATE publications SET deleted_at = ? WHERE shortcode = ?',
+                (datetime.now().isoformat(), shortcode),
+            )
+
+    def get_backfill(self, username: str):
+        """Return (cursor, scanned, finished_at) of the account's backfill, or None."""
+        with self._lock:
+            return self.conn.execute(
+                'SELECT cursor, scanned, finished_at FROM backfills WHERE username = ?',
+                (username,),
+            ).fetchone()
+
+    def save_backfill(self, username: str, cursor: str | None, scanned: int, finished: bool = False):
+        """Record the progress of an account's backfill; a finished backfill keeps no cursor."""
+        now = datetime.now().isoformat()
+        with self._lock, self.conn:
+            self.conn.execute('''
+                INSERT INTO backfills (username, cursor, scanned, updated_at, finished_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(username) DO UPDATE SET
+                    cursor = excluded.cursor,
+                    scanned = excluded.scanned,
+                    updated_at = excluded.updated_at,
+                    finished_at = excluded.finished_at
+            ''', (username, None if finished else cursor, scanned, now, now if finished else None))
+
+    def enqueue_job(self, shortcode: str, username: str, description: str = None, timestamp: str = None, done_stages: Iterable[str] = ('fetched',), stages: Iterable[str] = JOB_STAGES, results: dict[str, dict] = None, digest: str = None) -> bool:
+        """Add a post to the outbox. Returns False if it is already queued.
+
+        results may hold the result of stages that are already done. Posts
+        queued with the same digest id are published together.
+        """
+        done_stages = set(done_stages)
+        results = results or {}
+        with self._lock, self.conn:
+            cursor = self.conn.execute('''
+                INSERT OR IGNORE INTO jobs (shortcode, username, description, timestamp, created_at, digest)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (shortcode, username, description, timestamp, datetime.now().isoformat(), digest))
+            if cursor.rowcount == 0:
+                return False
+            self.conn.executemany(
+                'INSERT INTO job_stages (shortcode, stage, status, result) VALUES (?, ?, ?, ?)',
+                [
+                    (
+                        shortcode, stage, 'done' if stage in done_stages else 'pending',
+                        json.dumps(results[stage]) if stage in results else None,
+                    )
+                    for stage in stages
+                ],
+            )
+        return True
+
+    def get_jobs(self, username: str = None) -> list[dict]:
+        """Return the queued jobs (of one account, or all), oldest post first, with the state of each stage."""
+        with self._lock:
+            jobs = self.conn.execute('''
+                SELECT shortcode, username, description, timestamp, digest FROM jobs
+                WHERE ?1 IS NULL OR username = ?1
+                ORDER BY timestamp, created_at
+            ''', (username,)).fetchall()
+            stages = self.conn.execute('''
+                SELECT job_stages.shortcode, stage, status, attempts, next_attempt_at, last_error, result
+                FROM job_stages JOIN jobs ON jobs.shortcode = job_stages.shortcode
+                WHERE ?1 IS NULL OR jobs.username = ?1
+            ''', (username,)).fetchall()
+
+        result = {
+            shortcode: {
+                'shortcode': shortcode,
+                'username': username,
+                'description': description,
+                'timestamp': timestamp,
+                'digest': digest,
+                'stages': {},
+            }
+            for shortcode, username, description, timestamp, digest in jobs
+        }
+        for shortcode, stage, status, attempts, next_attempt_at, last_error, stage_result in stages:
+            if shortcode in result:
+                result[shortcode]['stages'][stage] = {
+                    'status': status,
+                    'attempts': attempts,
+                    'next_attempt_at': next_attempt_at,
+                    'last_error': last_error,
+                    'result': json.loads(stage_result) if stage_result else None,
+                }
+        return list(result.values())
+
+    def complete_stage(self, shortcode: str, stage: str, result=None):
+        """Mark a job stage as done, storing its (JSON-serialisable) result."""
+        with self._lock, self.conn:
+            # Upsert: a stage added after the job was queued has no row yet
+            self.conn.execute('''
+                INSERT INTO job_stages (shortcode, stage, status, result) VALUES (?, ?, 'done', ?)
+                ON CONFLICT(shortcode, stage) DO UPDATE SET
+                    status = 'done', last_error = NULL, next_attempt_at = NULL, result = excluded.result
+            ''', (shortcode, stage, json.dumps(result) if result is not None else None))
+
+    def fail_stage(self, shortcode: str, stage: str, error: str, max_attempts: int, backoff_seconds: float, result=None) -> str:
+        """
+        Record a failed attempt of a job stage and schedule the next one with
+        exponential backoff. After max_attempts the stage is given up on.
+        A partial result (e.g. media already uploaded) is kept for the retry.
+        Returns the new status of the stage.
+        """
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                'SELECT attempts FROM job_stages WHERE shortcode = ? AND stage = ?',
+                (shortcode, stage),
+            ).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            status = 'failed' if attempts >= max_attempts else 'pending'
+            next_attempt_at = (datetime.now() + timedelta(seconds=backoff_seconds * 2 ** (attempts - 1))).isoformat()
+            self.conn.execute('''
+                INSERT INTO job_stages (shortcode, stage, status, attempts, next_attempt_at, last_error, result)
+                VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7)
+                ON CONFLICT(shortcode, stage) DO UPDATE SET
+                    status = ?3, attempts = ?4, next_attempt_at = ?5, last_error = ?6,
+                    result = COALESCE(?7, result)
+            ''', (shortcode, stage, status, attempts, next_attempt_at, error,
+                  json.dumps(result) if result is not None else None))
+        return status
+
+    def finish_job(self, shortcode: str):
+        """Remove a job whose stages have all completed (or been given up on)."""
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM jobs WHERE shortcode = ?', (shortcode,))
+
+    def get_blob(self, sha256: str):
+        """Return (ext, size, stored, ghost_url, telegram_file_id) for a blob, or None."""
+        with self._lock:
+            return self.conn.execute(
+                'SELECT ext, size, stored, ghost_url, telegram_file_id FROM blobs WHERE sha256 = ?',
+                (sha256,),
+            ).fetchone()
+
+    def put_blob(self, sha256: str, ext: str, size: int):
+        """Record that a blob is stored locally, refreshing its last use."""
+        with self._lock, self.conn:
+            self.conn.execute('''
+                INSERT INTO blobs (sha256, ext, size, stored, last_used) VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT(sha256) DO UPDATE SET
+                    ext = excluded.ext, size = excluded.size, stored = 1, last_used = excluded.last_used
+            ''', (sha256, ext, size, datetime.now().isoformat()))
+
+    def touch_blobs(self, sha256s: Iterable[str]):
+        """Refresh the last use of the given blobs."""
+        now = datetime.now().isoformat()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'UPDATE blobs SET last_used = ? WHERE sha256 = ?',
+                [(now, sha256) for sha256 in sha256s],
+            )
+
+    def set_blob_ghost_url(self, sha256: str, url: str):
+        """Remember the Ghost URL a blob was uploaded to."""
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE blobs SET ghost_url = ? WHERE sha256 = ?', (url, sha256))
+
+    def set_blob_telegram_file_id(self, sha256: str, file_id: str):
+        """Remember the Telegram file_id a blob was sent as."""
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE blobs SET telegram_file_id = ? WHERE sha256 = ?', (file_id, sha256))
+
+    def stored_blobs_size(self) -> int:
+        """Total size in bytes of the blobs currently kept on disk."""
+        with self._lock:
+            return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs WHERE stored = 1').fetchone()[0]
+
+    def queued_blobs(self, exclude: str = None) -> set[str]:
+        """SHA-256 of the media downloaded for the queued jobs (other than exclude), in one query."""
+        with self._lock:
+            rows = self.conn.execute('''
+                SELECT DISTINCT json_extract(media.value, '$.sha256')
+                FROM job_stages, json_each(job_stages.result, '$.media') AS media
+                WHERE job_stages.stage = 'downloaded' AND job_stages.result IS NOT NULL
+                  AND job_stages.shortcode IS NOT ?
+            ''', (exclude,)).fetchall()
+        return {row[0] for row in rows}
+
+    def stored_blobs_lru(self):
+        """Return (sha256, ext, size) of the blobs on disk, least recently used first."""
+        with self._lock:
+            return self.conn.execute(
+                'SELECT sha256, ext, size FROM blobs WHERE stored = 1 ORDER BY last_used'
+            ).fetchall()
+
+    def unstore_blob(self, sha256: str):
+        """Mark a blob as evicted from disk; its remote URLs stay known."""
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE blobs SET stored = 0 WHERE sha256 = ?', (sha256,))
+
+    def get_rate_limit_state(self) -> dict[str, tuple]:
+        """Return key -> (tokens, updated_at, failures, open_until, trips) for the rate limiter."""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT key, tokens, updated_at, failures, open_until, trips FROM rate_limits'
+            ).fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def save_rate_limit_state(self, state: dict[str, tuple]):
+        """Store the rate limiter state, as returned by get_rate_limit_state."""
+        with self._lock, self.conn:
+            self.conn.executemany('''
+                INSERT INTO rate_limits (key, tokens, updated_at, failures, open_until, trips)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    tokens = excluded.tokens, updated_at = excluded.updated_at, failures = excluded.failures,
+                    open_until = excluded.open_until, trips = excluded.trips
+            ''', [(key, *values) for key, values in state.items()])
+
+    def get_cached_profile(self, username: str, ttl_seconds: float):
+        """Return (user_id, profile_pic_url, mediacount) if cached less than ttl_seconds ago, else None."""
+        oldest = (datetime.now() - timedelta(seconds=ttl_seconds)).isoformat()
+        with self._lock:
+            return self.conn.execute('''
+                SELECT user_id, profile_pic_url, mediacount FROM profiles
+                WHERE username = ? AND fetched_at >= ?
+            ''', (username, oldest)).fetchone()
+
+    def cache_profile(self, username: str, user_id: int, profile_pic_url: str = None, mediacount: int = None):
+        """Store freshly resolved profile metadata."""
+        with self._lock, self.conn:
+            self.conn.execute('''
+                INSERT OR REPLACE INTO profiles (username, user_id, profile_pic_url, mediacount, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (username, user_id, profile_pic_url, mediacount, datetime.now().isoformat()))
@@ -0,0 +1,86 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import instaloader
+import requests
+
+from metrics import TRANSFERRED_BYTES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Size of the pieces media files are written to disk in
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+
+def post_media_items(post: instaloader.Post) -> list[tuple[str, str]]:
+    """
+    The (file name, URL) of every media item of a post, in carousel order.
+
+    Videos are fetched as the video only; the thumbnail Instaloader would
+    also save is not published anywhere.
+    """
+    if post.typename == 'GraphSidecar':
+        nodes = [(node.is_video, node.video_url if node.is_video else node.display_url)
+                 for node in post.get_sidecar_nodes()]
+    elif post.is_video:
+        nodes = [(True, post.video_url)]
+    else:
+        nodes = [(False, post.url)]
+
+    return [
+        (f"{index:02d}{'.mp4' if is_video else '.jpg'}", url)
+        for index, (is_video, url) in enumerate(nodes, start=1)
+    ]
+
+
+class MediaDownloader:
+    """
+    Downloads the items of a post concurrently on a dedicated, bounded pool.
+
+    Each file is written to a temporary name and renamed into place once it
+    is complete, so a crash never leaves a truncated file that a retry would
+    mistake for a finished one; files already on disk are skipped.
+    """
+
+    def __init__(self, max_workers: int = 4, limiter=None, user_agent: str = None):
+        self.limiter = limiter
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='media-download')
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent or instaloader.instaloadercontext.default_user_agent()
+
+    def _fetch(self, url: str, target: Path):
+        """Stream one URL to target through a temporary file."""
+        partial = target.with_name(target.name + '.part')
+        with self.session.get(url, stream=True, timeout=120) as response:
+            response.raise_for_status()
+            with open(partial, 'wb') as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(partial, target)
+        TRANSFERRED_BYTES.inc(target.stat().st_size, destination='instagram')
+
+    def _download_item(self, url: str, target: Path) -> Path:
+        if target.exists():
+            return target
+        # An earlier attempt may also have re-encoded it under another extension
+        for done in target.parent.glob(f'{target.stem}.*'):
+            if done.suffix != '.part':
+                return done
+        if self.limiter is not None:
+            self.limiter.call('media', self._fetch, url, target)
+        else:
+            self._fetch(url, target)
+        return target
+
+    def download(self, items: list[tuple[str, str]], folder: Path) -> list[Path]:
+        """Download (file name, URL) items into folder in parallel; returns the paths in order."""
+        folder.mkdir(parents=True, exist_ok=True)
+        futures = [self.pool.submit(self._download_item, url, folder / name) for name, url in items]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        """Stop the download pool."""
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -1,20 +1,145 @@
+import asyncio
+import secrets
 import jwt
+import httpx
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import time
 import logging
 from pathlib import Path
-from instagram import Instagram
-from db import Database
+from metrics import RETRIES, STAGE_SECONDS, TRANSFERRED_BYTES
 import json
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class GhostAPI:
-    def __init__(self, base_url, admin_api_key):
+# Ghost admin tokens are valid for 5 minutes; refresh them a minute early so a
+# request never goes out with a token that expires in flight.
+TOKEN_LIFETIME = 5 * 60
+TOKEN_REFRESH_MARGIN = 60
+
+IMAGE_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp'
+}
+
+# Leading bytes of the image formats Ghost accepts, and their MIME type
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+# Size of the pieces uploads are streamed in
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+MEDIA_MIME_TYPES = {
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+    '.ogg': 'video/ogg'
+}
+
+
+def image_mime_type(path) -> str:
+    """MIME type of an image from its content, falling back to the file extension."""
+    path = Path(path)
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    # WebP is a RIFF container: 'RIFF', 4 size bytes, then 'WEBP'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    return IMAGE_MIME_TYPES.get(path.suffix.lower(), 'image/jpeg')
+
+
+class MultipartFileBody:
+    """
+    multipart/form-data body for a single file, streamed from disk.
+
+    The body is produced in fixed-size chunks, so an upload never holds more
+    than chunk_size bytes of the file in memory, whatever the file size. The
+    exact length is known up front and sent as Content-Length. It can be
+    iterated synchronously (requests) or asynchronously (httpx).
+    """
+
+    def __init__(self, path, mime_type: str, field: str = 'file', chunk_size: int = UPLOAD_CHUNK_SIZE, progress=None):
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.boundary = secrets.token_hex(16)
+        self.file_size = self.path.stat().st_size
+        self._head = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{self.path.name}"\r\n'
+            f'Content-Type: {mime_type}\r\n\r\n'
+        ).encode()
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode()
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self._head) + self.file_size + len(self._tail)
+
+    def _report(self, sent: int, started: float):
+        if self.progress:
+            self.progress(self.path, sent, self.file_size, time.monotonic() - started)
+
+    def _log_throughput(self, started: float):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        size_mb = self.file_size / (1024 * 1024)
+        logger.info(f"Streamed {self.path.name}: {size_mb:.2f} MB in {elapsed:.1f}s ({size_mb / elapsed:.2f} MB/s)")
+
+    def __iter__(self):
+        started = time.monotonic()
+        sent = 0
+        yield self._head
+        with open(self.path, 'rb') as f:
+            while chunk := f.read(self.chunk_size):
+                sent += len(chunk)
+                yield chunk
+                self._report(sent, started)
+        yield self._tail
+        self._log_throughput(started)
+
+    async def __aiter__(self):
+        started = time.monotonic()
+        sent = 0
+        yield self._head
+        with open(self.path, 'rb') as f:
+            # Disk reads happen off the event loop
+            while chunk := await asyncio.to_thread(f.read, self.chunk_size):
+                sent += len(chunk)
+                yield chunk
+                self._report(sent, started)
+        yield self._tail
+        self._log_throughput(started)
+
+
+class _GhostBase:
+    """Authentication and content helpers shared by the sync and async clients."""
+
+    def __init__(self, base_url, admin_api_key, max_concurrent_uploads: int = 4, upload_retries: int = 2, retry_backoff: float = 2.0):
         self.base_url = base_url.rstrip('/')
         self.key_id, self.key_secret = admin_api_key.split(':')
+        self._token = None
+        self._token_expires_at = 0
+        # How many media uploads of a post may run at once, and how often a
+        # single failed item is retried before it is left out of the post
+        self.max_concurrent_uploads = max(1, max_concurrent_uploads)
+        self.upload_retries = upload_retries
+        self.retry_backoff = retry_backoff
+        # Optional callback(path, bytes_sent, total_bytes, elapsed_seconds)
+        # invoked after every streamed chunk of an upload
+        self.on_upload_progress = None
     
     def _generate_token(self):
         """Generate JWT token for authentication"""
@@ -28,7 +153,7 @@ class GhostAPI:
         
         payload = {
             'iat': iat,
-            'exp': iat + 5 * 60,  # Token expires in 5 minutes
+            'exp': iat + TOKEN_LIFETIME,  # Token expires in 5 minutes
             'aud': '/admin/'
         }
         
@@ -40,20 +165,45 @@ class GhostAPI:
         )
         
         return token
+
+    def _get_token(self):
+        """Return the cached JWT, signing a new one shortly before it expires"""
+        now = time.time()
+        if self._token is None or now >= self._token_expires_at - TOKEN_REFRESH_MARGIN:
+            self._token = self._generate_token()
+            self._token_expires_at = now + TOKEN_LIFETIME
+        return self._token
     
     def _get_headers(self):
-        """Get headers with fresh JWT token"""
-        token = self._generate_token()
+        """Get headers with a valid JWT token"""
         return {
-            'Authorization': f'Ghost {token}',
+            'Authorization': f'Ghost {self._get_token()}',
             'Content-Type': 'application/json',
             'Accept-Version': 'v5.0'  # Ghost API version
         }
-    
-    def create_post(self, title: str, content: str = None, mobiledoc: dict = None, status: str = 'published', tags: list[str] | None = None, **kwargs):
-        """Create a post in Ghost"""
-        url = f'{self.base_url}/ghost/api/admin/posts/'
-        
+
+    def _get_upload_headers(self, body: MultipartFileBody):
+        """Get headers for a streamed multipart upload"""
+        return {
+            'Authorization': f'Ghost {self._get_token()}',
+            'Accept-Version': 'v5.0',
+            'Content-Type': body.content_type,
+            'Content-Length': str(len(body)),
+        }
+
+    def _collect_uploaded(self, kind: str, paths: list[str], results: list[str | None]) -> list[str]:
+        """Log the outcome of each upload and return the URLs of the successful ones, in order"""
+        urls = []
+        for path, url in zip(paths, results):
+            if url:
+                urls.append(url)
+                logger.info(f"✓ {kind.capitalize()} uploaded: {url}")
+            else:
+                logger.warning(f"✗ Failed to upload {kind}: {path}")
+        return urls
+
+    def _build_post_data(self, title: str, content: str = None, mobiledoc: dict = None, status: str = 'published', tags: list[str] | None = None, **kwargs):
+        """Build the JSON body for the posts endpoint"""
         tag_list = []
         if tags:
             for tag in tags:
@@ -76,9 +226,134 @@ class GhostAPI:
             post_data['posts'][0]['mobiledoc'] = json.dumps(mobiledoc)
         elif content:
             post_data['posts'][0]['html'] = content
+
+        return post_data
+
+    def _build_update_data(self, updated_at: str, mobiledoc: dict = None, title: str = None, status: str = None, **kwargs):
+        """Build the JSON body for a post update; fields left as None are not changed"""
+        post = {'updated_at': updated_at, **kwargs}
+        if title is not None:
+            post['title'] = title
+        if status is not None:
+            post['status'] = status
+        if mobiledoc is not None:
+            post['mobiledoc'] = json.dumps(mobiledoc)
+        return {'posts': [post]}
+
+    def _build_mobiledoc(self, description: str | None, image_urls: list[str], video_urls: list[str]) -> dict:
+        """Build the Mobiledoc document for a post with the given media"""
+        cards = []
+        
+        # Add description as markdown card
+        if description:
+            cards.append([
+                "markdown",
+                {
+                    "markdown": description
+                }
+            ])
+        
+        # Add images as image cards
+        for url in image_urls:
+            cards.append([
+                "image",
+                {
+                    "src": url,
+                    "alt": "",
+                    "cardWidth": "wide"
+                }
+            ])
+        
+        # Add videos as HTML cards (more compatibile per la resa)
+        for vurl in video_urls:
+            cards.append([
+                "html",
+                {
+                    "html": (
+                        '<figure class="kg-card kg-video-card kg-width-wide">'
+                        f'  <video controls preload="metadata" src="{vurl}" style="width:100%;height:auto;"></video>'
+                        '</figure>'
+                    )
+                }
+            ])
+        
+        return self._mobiledoc_from_cards(cards)
+
+    def _build_digest_mobiledoc(self, posts: list[tuple[str | None, list[str], list[str]]]) -> dict:
+        """Build one Mobiledoc document for several (description, image_urls, video_urls) posts, separated by dividers"""
+        cards = []
+        for index, (description, image_urls, video_urls) in enumerate(posts):
+            if index:
+                cards.append(["hr", {}])
+            cards += self._build_mobiledoc(description, image_urls, video_urls)["cards"]
+        return self._mobiledoc_from_cards(cards)
+
+    def _mobiledoc_from_cards(self, cards: list) -> dict:
+        """Create Mobiledoc structure, with one section referencing each card"""
+        return {
+            "version": "0.3.1",
+            "atoms": [],
+            "cards": cards,
+            "markups": [],
+            "sections": [[10, i] for i in range(len(cards))]
+        }
+
+
+class GhostAPI(_GhostBase):
+    def __init__(self, base_url, admin_api_key, **kwargs):
+        super().__init__(base_url, admin_api_key, **kwargs)
+        # Reuse keep-alive connections across requests
+        self.session = requests.Session()
+    
+    def _upload_with_retry(self, upload, path, uploaded: dict):
+        """Upload one item, retrying only that item with exponential backoff"""
+        if path in uploaded:
+            return uploaded[path]
+        for attempt in range(self.upload_retries + 1):
+            logger.info(f"Uploading {path}")
+            with STAGE_SECONDS.time(stage=f'ghost_{upload.__name__}'):
+                url = upload(path)
+            if url:
+                uploaded[path] = url
+                TRANSFERRED_BYTES.inc(Path(path).stat().st_size, destination='ghost')
+                return url
+            if attempt < self.upload_retries:
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning(f"Retrying upload of {path} in {delay:.1f}s ({attempt + 1}/{self.upload_retries})")
+                RETRIES.inc(destination='ghost')
+                time.sleep(delay)
+        return None
+
+    def upload_items(self, image_paths: list[str], video_paths: list[str], uploaded: dict[str, str]) -> tuple[list[str], list[str]]:
+        """Upload the media that is not in uploaded yet; returns the image and video URLs that made it, in order"""
+        logger.info(f"Uploading {len(image_paths)} images and {len(video_paths)} videos")
+
+        # Upload images and videos concurrently: every upload is submitted
+        # before any result is awaited, and results are read back in carousel order
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_uploads) as pool:
+            image_futures = [pool.submit(self._upload_with_retry, self.upload_image, p, uploaded) for p in image_paths]
+            video_futures = [pool.submit(self._upload_with_retry, self.upload_media, p, uploaded) for p in video_paths]
+            image_results = [future.result() for future in image_futures]
+            video_results = [future.result() for future in video_futures]
+
+        return (
+            self._collect_uploaded('image', image_paths, image_results),
+            self._collect_uploaded('video', video_paths, video_results),
+        )
+
+    def _media_mobiledoc(self, image_paths: list[str] | None, video_paths: list[str] | None, video_urls: list[str] | None, description: str | None, uploaded: dict[str, str] | None) -> dict:
+        """Upload the media that is not in uploaded yet and build the post's Mobiledoc"""
+        uploaded = uploaded if uploaded is not None else {}
+        image_urls, uploaded_video_urls = self.upload_items(image_paths or [], video_paths or [], uploaded)
+        return self._build_mobiledoc(description, image_urls, (video_urls or []) + uploaded_video_urls)
+
+    def create_post(self, title: str, content: str = None, mobiledoc: dict = None, status: str = 'published', tags: list[str] | None = None, **kwargs):
+        """Create a post in Ghost"""
+        url = f'{self.base_url}/ghost/api/admin/posts/'
+        post_data = self._build_post_data(title, content, mobiledoc, status, tags, **kwargs)
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=post_data,
                 headers=self._get_headers(),
@@ -97,32 +372,17 @@ class GhostAPI:
         """Upload an image"""
         url = f'{self.base_url}/ghost/api/admin/images/upload/'
         
-        token = self._generate_token()
-        headers = {
-            'Authorization': f'Ghost {token}',
-            'Accept-Version': 'v5.0'
-        }
-        
         try:
-            # Determine MIME type based on file extension
+            # The content decides the MIME type: preprocessing may have
+            # re-encoded the image into another format
             path = Path(image_path)
-            mime_types = {
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.png': 'image/png',
-                '.gif': 'image/gif',
-                '.webp': 'image/webp'
-            }
-            mime_type = mime_types.get(path.suffix.lower(), 'image/jpeg')
+            mime_type = image_mime_type(path)
             
-            with open(image_path, 'rb') as f:
-                files = {
-                    'file': (path.name, f, mime_type)
-                }
-                response = requests.post(url, files=files, headers=headers, timeout=120)
-                response.raise_for_status()
-                result = response.json()
-                return result['images'][0]['url']
+            body = MultipartFileBody(path, mime_type, progress=self.on_upload_progress)
+            response = self.session.post(url, data=body, headers=self._get_upload_headers(body), timeout=120)
+            response.raise_for_status()
+            result = response.json()
+            return result['images'][0]['url']
         except requests.exceptions.RequestException as e:
             logger.error(f"Error uploading image {image_path}: {e}")
             return None
@@ -133,30 +393,16 @@ class GhostAPI:
         """
         url = f'{self.base_url}/ghost/api/admin/media/upload/'
 
-        token = self._generate_token()
-        headers = {
-            'Authorization': f'Ghost {token}',
-            'Accept-Version': 'v5.0'
-        }
-
         try:
             # Determine MIME type based on file extension
             path = Path(media_path)
-            mime_types = {
-                '.mp4': 'video/mp4',
-                '.webm': 'video/webm',
-                '.ogg': 'video/ogg'
-            }
-            mime_type = mime_types.get(path.suffix.lower(), 'video/mp4')
+            mime_type = MEDIA_MIME_TYPES.get(path.suffix.lower(), 'video/mp4')
             
-            with open(media_path, 'rb') as f:
-                files = {
-                    'file': (path.name, f, mime_type)
-                }
-                resp = requests.post(url, files=files, headers=headers, timeout=120)
-                resp.raise_for_status()
-                data = resp.json()
-                return data['media'][0]['url']
+            body = MultipartFileBody(path, mime_type, progress=self.on_upload_progress)
+            resp = self.session.post(url, data=body, headers=self._get_upload_headers(body), timeout=120)
+            resp.raise_for_status()
+            data = resp.json()
+            return data['media'][0]['url']
         except requests.exceptions.RequestException as e:
             logger.error(f"Error uploading media {media_path}: {e}")
             if hasattr(e, 'response') and getattr(e.response, 'text', None):
@@ -172,6 +418,7 @@ class GhostAPI:
         description: str | None = None,
         status: str = 'published',
         tags: list[str] | None = None,
+        uploaded: dict[str, str] | None = None,
         **kwargs
     ):
         """
@@ -180,107 +427,400 @@ class GhostAPI:
         image_paths: local image file paths to upload to Ghost
         video_paths: local video file paths to upload via Admin Media API
         video_urls: externally hosted video URLs to embed
+        uploaded: path -> URL of files uploaded by an earlier attempt; they are
+            not uploaded again, and new uploads are added to it
         """
-        image_paths = image_paths or []
-        video_paths = video_paths or []
-        video_urls = video_urls or []
-
         logger.info(f"Creating Ghost post: {title}")
-        logger.info(f"Uploading {len(image_paths)} images and {len(video_paths)} videos")
+        mobiledoc = self._media_mobiledoc(image_paths, video_paths, video_urls, description, uploaded)
+
+        logger.info("Creating Ghost post...")
+        with STAGE_SECONDS.time(stage='ghost_post_create'):
+            ghost_post = self.create_post(
+                title=title,
+                mobiledoc=mobiledoc,
+                status=status,
+                tags=tags,
+                **kwargs
+            )
+        
+        if ghost_post:
+            logger.info(f"✓ Ghost post created: {ghost_post.get('title')} ({ghost_post.get('url')})")
+        else:
+            logger.error(f"✗ Failed to create Ghost post: {title}")
+        
+        return ghost_post
+
+    def create_digest_post(
+        self,
+        title: str,
+        posts: list[dict],
+        status: str = 'published',
+        tags: list[str] | None = None,
+        uploaded: dict[str, str] | None = None,
+        **kwargs
+    ):
+        """
+        Create one post that collects several posts, one after the other.
+
+        posts: dicts with the description, image_paths and video_paths of
+            each post, as the arguments of create_media_post
+        uploaded: as in create_media_post, shared by all the posts
+        """
+        uploaded = uploaded if uploaded is not None else {}
+        logger.info(f"Creating Ghost digest post: {title} ({len(posts)} posts)")
+
+        sections = []
+        for post in posts:
+            image_urls, video_urls = self.upload_items(post.get('image_paths') or [], post.get('video_paths') or [], uploaded)
+            sections.append((post.get('description'), image_urls, video_urls))
+
+        with STAGE_SECONDS.time(stage='ghost_post_create'):
+            ghost_post = self.create_post(title=title, mobiledoc=self._build_digest_mobiledoc(sections), status=status, tags=tags, **kwargs)
+
+        if ghost_post:
+            logger.info(f"✓ Ghost digest post created: {ghost_post.get('title')} ({ghost_post.get('url')})")
+        else:
+            logger.error(f"✗ Failed to create Ghost digest post: {title}")
+
+        return ghost_post
+
+    def get_post(self, post_id: str):
+        """Fetch a post's id, status and updated_at"""
+        url = f'{self.base_url}/ghost/api/admin/posts/{post_id}/'
+
+        try:
+            response = self.session.get(url, params={'fields': 'id,status,updated_at'}, headers=self._get_headers(), timeout=30)
+            response.raise_for_status()
+            result = response.json()
+            return result['posts'][0] if result.get('posts') else None
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error fetching post {post_id}: {e}")
+            return None
+
+    def update_post(self, post_id: str, updated_at: str = None, mobiledoc: dict = None, title: str = None, status: str = None, **kwargs):
+        """
+        Update a post in Ghost.
+
+        Ghost applies the update only if updated_at is the post's current
+        one. If the post has changed since (e.g. edited in the admin), its
+        current updated_at is fetched and the update is sent once more:
+        Instagram is the source of truth for the fields being updated.
+        """
+        url = f'{self.base_url}/ghost/api/admin/posts/{post_id}/'
+
+        for attempt in range(2):
+            if updated_at is None:
+                current = self.get_post(post_id)
+                if current is None:
+                    return None
+                updated_at = current['updated_at']
+            post_data = self._build_update_data(updated_at, mobiledoc, title, status, **kwargs)
+            try:
+                response = self.session.put(url, json=post_data, headers=self._get_headers(), timeout=30)
+                if response.status_code == 409 and attempt == 0:
+                    logger.warning(f"Ghost post {post_id} changed since it was last seen, updating its current version")
+                    updated_at = None
+                    continue
+                response.raise_for_status()
+                result = response.json()
+                return result['posts'][0] if result.get('posts') else None
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error updating post {post_id}: {e}")
+                if hasattr(e, 'response') and getattr(e.response, 'text', None):
+                    logger.error(f"Response: {e.response.text}")
+                return None
+        return None
+
+    def update_media_post(
+        self,
+        post_id: str,
+        updated_at: str = None,
+        image_paths: list[str] | None = None,
+        video_paths: list[str] | None = None,
+        description: str | None = None,
+        uploaded: dict[str, str] | None = None,
+        **kwargs
+    ):
+        """Replace the content of a post made by create_media_post; arguments as there"""
+        logger.info(f"Updating Ghost post {post_id}")
+        mobiledoc = self._media_mobiledoc(image_paths, video_paths, None, description, uploaded)
+        with STAGE_SECONDS.time(stage='ghost_post_update'):
+            return self.update_post(post_id, updated_at, mobiledoc=mobiledoc, **kwargs)
+
+
+class AsyncGhostAPI(_GhostBase):
+    """
+    Asyncio version of GhostAPI with the same methods.
+
+    All requests go through one pooled keep-alive httpx.AsyncClient, so
+    uploads never block the event loop the Telegram bot runs on.
+    """
+
+    def __init__(self, base_url, admin_api_key, max_connections: int = 10, **kwargs):
+        super().__init__(base_url, admin_api_key, **kwargs)
+        self.max_connections = max_connections
+        self._client: httpx.AsyncClient | None = None
 
-        # 1) Upload images
-        image_urls: list[str] = []
-        for path in image_paths:
-            logger.info(f"Uploading image: {path}")
-            url = self.upload_image(path)
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared HTTP client, created lazily inside the running event loop"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=httpx.Timeout(120, connect=30),
+            )
+        return self._client
+
+    async def aclose(self):
+        """Close the pooled HTTP client"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _upload_with_retry(self, upload, path, semaphore: asyncio.Semaphore, uploaded: dict):
+        """Upload one item, retrying only that item with exponential backoff"""
+        if path in uploaded:
+            return uploaded[path]
+        for attempt in range(self.upload_retries + 1):
+            async with semaphore:
+                logger.info(f"Uploading {path}")
+                with STAGE_SECONDS.time(stage=f'ghost_{upload.__name__}'):
+                    url = await upload(path)
             if url:
-                image_urls.append(url)
-                logger.info(f"✓ Image uploaded: {url}")
-            else:
-                logger.warning(f"✗ Failed to upload image: {path}")
-
-        # 2) Upload videos via media/upload and collect URLs
-        uploaded_video_urls: list[str] = []
-        for path in video_paths:
-            logger.info(f"Uploading video: {path}")
-            vurl = self.upload_media(path)
-            if vurl:
-                logger.info(vurl)
-                uploaded_video_urls.append(vurl)
-                logger.info(f"✓ Video uploaded: {vurl}")
-            else:
-                logger.warning(f"✗ Failed to upload video: {path}")
+                uploaded[path] = url
+                TRANSFERRED_BYTES.inc(Path(path).stat().st_size, destination='ghost')
+                return url
+            if attempt < self.upload_retries:
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning(f"Retrying upload of {path} in {delay:.1f}s ({attempt + 1}/{self.upload_retries})")
+                RETRIES.inc(destination='ghost')
+                await asyncio.sleep(delay)
+        return None
 
-        all_video_urls = video_urls + uploaded_video_urls
+    async def upload_items(self, image_paths: list[str], video_paths: list[str], uploaded: dict[str, str], semaphore: asyncio.Semaphore = None) -> tuple[list[str], list[str]]:
+        """Upload the media that is not in uploaded yet; returns the image and video URLs that made it, in order"""
+        logger.info(f"Uploading {len(image_paths)} images and {len(video_paths)} videos")
 
-        # 3) Build Mobiledoc content
-        cards = []
-        
-        # Add description as markdown card
-        if description:
-            cards.append([
-                "markdown",
-                {
-                    "markdown": description
-                }
-            ])
-        
-        # Add images as image cards
-        for url in image_urls:
-            cards.append([
-                "image",
-                {
-                    "src": url,
-                    "alt": "",
-                    "cardWidth": "wide"
-                }
-            ])
-        
-        # Add videos as HTML cards (more compatibile per la resa)
-        for vurl in all_video_urls:
-            cards.append([
-                "html",
-                {
-                    "html": (
-                        '<figure class="kg-card kg-video-card kg-width-wide">'
-                        f'  <video controls preload="metadata" src="{vurl}" style="width:100%;height:auto;"></video>'
-                        '</figure>'
-                    )
-                }
-            ])
-        
-        # Create Mobiledoc structure
-        mobiledoc = {
-            "version": "0.3.1",
-            "atoms": [],
-            "cards": cards,
-            "markups": [],
-            "sections": [[10, 0]] * len(cards)  # Reference each card
-        }
-        
-        # Update sections to reference cards correctly
-        mobiledoc["sections"] = [[10, i] for i in range(len(cards))]
+        # Upload images and videos concurrently; gather() keeps carousel order
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrent_uploads)
+        image_results, video_results = await asyncio.gather(
+            asyncio.gather(*(self._upload_with_retry(self.upload_image, p, semaphore, uploaded) for p in image_paths)),
+            asyncio.gather(*(self._upload_with_retry(self.upload_media, p, semaphore, uploaded) for p in video_paths)),
+        )
 
-        # 4) Create the post
-        logger.info("Creating Ghost post...")
-        ghost_post = self.create_post(
-            title=title,
-            mobiledoc=mobiledoc,
-            status=status,
-            tags=tags,
-            **kwargs
+        return (
+            self._collect_uploaded('image', image_paths, image_results),
+            self._collect_uploaded('video', video_paths, video_results),
         )
-        
+
+    async def _media_mobiledoc(self, image_paths: list[str] | None, video_paths: list[str] | None, video_urls: list[str] | None, description: str | None, uploaded: dict[str, str] | None) -> dict:
+        """Upload the media that is not in uploaded yet and build the post's Mobiledoc"""
+        uploaded = uploaded if uploaded is not None else {}
+        image_urls, uploaded_video_urls = await self.upload_items(image_paths or [], video_paths or [], uploaded)
+        return self._build_mobiledoc(description, image_urls, (video_urls or []) + uploaded_video_urls)
+
+    async def create_post(self, title: str, content: str = None, mobiledoc: dict = None, status: str = 'published', tags: list[str] | None = None, **kwargs):
+        """Create a post in Ghost"""
+        url = f'{self.base_url}/ghost/api/admin/posts/'
+        post_data = self._build_post_data(title, content, mobiledoc, status, tags, **kwargs)
+
+        try:
+            response = await self.client.post(
+                url,
+                json=post_data,
+                headers=self._get_headers(),
+                timeout=30
+            )
+            response.raise_for_status()
+            result = response.json()
+            return result['posts'][0] if result.get('posts') else None
+        except httpx.HTTPError as e:
+            logger.error(f"Error creating post: {e}")
+            if isinstance(e, httpx.HTTPStatusError) and e.response.text:
+                logger.error(f"Response: {e.response.text}")
+            return None
+
+    async def upload_image(self, image_path):
+        """Upload an image"""
+        url = f'{self.base_url}/ghost/api/admin/images/upload/'
+
+        try:
+            # The content decides the MIME type: preprocessing may have
+            # re-encoded the image into another format
+            path = Path(image_path)
+            mime_type = image_mime_type(path)
+
+            body = MultipartFileBody(path, mime_type, progress=self.on_upload_progress)
+            response = await self.client.post(url, content=body.__aiter__(), headers=self._get_upload_headers(body))
+            response.raise_for_status()
+            result = response.json()
+            return result['images'][0]['url']
+        except httpx.HTTPError as e:
+            logger.error(f"Error uploading image {image_path}: {e}")
+            return None
+
+    async def upload_media(self, media_path: str) -> str | None:
+        """
+        Upload a media file (e.g., video) to Ghost Admin Media API and return its URL.
+        """
+        url = f'{self.base_url}/ghost/api/admin/media/upload/'
+
+        try:
+            # Determine MIME type based on file extension
+            path = Path(media_path)
+            mime_type = MEDIA_MIME_TYPES.get(path.suffix.lower(), 'video/mp4')
+
+            body = MultipartFileBody(path, mime_type, progress=self.on_upload_progress)
+            resp = await self.client.post(url, content=body.__aiter__(), headers=self._get_upload_headers(body))
+            resp.raise_for_status()
+            data = resp.json()
+            return data['media'][0]['url']
+        except httpx.HTTPError as e:
+            logger.error(f"Error uploading media {media_path}: {e}")
+            if isinstance(e, httpx.HTTPStatusError) and e.response.text:
+                logger.error(f"Response: {e.response.text}")
+            return None
+
+    async def create_media_post(
+        self,
+        title: str,
+        image_paths: list[str] | None = None,
+        video_paths: list[str] | None = None,
+        video_urls: list[str] | None = None,
+        description: str | None = None,
+        status: str = 'published',
+        tags: list[str] | None = None,
+        uploaded: dict[str, str] | None = None,
+        **kwargs
+    ):
+        """
+        Create a post that contains multiple photos and videos.
+
+        image_paths: local image file paths to upload to Ghost
+        video_paths: local video file paths to upload via Admin Media API
+        video_urls: externally hosted video URLs to embed
+        uploaded: path -> URL of files uploaded by an earlier attempt; they are
+            not uploaded again, and new uploads are added to it
+        """
+        logger.info(f"Creating Ghost post: {title}")
+        mobiledoc = await self._media_mobiledoc(image_paths, video_paths, video_urls, description, uploaded)
+
+        logger.info("Creating Ghost post...")
+        with STAGE_SECONDS.time(stage='ghost_post_create'):
+            ghost_post = await self.create_post(
+                title=title,
+                mobiledoc=mobiledoc,
+                status=status,
+                tags=tags,
+                **kwargs
+            )
+
         if ghost_post:
             logger.info(f"✓ Ghost post created: {ghost_post.get('title')} ({ghost_post.get('url')})")
         else:
             logger.error(f"✗ Failed to create Ghost post: {title}")
-        
+
+        return ghost_post
+
+    async def create_digest_post(
+        self,
+        title: str,
+        posts: list[dict],
+        status: str = 'published',
+        tags: list[str] | None = None,
+        uploaded: dict[str, str] | None = None,
+        **kwargs
+    ):
+        """Create one post that collects several posts, as GhostAPI.create_digest_post"""
+        uploaded = uploaded if uploaded is not None else {}
+        logger.info(f"Creating Ghost digest post: {title} ({len(posts)} posts)")
+
+        # One semaphore for all the posts: the upload limit is per Ghost post
+        semaphore = asyncio.Semaphore(self.max_concurrent_uploads)
+        results = await asyncio.gather(*(
+            self.upload_items(post.get('image_paths') or [], post.get('video_paths') or [], uploaded, semaphore)
+            for post in posts
+        ))
+        sections = [
+            (post.get('description'), image_urls, video_urls)
+            for post, (image_urls, video_urls) in zip(posts, results)
+        ]
+
+        with STAGE_SECONDS.time(stage='ghost_post_create'):
+            ghost_post = await self.create_post(title=title, mobiledoc=self._build_digest_mobiledoc(sections), status=status, tags=tags, **kwargs)
+
+        if ghost_post:
+            logger.info(f"✓ Ghost digest post created: {ghost_post.get('title')} ({ghost_post.get('url')})")
+        else:
+            logger.error(f"✗ Failed to create Ghost digest post: {title}")
+
         return ghost_post
 
+    async def get_post(self, post_id: str):
+        """Fetch a post's id, status and updated_at"""
+        url = f'{self.base_url}/ghost/api/admin/posts/{post_id}/'
+
+        try:
+            response = await self.client.get(url, params={'fields': 'id,status,updated_at'}, headers=self._get_headers(), timeout=30)
+            response.raise_for_status()
+            result = response.json()
+            return result['posts'][0] if result.get('posts') else None
+        except httpx.HTTPError as e:
+            logger.error(f"Error fetching post {post_id}: {e}")
+            return None
+
+    async def update_post(self, post_id: str, updated_at: str = None, mobiledoc: dict = None, title: str = None, status: str = None, **kwargs):
+        """Update a post in Ghost, conditionally on updated_at as in GhostAPI.update_post"""
+        url = f'{self.base_url}/ghost/api/admin/posts/{post_id}/'
+
+        for attempt in range(2):
+            if updated_at is None:
+                current = await self.get_post(post_id)
+                if current is None:
+                    return None
+                updated_at = current['updated_at']
+            post_data = self._build_update_data(updated_at, mobiledoc, title, status, **kwargs)
+            try:
+                response = await self.client.put(url, json=post_data, headers=self._get_headers(), timeout=30)
+                if response.status_code == 409 and attempt == 0:
+                    logger.warning(f"Ghost post {post_id} changed since it was last seen, updating its current version")
+                    updated_at = None
+                    continue
+                response.raise_for_status()
+                result = response.json()
+                return result['posts'][0] if result.get('posts') else None
+            except httpx.HTTPError as e:
+                logger.error(f"Error updating post {post_id}: {e}")
+                if isinstance(e, httpx.HTTPStatusError) and e.response.text:
+                    logger.error(f"Response: {e.response.text}")
+                return None
+        return None
+
+    async def update_media_post(
+        self,
+        post_id: str,
+        updated_at: str = None,
+        image_paths: list[str] | None = None,
+        video_paths: list[str] | None = None,
+        description: str | None = None,
+        uploaded: dict[str, str] | None = None,
+        **kwargs
+    ):
+        """Replace the content of a post made by create_media_post; arguments as there"""
+        logger.info(f"Updating Ghost post {post_id}")
+        mobiledoc = await self._media_mobiledoc(image_paths, video_paths, None, description, uploaded)
+        with STAGE_SECONDS.time(stage='ghost_post_update'):
+            return await self.update_post(post_id, updated_at, mobiledoc=mobiledoc, **kwargs)
+
 
 def main():
     """Check Instagram for new posts and publish them on Ghost."""
+    from instagram import Instagram
+    from db import Database
+
     # Configuration
     GHOST_URL = ''
     ADMIN_API_KEY = ''  # Format: key_id:key_secret
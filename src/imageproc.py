@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it images are published as downloaded
+    Image = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Output formats and the extension their files get
+OUTPUT_FORMATS = {
+    'jpeg': '.jpg',
+    'webp': '.webp',
+}
+
+# Downloaded files that are images and may be re-encoded
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def process_image(path: str, max_width: int, output_format: str, quality: int) -> str:
+    """
+    Downscale and re-encode one image, replacing the original. Runs in a
+    worker process. Returns the path of the new file.
+
+    Images wider than max_width (if set) are resized keeping their aspect
+    ratio. Only the pixels are written back: EXIF (camera, location), ICC
+    and XMP metadata are dropped, after the EXIF orientation is applied.
+    """
+    source = Path(path)
+    target = source.with_suffix(OUTPUT_FORMATS[output_format])
+    partial = target.with_name(target.name + '.part')
+
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if max_width and image.width > max_width:
+            height = max(1, round(image.height * max_width / image.width))
+            image = image.resize((max_width, height), Image.Resampling.LANCZOS)
+        if output_format == 'jpeg':
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.save(partial, format='JPEG', quality=quality, optimize=True, progressive=True)
+        else:
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            image.save(partial, format='WEBP', quality=quality, method=4)
+
+    os.replace(partial, target)
+    if target != source:
+        source.unlink()
+    return str(target)
+
+
+class ImageProcessor:
+    """
+    Optional preprocessing of downloaded images before they are published.
+
+    Images are resized and re-encoded on a process pool, so the CPU-bound
+    work neither blocks the event loop nor competes for the GIL with the
+    download and upload threads. Disabled when no output format is set or
+    Pillow is not installed; an image that cannot be processed is published
+    as downloaded.
+    """
+
+    def __init__(self, output_format: str = None, max_width: int = 0, quality: int = 82, workers: int = None):
+        if output_format and output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported image format '{output_format}', use one of: {', '.join(OUTPUT_FORMATS)}")
+        if output_format and Image is None:
+            logger.warning("Image preprocessing needs Pillow, which is not installed: images are published as downloaded")
+            output_format = None
+        self.output_format = output_format
+        self.max_width = max_width
+        self.quality = quality
+        self.workers = workers
+        self._pool = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.output_format is not None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        # Worker processes are only started once there is an image to process.
+        # They are not forked from the bot, whose event loop, executor threads
+        # and open connections a forked child would inherit mid-use
+        if self._pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+        return self._pool
+
+    async def process_folder(self, folder: Path) -> int:
+        """Process the images of a downloaded post in place. Returns the bytes saved."""
+        if not self.enabled:
+            return 0
+        paths = [path for path in sorted(folder.iterdir()) if path.suffix.lower() in SOURCE_EXTENSIONS]
+        if not paths:
+            return 0
+
+        loop = asyncio.get_running_loop()
+        sizes = {path: path.stat().st_size for path in paths}
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self.pool, process_image, str(path), self.max_width, self.output_format, self.quality)
+            for path in paths
+        ), return_exceptions=True)
+
+        processed = saved = 0
+        for path, result in zip(paths, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Could not process image {path}, publishing it as downloaded: {result}")
+                continue
+            processed += 1
+            saved += sizes[path] - Path(result).stat().st_size
+        logger.info(f"Processed {processed} image(s) in {folder}, saved {saved / 1024:.0f} KB")
+        return saved
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -1,41 +1,338 @@
+import hashlib
 import instaloader
-import os
+import json
+from downloader import post_media_items
+from ratelimit import RaisingRateController
 from pathlib import Path
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-print(os.getcwd())
+# Posts examined on the very first poll of an account, before it has a
+# high-water mark (the original fixed depth).
+INITIAL_DEPTH = 5
+# Once a high-water mark exists, the feed is scanned until it is reached.
+# A poll stops after finding this many posts that are neither stored nor
+# queued; the next poll goes on from there, as the posts queued meanwhile
+# no longer count.
+MAX_CATCHUP_DEPTH = 500
+# How long resolved profile metadata (user id, picture, post count) is reused
+PROFILE_CACHE_TTL = 24 * 3600
+# Posts a backfill handles between two saves of its feed cursor
+BACKFILL_BATCH_SIZE = 200
+# Newest posts re-checked for edits and deletions on every poll. One feed
+# page is fetched by every poll anyway, so this window costs no request.
+RECHECK_WINDOW = 12
+# Posts a page can pin to the top of its feed, whatever their age.
+# Instaloader no longer reports which ones are pinned (Post.is_pinned is
+# always False), so the top slots are treated as possibly pinned.
+MAX_PINNED_POSTS = 3
+
+
+def media_kinds(post: instaloader.Post) -> list[str]:
+    """Kind of each media item of a post, in carousel order, as the feed lists them (no extra request)."""
+    if post.typename == 'GraphSidecar':
+        # pylint:disable=protected-access
+        edges = post._field('edge_sidecar_to_children', 'edges')
+        return ['video' if edge['node']['is_video'] else 'image' for edge in edges]
+    return ['video' if post.is_video else 'image']
+
+
+def content_hash(caption: str | None, kinds: list[str]) -> str:
+    """
+    Hash of what a post publishes: its caption and its media list.
+
+    Instagram only lets a post's caption be edited and carousel items be
+    removed, so the kinds of the items are enough to notice a media change;
+    media URLs are not used, as they are signed and change on every fetch.
+    """
+    return hashlib.sha256(json.dumps([caption or '', kinds]).encode()).hexdigest()
+
 
 class Instagram:
-    def __init__(self, username: str, db):
+    def __init__(self, username: str, db, limiter=None, session_user: str = None, session_file: str = None, downloader=None, recheck_window: int = RECHECK_WINDOW):
         self.username = username
         self.db = db
-        self.L = instaloader.Instaloader()
+        self.limiter = limiter
+        self.downloader = downloader
+        if limiter is not None:
+            # Let the shared limiter own retries and 429 handling instead of
+            # Instaloader sleeping inside the call
+            self.L = instaloader.Instaloader(max_connection_attempts=1, rate_controller=RaisingRateController)
+        else:
+            self.L = instaloader.Instaloader()
+        self._posts = {}
+        # False when the last fetch_new_posts stopped at MAX_CATCHUP_DEPTH
+        # before reaching the high-water mark: the mark must not move then
+        self.caught_up = True
+        # The newest posts seen by the last fetch_new_posts, and the timestamp
+        # they cover back to (None when the whole feed was seen), used to sync
+        # edits and deletions of published posts. A window that is not empty
+        # always reaches past the pinned slots.
+        self.recheck_window = max(recheck_window, MAX_PINNED_POSTS + 1) if recheck_window else 0
+        self.recent_posts: list[dict] | None = None
+        self.recent_since: str | None = None
+        # Their Post objects, so a post whose media changed is not looked up again
+        self._recent = {}
+        self.session_file = session_file
+        if session_user:
+            self._load_session(session_user)
 
-    def download_new_posts(self) -> dict:
-        new_posts = []
+    def _load_session(self, session_user: str):
+        """Reuse the session cookies saved by a previous run, if any."""
+        try:
+            self.L.load_session_from_file(session_user, self.session_file)
+            logger.info(f"Loaded Instagram session of {session_user}")
+        except FileNotFoundError:
+            logger.warning(f"No saved Instagram session for {session_user}, continuing anonymously")
+
+    def save_session(self):
+        """Persist the session cookies so the next start does not begin a new session."""
+        if self.L.context.is_logged_in:
+            self.L.save_session_to_file(self.session_file)
+
+    def _get_profile(self) -> instaloader.Profile:
+        """
+        Profile of the watched page, resolved through the database cache.
+
+        With a logged-in session the feed is queried by username, so a cached
+        profile lets the poll go straight to the feed. Anonymous feeds start
+        from the profile lookup itself (it carries the first page of posts),
+        so that request is always made and only refreshes the cache.
+        """
+        cached = self.db.get_cached_profile(self.username, PROFILE_CACHE_TTL)
+        if cached and self.L.context.is_logged_in:
+            user_id, profile_pic_url, mediacount = cached
+            profile = instaloader.Profile(self.L.context, {
+                'id': str(user_id),
+                'username': self.username.lower(),
+                'profile_pic_url': profile_pic_url,
+                'edge_owner_to_timeline_media': {'count': mediacount},
+            })
+            # pylint:disable=protected-access
+            profile._has_full_metadata = True
+            return profile
+
+        profile = self._call('profile', instaloader.Profile.from_username, self.L.context, self.username)
+        # pylint:disable=protected-access
+        self.db.cache_profile(
+            self.username,
+            profile.userid,
+            profile._metadata('profile_pic_url'),
+            profile.mediacount,
+        )
+        return profile
+
+    def _lookup_post(self, shortcode: str) -> instaloader.Post:
+        """Look a post up by shortcode (one request against the post bucket)."""
+        return self._call('post', instaloader.Post.from_shortcode, self.L.context, shortcode)
+
+    def _call(self, endpoint: str, fn, *args, **kwargs):
+        """Run an Instaloader call through the rate limiter, if there is one."""
+        if self.limiter is None:
+            return fn(*args, **kwargs)
+        return self.limiter.call(endpoint, fn, *args, **kwargs)
+
+    def download_new_posts(self) -> list[dict]:
+        """Find the posts newer than the high-water mark and download them."""
+        new_posts = self.fetch_new_posts()
+        for post in new_posts:
+            self.download_post(post['shortcode'])
+        return new_posts
+
+    def fetch_new_posts(self) -> list[dict]:
+        """Find the posts newer than the high-water mark, without downloading them."""
+        mark = self.db.get_high_water_mark(self.username)
+        mark_timestamp = mark[1] if mark else None
+        if mark_timestamp:
+            depth = MAX_CATCHUP_DEPTH
+            logger.info(f"Scanning @{self.username} back to {mark[0]} ({mark_timestamp})")
+        else:
+            depth = INITIAL_DEPTH
         
-        profile = instaloader.Profile.from_username(self.L.context, self.username)
-        posts = profile.get_posts()
-        for post in posts:
-            if not post.is_pinned:
-                shortcode = post.shortcode
-                if not self.db.post_exists(shortcode):
-                    logger.info(f"Downloading post: {shortcode}")
-                    self.L.download_post(post, target=Path("media_downloads") / shortcode)
-                    new_posts.append({
-                        'shortcode': shortcode,
-                        'description': post.caption
-                    })
-                    logger.info(f"Post {shortcode} downloaded to media_downloads/{shortcode}")
-            
-            if posts.total_index >= 5:
+        profile = self._get_profile()
+        # With a logged-in session the feed's first page is fetched right here
+        posts = self._call('feed', profile.get_posts)
+        feed = self.limiter.iterate('feed', posts) if self.limiter else posts
+
+        # Walk the feed newest-first until the high-water mark is reached.
+        # Pinned posts sit at the top regardless of their age, so a post older
+        # than the mark in the top MAX_PINNED_POSTS slots never ends the scan:
+        # new posts may follow it. The scan goes on to the end of the recheck
+        # window, which is within the feed page already fetched.
+        self.recent_posts = None
+        self.caught_up = True
+        candidates = []
+        # Candidates already stored or queued, last counted when the depth was reached
+        known = 0
+        recent = []
+        reached = False
+        exhausted = True
+        for post in feed:
+            timestamp = post.date_utc.isoformat()
+            if posts.total_index <= self.recheck_window:
+                recent.append(post)
+            if not reached:
+                if not mark_timestamp or timestamp > mark_timestamp:
+                    candidates.append(post)
+                elif posts.total_index > MAX_PINNED_POSTS:
+                    reached = True
+
+            if reached and posts.total_index >= self.recheck_window:
+                exhausted = False
+                break
+            if not reached and not mark_timestamp and posts.total_index >= depth:
+                exhausted = False
                 break
+            if not reached and mark_timestamp and len(candidates) - known >= depth:
+                known = len(self.db.existing_shortcodes(p.shortcode for p in candidates))
+                if len(candidates) - known >= depth:
+                    logger.warning(
+                        f"Stopped scanning @{self.username} after {depth} new posts without reaching the "
+                        f"high-water mark: the next poll goes on from there"
+                    )
+                    self.caught_up = False
+                    exhausted = False
+                    break
+
+        seen = self.db.existing_shortcodes(post.shortcode for post in candidates)
+
+        new_posts = self._unseen(candidates, seen)
+
+        # If the newest post is already stored (e.g. first poll of an existing
+        # database), start the high-water mark there so later polls stop early.
+        # Not while older posts are still to be queued: the mark would skip them.
+        # The newest by date, as an old pinned post may come first in the feed.
+        newest_seen = max(candidates, key=lambda post: post.date_utc, default=None)
+        if self.caught_up and not new_posts and newest_seen is not None and newest_seen.shortcode in seen:
+            self.db.update_high_water_mark(self.username, newest_seen.shortcode, newest_seen.date_utc.isoformat())
+
+        self.recent_posts = [self._published_state(post) for post in recent]
+        self._recent = {post.shortcode: post for post in recent}
+        # Below the pinned slots the feed runs newest-first, so the window
+        # holds every post back to its last one. Not the window's oldest
+        # post: an old pinned post on top would stretch it back years.
+        self.recent_since = None if exhausted or not recent else recent[-1].date_utc.isoformat()
+
+        self.db.touch_account(self.username)
+        self.save_session()
                     
         return new_posts
 
+    def _unseen(self, candidates: list[instaloader.Post], seen: set[str], keep: bool = True) -> list[dict]:
+        """The candidates that are not in seen, as post dicts."""
+        new_posts = []
+        for post in candidates:
+            shortcode = post.shortcode
+            if shortcode not in seen:
+                if keep:
+                    # Keep the Post around so the download does not look it up again
+                    self._posts[shortcode] = post
+                new_posts.append({
+                    'shortcode': shortcode,
+                    'description': post.caption,
+                    'timestamp': post.date_utc.isoformat(),
+                })
+        return new_posts
+
+    def _published_state(self, post: instaloader.Post) -> dict:
+        """What a post currently publishes, with its content hash."""
+        kinds = media_kinds(post)
+        return {
+            'shortcode': post.shortcode,
+            'description': post.caption,
+            'timestamp': post.date_utc.isoformat(),
+            'media_kinds': kinds,
+            'content_hash': content_hash(post.caption, kinds),
+        }
+
+    def backfill_batches(self, batch_size: int = BACKFILL_BATCH_SIZE, keep_posts: bool = True):
+        """
+        Page through the account's whole feed, newest first, yielding batches
+        of the posts that are neither stored nor queued.
+
+        The frozen feed iterator is saved as the cursor once the caller asks
+        for the next batch, i.e. after the previous one has been handled, so
+        an interrupted backfill resumes from the last handled batch instead of
+        the top of the feed. keep_posts=False skips caching the Post objects
+        when the posts will not be downloaded.
+        """
+        profile = self._get_profile()
+        posts = self._call('feed', profile.get_posts)
+
+        scanned = 0
+        saved = self.db.get_backfill(self.username)
+        if saved and saved[0] and not saved[2]:
+            try:
+                frozen = instaloader.FrozenNodeIterator(**json.loads(saved[0]))
+                posts.thaw(frozen)
+                # The thawed iterator starts again at the last handled post
+                scanned = frozen.total_index
+                logger.info(f"Resuming the backfill of @{self.username} after {scanned} posts")
+            except instaloader.InvalidArgumentException as e:
+                # Cursors expire; posts already handled are skipped anyway.
+                # A rejected cursor leaves the iterator at the newest post.
+                logger.warning(f"Cannot resume the backfill of @{self.username} ({e}), starting from the newest post")
+
+        feed = self.limiter.iterate('feed', posts) if self.limiter else posts
+        batch = []
+        for post in feed:
+            batch.append(post)
+            if len(batch) < batch_size:
+                continue
+            # Resuming from this cursor yields the batch's last post again,
+            # which is harmless as it is handled by then
+            cursor = json.dumps(posts.freeze()._asdict())
+            yield self._unseen(batch, self.db.existing_shortcodes(p.shortcode for p in batch), keep_posts)
+            scanned += len(batch)
+            self.db.save_backfill(self.username, cursor, scanned)
+            self.save_session()
+            batch = []
+
+        if batch:
+            yield self._unseen(batch, self.db.existing_shortcodes(p.shortcode for p in batch), keep_posts)
+            scanned += len(batch)
+        self.db.save_backfill(self.username, None, scanned, finished=True)
+        self.save_session()
+        logger.info(f"Backfill of @{self.username} finished: {scanned} posts scanned")
+
+    def forget_post(self, shortcode: str) -> None:
+        """Drop a cached Post that will not be downloaded (again) by this process."""
+        self._posts.pop(shortcode, None)
+
+    def download_post(self, shortcode: str) -> Path:
+        """Download a post's media to media_downloads/<shortcode>."""
+        # Kept until the download succeeds, so a retry does not look it up again
+        post = self._posts.get(shortcode) or self._recent.get(shortcode)
+        if post is None:
+            # Resuming after a restart: the Post has to be looked up again
+            post = self._lookup_post(shortcode)
+        target = Path("media_downloads") / shortcode
+        logger.info(f"Downloading post: {shortcode}")
+        if self.downloader is not None:
+            # Resolving the carousel items may need one more post request
+            items = self._call('post', post_media_items, post)
+            self.downloader.download(items, target)
+        else:
+            self._call('media', self.L.download_post, post, target=target)
+        self._posts.pop(shortcode, None)
+        logger.info(f"Post {shortcode} downloaded to {target}")
+        return target
+
+    def is_deleted(self, shortcode: str) -> bool:
+        """True if Instagram no longer serves a post, which a missing post in the feed does not prove."""
+        try:
+            self._lookup_post(shortcode)
+        except (instaloader.QueryReturnedNotFoundException, instaloader.BadResponseException):
+            # A deleted or archived post comes back empty
+            return True
+        return False
+
+    def mark_seen(self, post: dict):
+        """Advance the high-water mark past a post that has been handled."""
+        self.db.update_high_water_mark(self.username, post['shortcode'], post['timestamp'])
+
 
 #test code
 if __name__ == "__main__":
@@ -46,4 +343,5 @@ if __name__ == "__main__":
     new_posts = instagram.download_new_posts()
     for post in new_posts:
         db.insert_post(post['shortcode'], post['description'])
+        instagram.mark_seen(post)
         print(f"Downloaded and saved post: {post['shortcode']}")
\ No newline at end of file
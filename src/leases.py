@@ -0,0 +1,322 @@
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How long a lease (and a node's heartbeat) lasts without being renewed.
+# It is renewed every third of that, and must exceed the clock skew between
+# nodes, since expiry times are compared across machines.
+LEASE_TTL = 60
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def rendezvous_owner(account: str, nodes: list[str]) -> str:
+    """
+    The node an account belongs to (highest random weight hashing).
+
+    Every node computes the same answer from the same node list, and a node
+    joining or leaving only moves the accounts it gains or had.
+    """
+    return max(nodes, key=lambda node: hashlib.sha256(f'{node}\0{account}'.encode()).digest())
+
+
+class LeaseBackend:
+    """
+    Shared store the watcher nodes coordinate through.
+
+    acquire, save_mark and claim must be atomic across nodes: they are what
+    keeps two nodes from polling the same account.
+    """
+
+    def heartbeat(self, node_id: str, ttl: float) -> None:
+        """Announce that the node is alive for another ttl seconds."""
+        raise NotImplementedError
+
+    def leave(self, node_id: str) -> None:
+        """Remove the node right away instead of waiting for its heartbeat to expire."""
+        raise NotImplementedError
+
+    def live_nodes(self) -> list[str]:
+        """Ids of the nodes whose heartbeat has not expired."""
+        raise NotImplementedError
+
+    def acquire(self, account: str, node_id: str, ttl: float) -> bool:
+        """Take or renew the account's lease, if it is free, expired or already the node's."""
+        raise NotImplementedError
+
+    def release(self, account: str, node_id: str) -> None:
+        """Give up the node's lease on the account."""
+        raise NotImplementedError
+
+    def get_mark(self, account: str) -> tuple[str, str] | None:
+        """(shortcode, timestamp) of the newest post of the account handled by any node."""
+        raise NotImplementedError
+
+    def save_mark(self, account: str, node_id: str, shortcode: str, timestamp: str) -> bool:
+        """Advance the account's shared high-water mark; False if the node no longer holds the lease."""
+        raise NotImplementedError
+
+    def claim(self, account: str, node_id: str, shortcode: str, timestamp: str) -> bool:
+        """
+        Record a post queued below the shared mark (during a catch-up); False
+        if the node no longer holds the lease. Claims older than the mark are dropped.
+        """
+        raise NotImplementedError
+
+    def get_claims(self, account: str) -> list[str]:
+        """Shortcodes of the account's posts claimed and not yet covered by the shared mark."""
+        raise NotImplementedError
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """
+    Leases in a SQLite file shared by the nodes (same host or a shared volume
+    whose file locking SQLite can rely on).
+
+    Every operation is a single conditional statement, so the database's own
+    write lock is what makes acquire, save_mark and claim atomic.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS lease_nodes (
+                    node_id TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    account TEXT PRIMARY KEY,
+                    owner TEXT,
+                    expires_at REAL NOT NULL DEFAULT 0,
+                    last_shortcode TEXT,
+                    last_timestamp TEXT
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS lease_claims (
+                    account TEXT NOT NULL,
+                    shortcode TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    PRIMARY KEY (account, shortcode)
+                )
+            ''')
+
+    def heartbeat(self, node_id: str, ttl: float) -> None:
+        with self._lock, self.conn:
+            self.conn.execute('''
+                INSERT INTO lease_nodes (node_id, expires_at) VALUES (?, ?)
+                ON CONFLICT(node_id) DO UPDATE SET expires_at = excluded.expires_at
+            ''', (node_id, time.time() + ttl))
+
+    def leave(self, node_id: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM lease_nodes WHERE node_id = ?', (node_id,))
+
+    def live_nodes(self) -> list[str]:
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT node_id FROM lease_nodes WHERE expires_at > ? ORDER BY node_id', (time.time(),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def acquire(self, account: str, node_id: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock, self.conn:
+            cursor = self.conn.execute('''
+                INSERT INTO leases (account, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(account) DO UPDATE SET
+                    owner = excluded.owner,
+                    expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.owner IS NULL OR leases.expires_at <= ?
+            ''', (account, node_id, now + ttl, now))
+            return cursor.rowcount > 0
+
+    def release(self, account: str, node_id: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                'UPDATE leases SET owner = NULL, expires_at = 0 WHERE account = ? AND owner = ?',
+                (account, node_id),
+            )
+
+    def get_mark(self, account: str) -> tuple[str, str] | None:
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT last_shortcode, last_timestamp FROM leases WHERE account = ?', (account,)
+            ).fetchone()
+        return (row[0], row[1]) if row and row[1] else None
+
+    def save_mark(self, account: str, node_id: str, shortcode: str, timestamp: str) -> bool:
+        with self._lock, self.conn:
+            cursor = self.conn.execute('''
+                UPDATE leases SET
+                    last_shortcode = CASE WHEN last_timestamp IS NULL OR last_timestamp < ?1 THEN ?2 ELSE last_shortcode END,
+                    last_timestamp = MAX(COALESCE(last_timestamp, ''), ?1)
+                WHERE account = ?3 AND owner = ?4 AND expires_at > ?5
+            ''', (timestamp, shortcode, account, node_id, time.time()))
+            saved = cursor.rowcount > 0
+            if saved:
+                self.conn.execute('''
+                    DELETE FROM lease_claims WHERE account = ? AND timestamp <= (
+                        SELECT last_timestamp FROM leases WHERE account = ?
+                    )
+                ''', (account, account))
+            return saved
+
+    def claim(self, account: str, node_id: str, shortcode: str, timestamp: str) -> bool:
+        with self._lock, self.conn:
+            cursor = self.conn.execute('''
+                INSERT OR REPLACE INTO lease_claims (account, shortcode, timestamp)
+                SELECT ?1, ?2, ?3 WHERE EXISTS (
+                    SELECT 1 FROM leases WHERE account = ?1 AND owner = ?4 AND expires_at > ?5
+                )
+            ''', (account, shortcode, timestamp, node_id, time.time()))
+            return cursor.rowcount > 0
+
+    def get_claims(self, account: str) -> list[str]:
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT shortcode FROM lease_claims WHERE account = ? ORDER BY timestamp', (account,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class LeaseManager:
+    """
+    Splits the watched accounts among the live watcher nodes.
+
+    Each node heartbeats into the backend, works out which accounts are its
+    own by rendezvous hashing over the live nodes, and holds an expiring
+    lease on each of them, renewed every ttl/3. When a node joins, the
+    current owners release the accounts that moved to it; when a node dies,
+    its heartbeat and leases expire and the survivors take its accounts over.
+
+    The high-water mark of each account travels with its lease: it is saved
+    in the backend, conditionally on still holding the lease, before a new
+    post is queued, and the next owner starts from it, so a handover never
+    publishes a post twice. Posts queued during a catch-up, below the mark,
+    are claimed in the backend instead, and the next owner skips them.
+    """
+
+    def __init__(self, backend: LeaseBackend, db, accounts: list[str], node_id: str = None, ttl: float = LEASE_TTL, on_acquired=None):
+        self.backend = backend
+        self.db = db
+        self.accounts = list(accounts)
+        self.node_id = node_id or default_node_id()
+        self.ttl = ttl
+        # Called with each account this node has just taken over
+        self.on_acquired = on_acquired
+        # Account -> when our lease on it expires, by our own clock
+        self._expires: dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+
+    def owns(self, account: str) -> bool:
+        """True while this node holds an unexpired lease on the account."""
+        return self._expires.get(account, 0) > time.time()
+
+    def owned(self) -> list[str]:
+        return [account for account in self.accounts if self.owns(account)]
+
+    def record_mark(self, account: str, shortcode: str, timestamp: str) -> bool:
+        """Share the account's new high-water mark. False if the lease was lost: the post must not be queued."""
+        if not self.backend.save_mark(account, self.node_id, shortcode, timestamp):
+            self._expires.pop(account, None)
+            logger.warning(f"Lost the lease on @{account} to another node")
+            return False
+        return True
+
+    def claim(self, account: str, shortcode: str, timestamp: str) -> bool:
+        """Share a post queued without moving the mark. False if the lease was lost: the post must not be queued."""
+        if not self.backend.claim(account, self.node_id, shortcode, timestamp):
+            self._expires.pop(account, None)
+            logger.warning(f"Lost the lease on @{account} to another node")
+            return False
+        return True
+
+    def _hand_over(self, account: str):
+        """Share our high-water mark of the account and release it."""
+        mark = self.db.get_high_water_mark(account)
+        if mark and mark[1]:
+            self.backend.save_mark(account, self.node_id, mark[0], mark[1])
+        self.backend.release(account, self.node_id)
+        self._expires.pop(account, None)
+
+    def sync(self) -> list[str]:
+        """Heartbeat, then claim, renew or release leases. Returns the accounts just acquired (blocking)."""
+        started = time.time()
+        self.backend.heartbeat(self.node_id, self.ttl)
+        nodes = self.backend.live_nodes()
+        if self.node_id not in nodes:
+            nodes.append(self.node_id)
+
+        acquired = []
+        for account in self.accounts:
+            if rendezvous_owner(account, nodes) != self.node_id:
+                if account in self._expires:
+                    logger.info(f"Handing @{account} over to another node")
+                    self._hand_over(account)
+                continue
+
+            if not self.backend.acquire(account, self.node_id, self.ttl):
+                # Still leased by its previous owner until it expires or is released
+                self._expires.pop(account, None)
+                continue
+            if account not in self._expires:
+                # Share our own mark (e.g. from before sharding was enabled),
+                # then start from the newest post any node has handled
+                local = self.db.get_high_water_mark(account)
+                if local and local[1]:
+                    self.backend.save_mark(account, self.node_id, local[0], local[1])
+                mark = self.backend.get_mark(account)
+                if mark:
+                    self.db.update_high_water_mark(account, *mark)
+                # Queued by the previous owner during a catch-up, below the mark
+                self.db.skip_posts(self.backend.get_claims(account), account, 'queued by another node')
+                acquired.append(account)
+                logger.info(f"Node {self.node_id} took over @{account}")
+            # Counted from before the heartbeat, so we give up a lease before the backend does
+            self._expires[account] = started + self.ttl
+        return acquired
+
+    async def run(self) -> None:
+        """Keep the leases in sync until cancelled (the first sync is expected to have been done already)."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                acquired = await loop.run_in_executor(None, self.sync)
+            except Exception as e:
+                logger.error(f"Lease sync failed: {e}")
+                acquired = []
+            if self.on_acquired:
+                for account in acquired:
+                    self.on_acquired(account)
+
+    def start(self) -> asyncio.Task:
+        """Start syncing the leases as a task on the running event loop."""
+        self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Stop syncing and hand every account over right away."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        loop = asyncio.get_running_loop()
+        for account in list(self._expires):
+            await loop.run_in_executor(None, self._hand_over, account)
+        await loop.run_in_executor(None, self.backend.leave, self.node_id)
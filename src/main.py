@@ -1,199 +1,820 @@
+from __future__ import annotations
+
+import argparse
 import asyncio
+import json
 import os
-from telegram import Update, InputMediaPhoto, InputMediaVideo
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
-from apscheduler.schedulers.background import BackgroundScheduler
-from instagram import Instagram
+import sys
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+from instagram import Instagram, content_hash
 from db import Database
+from mediastore import MediaStore
+from scheduler import AdaptivePollScheduler
+from ratelimit import CircuitOpenError, InstagramRateLimiter
+from downloader import MediaDownloader
+from publishers import GhostPublisher, TelegramPublisher
+from telegram_sender import split_media_group
+from metrics import FAILURES, STAGE_SECONDS, start_http_server
+from leases import LeaseManager, SQLiteLeaseBackend
+from profiling import CycleProfiler, profiled_stage
 import logging
 from pathlib import Path
-from ghostapi import GhostAPI
 from datetime import datetime
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
+
 load_dotenv()
 
-BOT_TOKEN = os.getenv("BOT_TOKEN")  # Telegram bot token
-CHANNEL_ID = int(os.getenv("CHANNEL_ID"))  # Telegram channel ID
-GHOST_URL = os.getenv("GHOST_URL")  # Ghost site URL
+BOT_TOKEN = os.getenv("BOT_TOKEN")  # Telegram bot token; unset skips Telegram (the bot itself needs it)
+CHANNEL_ID = int(os.getenv("CHANNEL_ID", 0))  # Telegram channel ID
+GHOST_URL = os.getenv("GHOST_URL")  # Ghost site URL; unset skips Ghost
 ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
-INSTAGRAM_PAGE = os.getenv("INSTAGRAM_PAGE")
-CHECK_INTERVAL_HOURS = int(os.getenv("CHECK_INTERVAL_HOURS", 1))  # Interval to check for new posts
+INSTAGRAM_PAGES = os.getenv("INSTAGRAM_PAGES", os.getenv("INSTAGRAM_PAGE", ""))  # Comma-separated pages to watch
+ACCOUNTS_CONFIG = os.getenv("ACCOUNTS_CONFIG")  # Optional JSON file with per-page channel_id and tags
+INSTAGRAM_SESSION_USER = os.getenv("INSTAGRAM_SESSION_USER")  # Instagram login whose saved session is reused
+INSTAGRAM_SESSION_FILE = os.getenv("INSTAGRAM_SESSION_FILE")  # Session file (Instaloader's default path if unset)
+MAX_CONCURRENT_FETCHES = int(os.getenv("MAX_CONCURRENT_FETCHES", 3))  # Instagram fetches running at once, across all pages
+MEDIA_DOWNLOAD_WORKERS = int(os.getenv("MEDIA_DOWNLOAD_WORKERS", 6))  # Parallel media item downloads
+CHECK_INTERVAL_HOURS = int(os.getenv("CHECK_INTERVAL_HOURS", 1))  # Longest interval between checks, used for quiet accounts
+MIN_CHECK_INTERVAL_MINUTES = int(os.getenv("MIN_CHECK_INTERVAL_MINUTES", 10))  # Shortest interval, used for active accounts
+RECHECK_WINDOW = int(os.getenv("RECHECK_WINDOW", 12))  # Newest posts re-checked for edits and deletions on every poll (0 disables)
+DIGEST_THRESHOLD = int(os.getenv("DIGEST_THRESHOLD", 0))  # Publish a poll's new posts as digests when there are more than this (0 disables)
+DIGEST_MAX_POSTS = int(os.getenv("DIGEST_MAX_POSTS", 20))  # Posts collected in one digest
+GHOST_MAX_CONCURRENT_UPLOADS = int(os.getenv("GHOST_MAX_CONCURRENT_UPLOADS", 4))  # Parallel media uploads per post
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))  # Attempts per stage before giving up
+OUTBOX_RETRY_BACKOFF_SECONDS = int(os.getenv("OUTBOX_RETRY_BACKOFF_SECONDS", 60))  # Base delay between stage retries
+TELEGRAM_PUBLISH_TIMEOUT = int(os.getenv("TELEGRAM_PUBLISH_TIMEOUT", 300))  # Seconds before a Telegram send is abandoned
+GHOST_PUBLISH_TIMEOUT = int(os.getenv("GHOST_PUBLISH_TIMEOUT", 600))  # Seconds before a Ghost publish is abandoned
+MEDIA_STORE_DIR = os.getenv("MEDIA_STORE_DIR", "media_store")  # Content-addressed media cache
+MEDIA_STORE_MAX_MB = int(os.getenv("MEDIA_STORE_MAX_MB", 2048))  # Disk budget of the media cache
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT")  # Re-encode images as "jpeg" (progressive) or "webp"; unset keeps them as downloaded
+IMAGE_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", 0))  # Downscale wider images to this width (0 keeps the width)
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 82))  # Encoder quality of re-encoded images
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))  # Processes re-encoding images
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # Serve Prometheus metrics on 127.0.0.1:<port>/metrics (0 disables)
+LEASE_DB = os.getenv("LEASE_DB")  # SQLite file shared by all watcher nodes; unset runs a single node watching every page
+NODE_ID = os.getenv("NODE_ID")  # This node's id in the lease table (hostname-pid if unset)
+LEASE_TTL_SECONDS = int(os.getenv("LEASE_TTL_SECONDS", 60))  # How long a dead node keeps its pages before they move
 DB_NAME = "instagram_posts.db"
-# Telegram bot token and channel ID
+DEFAULT_GHOST_TAGS = ['instagram', 'social-media']
+SAVED_POSTS_PAGE_SIZE = 10  # Posts per /savedposts page, well within Telegram's 4096 characters
+SEARCH_RESULTS = 10  # Captions shown by /search
+GIVEN_UP = 'given up'  # Skip reason of the posts no destination could publish
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize services
-db = Database(DB_NAME)
-instagram = Instagram(INSTAGRAM_PAGE, db)
-ghost = GhostAPI(GHOST_URL, ADMIN_API_KEY)
+
+
+def load_accounts() -> dict[str, dict]:
+    """
+    Watched pages and where each one is published.
+
+    ACCOUNTS_CONFIG may map a page to {"channel_id": ..., "tags": [...]};
+    pages without an entry go to CHANNEL_ID with the default Ghost tags.
+    """
+    overrides = {}
+    if ACCOUNTS_CONFIG:
+        with open(ACCOUNTS_CONFIG) as f:
+            overrides = json.load(f)
+
+    usernames = [name.strip() for name in INSTAGRAM_PAGES.split(',') if name.strip()]
+    usernames += [name for name in overrides if name not in usernames]
+    return {
+        username: {
+            'channel_id': int(overrides.get(username, {}).get('channel_id', CHANNEL_ID)),
+            'tags': overrides.get(username, {}).get('tags', DEFAULT_GHOST_TAGS),
+        }
+        for username in usernames
+    }
+
+
+# Services, created by init_services() rather than on import, so that each
+# command only loads and connects what it uses
+db = None
+accounts = {}
+limiter = None
+downloader = None
+instagrams = {}
+fetch_semaphore = None
+media_store = None
+image_processor = None
+ghost = None
+publishers = []
+JOB_STAGES = ()
+lease_manager = None
+
+
+def init_services() -> None:
+    """
+    Open the database and create the Instagram clients and the publishers.
+
+    Only the configured destinations are set up, and their libraries
+    imported: Telegram needs BOT_TOKEN, Ghost needs GHOST_URL and
+    ADMIN_API_KEY, and image preprocessing needs IMAGE_FORMAT. Raises
+    ValueError if Telegram is configured but a page has no channel.
+    """
+    global db, accounts, limiter, downloader, instagrams, fetch_semaphore, media_store
+    global image_processor, ghost, publishers, JOB_STAGES, lease_manager
+
+    accounts = load_accounts()
+    if BOT_TOKEN:
+        unrouted = [username for username, account in accounts.items() if not account['channel_id']]
+        if unrouted:
+            raise ValueError(f"no Telegram channel for {', '.join(unrouted)}: set CHANNEL_ID or their channel_id in ACCOUNTS_CONFIG")
+    db = Database(DB_NAME)
+    # One limiter for all pages: Instagram throttles per client, not per page
+    limiter = InstagramRateLimiter(db)
+    downloader = MediaDownloader(MEDIA_DOWNLOAD_WORKERS, limiter)
+    instagrams = {
+        username: Instagram(username, db, limiter, INSTAGRAM_SESSION_USER, INSTAGRAM_SESSION_FILE, downloader, RECHECK_WINDOW)
+        for username in accounts
+    }
+    # Bounds the Instagram traffic of all pages together
+    fetch_semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    media_store = MediaStore(MEDIA_STORE_DIR, db, MEDIA_STORE_MAX_MB * 1024 * 1024)
+    if IMAGE_FORMAT:
+        from imageproc import ImageProcessor
+        image_processor = ImageProcessor(IMAGE_FORMAT, IMAGE_MAX_WIDTH, IMAGE_QUALITY, IMAGE_WORKERS)
+
+    # Destinations every post is published to; each one is an outbox stage
+    publishers = []
+    if BOT_TOKEN:
+        publishers.append(TelegramPublisher(media_store, accounts, timeout=TELEGRAM_PUBLISH_TIMEOUT))
+    if GHOST_URL and ADMIN_API_KEY:
+        from ghostapi import AsyncGhostAPI
+        ghost = AsyncGhostAPI(GHOST_URL, ADMIN_API_KEY, max_concurrent_uploads=GHOST_MAX_CONCURRENT_UPLOADS)
+        publishers.append(GhostPublisher(ghost, media_store, accounts, timeout=GHOST_PUBLISH_TIMEOUT))
+    if not publishers:
+        logger.warning("Neither Telegram nor Ghost is configured: new posts are only recorded")
+    JOB_STAGES = ('fetched', 'downloaded', *(publisher.name for publisher in publishers), 'cleanup')
+    # With several nodes, each page is polled by the node holding its lease
+    lease_manager = (
+        LeaseManager(SQLiteLeaseBackend(LEASE_DB), db, list(accounts), NODE_ID, LEASE_TTL_SECONDS)
+        if LEASE_DB else None
+    )
+
+
+async def close_services() -> None:
+    """Release the pooled Ghost connections and stop the download and image workers."""
+    if ghost is not None:
+        await ghost.aclose()
+    downloader.shutdown()
+    if image_processor is not None:
+        image_processor.shutdown()
 
 
 async def hello(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(f'Ciao, questo bot controlla quando {INSTAGRAM_PAGE} pubblica nuovi post su Instagram e li inoltra su Telegram e Ghost!')
+    pages = ', '.join(accounts)
+    await update.message.reply_text(f'Ciao, questo bot controlla quando {pages} pubblica nuovi post su Instagram e li inoltra su Telegram e Ghost!')
 
 
 async def _is_admin_of_channel(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
-    """Return True if the user is admin/creator of CHANNEL_ID."""
-    try:
-        member = await context.bot.get_chat_member(CHANNEL_ID, user_id)
-        return getattr(member, "status", "") in ("administrator", "creator")
-    except Exception as e:
-        logger.warning(f"Impossibile verificare permessi admin: {e}")
-        return False
+    """Return True if the user is admin/creator of CHANNEL_ID or of the channel of any watched page."""
+    # Pages may be routed only through ACCOUNTS_CONFIG, with CHANNEL_ID unset
+    channels = dict.fromkeys([CHANNEL_ID, *(account['channel_id'] for account in accounts.values())])
+    for channel_id in channels:
+        if not channel_id:
+            continue
+        try:
+            member = await context.bot.get_chat_member(channel_id, user_id)
+        except Exception as e:
+            logger.warning(f"Impossibile verificare permessi admin nel canale {channel_id}: {e}")
+            continue
+        if getattr(member, "status", "") in ("administrator", "creator"):
+            return True
+    return False
+
+
+def _saved_posts_page(cursor: int = None, newer: bool = False):
+    """Text and navigation buttons of one /savedposts page."""
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+    rows, has_newer, has_older = db.get_posts_page(SAVED_POSTS_PAGE_SIZE, cursor, newer)
+    if not rows:
+        return "Nessun post salvato nel database.", None
+
+    message = "Post salvati nel database:\n"
+    for _, shortcode, publication_date, description in rows:
+        desc_text = f"{description[:50]}..." if description else "(no description)"
+        message += f"- Post del {publication_date},  https://instagram.com/p/{shortcode}/, {desc_text} \n"
+
+    # Buttons carry the id of the page's edge post: the next page starts right after it
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton("« Più recenti", callback_data=f"savedposts:newer:{rows[0][0]}"))
+    if has_older:
+        buttons.append(InlineKeyboardButton("Meno recenti »", callback_data=f"savedposts:older:{rows[-1][0]}"))
+    return message, InlineKeyboardMarkup([buttons]) if buttons else None
 
 
 async def saved_posts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """List saved Instagram posts in the database (only channel admins)."""
+    """List saved Instagram posts in the database, one page at a time (only channel admins)."""
     user_id = update.effective_user.id if update.effective_user else None
     if not user_id or not await _is_admin_of_channel(context, user_id):
         if update.message:
             await update.message.reply_text("Solo gli admin del canale possono usare questo comando.")
         return
 
-    posts = db.get_all_posts()
-    if not posts:
-        await update.message.reply_text("Nessun post salvato nel database.")
+    message, keyboard = _saved_posts_page()
+    await update.message.reply_text(message, reply_markup=keyboard)
+
+
+async def saved_posts_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the /savedposts page requested by a navigation button."""
+    query = update.callback_query
+    if not await _is_admin_of_channel(context, query.from_user.id):
+        await query.answer("Solo gli admin del canale possono usare questo comando.", show_alert=True)
         return
 
-    message = "Post salvati nel database:\n"
-    for shortcode, publication_date, description in posts:
-        desc_text = f"{description[:50]}..." if description else "(no description)"
-        message += f"- Post del {publication_date},  https://instagram.com/p/{shortcode}/, {desc_text} \n"
-        
+    _, direction, cursor = query.data.split(':')
+    message, keyboard = _saved_posts_page(int(cursor), newer=direction == 'newer')
+    await query.answer()
+    await query.edit_message_text(message, reply_markup=keyboard)
 
 
+async def search_posts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Search the captions of saved posts (only channel admins)."""
+    user_id = update.effective_user.id if update.effective_user else None
+    if not user_id or not await _is_admin_of_channel(context, user_id):
+        if update.message:
+            await update.message.reply_text("Solo gli admin del canale possono usare questo comando.")
+        return
+
+    query = ' '.join(context.args)
+    if not query:
+        await update.message.reply_text("Uso: /search <parole da cercare>")
+        return
+
+    results = db.search(query, SEARCH_RESULTS)
+    if not results:
+        await update.message.reply_text(f"Nessun post trovato per \"{query}\".")
+        return
+
+    message = f"Post trovati per \"{query}\":\n"
+    for shortcode, publication_date, snippet in results:
+        message += f"- Post del {publication_date},  https://instagram.com/p/{shortcode}/, {snippet} \n"
     await update.message.reply_text(message)
 
 
-async def check_new_posts(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Check for new Instagram posts and send them to Telegram channel and Ghost."""
+def _download_folder(username: str, shortcode: str) -> Path:
+    """Download a post's media; items finished by an earlier attempt are skipped (runs in the executor)."""
+    return instagrams[username].download_post(shortcode)
+
+
+def _job_media(job: dict) -> list[dict]:
+    """The media entries recorded by the job's download stage."""
+    return (job['stages']['downloaded']['result'] or {}).get('media', [])
+
+
+async def _download_media(username: str, shortcode: str) -> list[dict]:
+    """Download a post's media, preprocess its images and move them into the media store."""
+    loop = asyncio.get_running_loop()
+    with profiled_stage('download'):
+        async with fetch_semaphore:
+            with STAGE_SECONDS.time(stage='download'):
+                post_folder = await loop.run_in_executor(None, _download_folder, username, shortcode)
+        # Images are resized before they are stored, so both destinations and
+        # the store itself only ever see the smaller files
+        if image_processor is not None:
+            await image_processor.process_folder(post_folder)
+        return await loop.run_in_executor(None, media_store.ingest_folder, post_folder)
+
+
+async def _download_stage(context, job: dict):
+    """Download the post's media into the media store."""
+    media = await _download_media(job['username'], job['shortcode'])
+    job['stages']['downloaded']['result'] = {'media': media}
+    return {'media': media}
+
+
+async def _cleanup_stage(context, job: dict):
+    """Release the post's media and keep the media store within its disk budget."""
+    media_store.touch(_job_media(job))
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _evict, job['shortcode'])
+    return None
+
+
+def _evict(shortcode: str) -> None:
+    """Bring the media store back within its budget, if it is over it (blocking)."""
+    if not media_store.is_full():
+        return
+    # Blobs still needed by other queued jobs are never evicted
+    media_store.evict(db.queued_blobs(exclude=shortcode))
+
+
+def _is_due(stage: dict) -> bool:
+    """True if a pending stage may be attempted now."""
+    return stage['status'] == 'pending' and (
+        not stage['next_attempt_at'] or stage['next_attempt_at'] <= datetime.now().isoformat()
+    )
+
+
+async def _run_stage(job: dict, name: str, run, timeout: float = None) -> bool:
+    """
+    Run one outbox stage if it is due, recording its outcome. Returns True if it is done.
+
+    run is called with the state saved by the stage's previous attempt and
+    may update it with partial progress, which is kept if the attempt fails.
+    """
+    stage = job['stages'].setdefault(name, {
+        'status': 'pending', 'attempts': 0, 'next_attempt_at': None, 'last_error': None, 'result': None,
+    })
+    if stage['status'] == 'done':
+        return True
+    if not _is_due(stage):
+        return False
+
+    state = dict(stage['result'] or {})
+    try:
+        result = await asyncio.wait_for(run(state), timeout)
+    except CircuitOpenError as e:
+        # Instagram is throttling us: wait for the breaker without using up attempts
+        logger.warning(f"Postponing stage '{name}' of post {job['shortcode']}: {e}")
+        return False
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        status = db.fail_stage(
+            job['shortcode'], name, error,
+            max_attempts=OUTBOX_MAX_ATTEMPTS,
+            backoff_seconds=OUTBOX_RETRY_BACKOFF_SECONDS,
+            result=state or None,
+        )
+        FAILURES.inc(stage=name, outcome='failed' if status == 'failed' else 'retry')
+        if status == 'failed':
+            logger.error(f"✗ Giving up on stage '{name}' of post {job['shortcode']}: {error}")
+        else:
+            logger.warning(f"Stage '{name}' of post {job['shortcode']} failed, will retry: {error}")
+        stage['status'] = status
+        return False
+
+    db.complete_stage(job['shortcode'], name, result)
+    stage['status'] = 'done'
+    stage['result'] = result
+    return True
+
+
+async def _ensure_downloaded(context, job: dict) -> bool:
+    """Run the job's download stage unless it is done and its media still on disk. Returns True if it is done."""
+    downloaded = job['stages']['downloaded']
+    if downloaded['status'] == 'done' and not media_store.has_all(_job_media(job)):
+        # The blobs were evicted while the job waited: fetch them again
+        downloaded['status'] = 'pending'
+        downloaded['next_attempt_at'] = None
+    return await _run_stage(job, 'downloaded', lambda state: _download_stage(context, job))
+
+
+async def _settle_job(context, job: dict, track: bool = True) -> None:
+    """
+    Record a job whose destinations are all settled (or whose download was
+    given up on) as published, or as skipped if no destination has it,
+    release its media and remove it from the outbox. With track, later
+    edits and deletions on Instagram are synced to it.
+    """
+    statuses = [job['stages'][publisher.name]['status'] for publisher in publishers]
+    if job['stages']['downloaded']['status'] != 'failed' and 'pending' in statuses:
+        return
+    if 'done' not in statuses:
+        # Kept out of the published posts, but never queued again
+        db.skip_posts([job['shortcode']], job['username'], GIVEN_UP)
+        instagrams[job['username']].forget_post(job['shortcode'])
+        logger.error(f"✗ Post {job['shortcode']} of @{job['username']} was given up on, it is not published anywhere")
+        track = False
+    else:
+        db.insert_post(job['shortcode'], job['description'], job['username'])
+    if track:
+        # Remembered so later edits and deletions on Instagram can follow it
+        media = _job_media(job)
+        db.save_publication(
+            job['shortcode'], job['username'], job['timestamp'],
+            content_hash(job['description'], [item['kind'] for item in media]),
+            media,
+            {
+                publisher.name: job['stages'][publisher.name]['result']
+                for publisher in publishers if job['stages'][publisher.name]['status'] == 'done'
+            },
+        )
+    with profiled_stage('cleanup'):
+        await _run_stage(job, 'cleanup', lambda state: _cleanup_stage(context, job))
+    # A cleanup given up on leaves its files to the media store's eviction
+    if job['stages']['cleanup']['status'] != 'pending':
+        db.finish_job(job['shortcode'])
+
+
+async def process_job(context, job: dict) -> None:
+    """Advance one outbox job through its stages, skipping the ones already done."""
+    if not await _ensure_downloaded(context, job):
+        if job['stages']['downloaded']['status'] == 'failed':
+            # Nothing can be published without the media
+            await _settle_job(context, job)
+        return
+
+    # Destinations are published to concurrently, each with its own timeout
+    # and retry state: a Ghost failure does not resend to Telegram
+    media = _job_media(job)
+    with profiled_stage('publish'):
+        await asyncio.gather(*(
+            _run_stage(
+                job, publisher.name,
+                lambda state, publisher=publisher: publisher.publish(context, job, media, state),
+                publisher.timeout,
+            )
+            for publisher in publishers
+        ))
+
+    # Local media is only released once every destination is settled
+    await _settle_job(context, job)
+
+
+async def process_digest(context, jobs: list[dict]) -> None:
+    """
+    Advance the jobs of a digest: each post is downloaded on its own, then
+    all of them are published together, as one Ghost post and as few
+    Telegram media groups as possible.
+
+    The digest's publishing state is kept on its oldest job and copied to
+    the others once settled. Digest posts are not synced with later edits
+    on Instagram, as they share their Ghost post and Telegram messages.
+    """
+    downloaded = await asyncio.gather(*(_ensure_downloaded(context, job) for job in jobs))
+    if any(job['stages']['downloaded']['status'] == 'pending' for job in jobs):
+        # Wait for every download, so the digest is published only once
+        return
+    # Posts whose download was given up on are left out, and settled on their own
+    for job, done in zip(jobs, downloaded):
+        if not done:
+            await _settle_job(context, job, track=False)
+    jobs = [job for job, done in zip(jobs, downloaded) if done]
+    if not jobs:
+        return
+
+    leader = jobs[0]
+    media = [_job_media(job) for job in jobs]
+    with profiled_stage('publish'):
+        await asyncio.gather(*(
+            _run_stage(
+                leader, publisher.name,
+                lambda state, publisher=publisher: publisher.publish_digest(context, jobs, media, state),
+                publisher.timeout,
+            )
+            for publisher in publishers
+        ))
+
+    for publisher in publishers:
+        stage = leader['stages'][publisher.name]
+        for job in jobs[1:]:
+            if stage['status'] == 'done':
+                db.complete_stage(job['shortcode'], publisher.name, stage['result'])
+            elif stage['status'] == 'failed':
+                db.fail_stage(job['shortcode'], publisher.name, f"Digest failed on {leader['shortcode']}", max_attempts=1, backoff_seconds=0)
+            job['stages'].setdefault(publisher.name, {})['status'] = stage['status']
+    for job in jobs:
+        await _settle_job(context, job, track=False)
+
+
+async def process_outbox(context, username: str) -> None:
+    """Work through the account's queued jobs, oldest post first."""
+    jobs = db.get_jobs(username)
+    digests = {}
+    for job in jobs:
+        if job['digest']:
+            digests.setdefault(job['digest'], []).append(job)
+
+    for job in jobs:
+        try:
+            if not job['digest']:
+                await process_job(context, job)
+            elif job['digest'] in digests:
+                await process_digest(context, digests.pop(job['digest']))
+        except Exception as e:
+            logger.error(f"Error processing post {job['shortcode']}: {e}")
+
+
+async def _push_edit(context, username: str, publication: dict, post: dict) -> None:
+    """Update every destination of a post that was edited on Instagram."""
+    media = publication['media']
+    if post['media_kinds'] != [item['kind'] for item in media]:
+        # Carousel items were removed: fetch what is left of it
+        media = await _download_media(username, post['shortcode'])
+    job = {'shortcode': post['shortcode'], 'username': username, 'description': post['description'], 'timestamp': post['timestamp']}
+    previous = {'description': publication['description'], 'media': publication['media']}
+
+    refs = dict(publication['refs'])
+    results = await asyncio.gather(*(
+        publisher.update(context, job, media, refs[publisher.name], previous)
+        for publisher in publishers if publisher.name in refs
+    ))
+    refs.update(zip([publisher.name for publisher in publishers if publisher.name in refs], results))
+    db.update_publication(post['shortcode'], post['content_hash'], media, refs, post['description'])
+    logger.info(f"✓ Synced the edit of post {post['shortcode']}")
+
+
+async def _take_down(context, publication: dict) -> None:
+    """Remove a post that was deleted from Instagram from every destination."""
+    refs = publication['refs']
+    await asyncio.gather(*(
+        publisher.delete(context, refs[publisher.name])
+        for publisher in publishers if publisher.name in refs
+    ))
+    db.mark_publication_deleted(publication['shortcode'])
+    logger.info(f"✓ Took down post {publication['shortcode']}, deleted from Instagram")
+
+
+async def sync_published_posts(context, username: str) -> None:
+    """
+    Push Instagram edits and deletions of recently published posts.
+
+    The posts in the recheck window of the last poll are compared with the
+    content hash stored when they were last published or synced; only the
+    posts whose hash changed, or that are gone from the window, cost any
+    API call. A post gone from the window is only taken down once a lookup
+    confirms Instagram no longer serves it. A sync that fails is retried on
+    the next poll.
+    """
+    instagram = instagrams[username]
+    loop = asyncio.get_running_loop()
+    current = {post['shortcode']: post for post in instagram.recent_posts or []}
+    if not current:
+        # An empty or failed scan never means every post was deleted
+        return
+
+    for publication in db.get_publications(username, instagram.recent_since, current):
+        post = current.get(publication['shortcode'])
+        try:
+            if post is None:
+                async with fetch_semaphore:
+                    deleted = await loop.run_in_executor(None, instagram.is_deleted, publication['shortcode'])
+                if deleted:
+                    await _take_down(context, publication)
+                else:
+                    logger.warning(f"Post {publication['shortcode']} of @{username} is missing from the feed but still on Instagram, keeping it")
+            elif post['content_hash'] != publication['content_hash']:
+                await _push_edit(context, username, publication, post)
+        except Exception as e:
+            logger.error(f"Error syncing post {publication['shortcode']} of @{username}: {e}")
+
+
+async def check_new_posts(context: ContextTypes.DEFAULT_TYPE, username: str) -> bool:
+    """
+    Check a page for new Instagram posts and send them to its Telegram channel
+    and Ghost. Returns False if the page could not be checked.
+    """
+    if lease_manager is not None and not lease_manager.owns(username):
+        # Another node watches this page: only finish the jobs queued here before
+        await process_outbox(context, username)
+        return True
+
+    instagram = instagrams[username]
     try:
         loop = asyncio.get_running_loop()
-        new_posts = await loop.run_in_executor(None, instagram.download_new_posts)
+        async with fetch_semaphore:
+            with STAGE_SECONDS.time(stage='fetch'), profiled_stage('fetch'):
+                new_posts = await loop.run_in_executor(None, instagram.fetch_new_posts)
 
         new_posts.reverse()  # Send older posts first
+        # A catch-up after downtime is published as digests instead of post
+        # by post, split evenly so no digest is left with a single post
+        digests = {}
+        if DIGEST_THRESHOLD and len(new_posts) > DIGEST_THRESHOLD:
+            for chunk in split_media_group(new_posts, DIGEST_MAX_POSTS):
+                digests.update((post['shortcode'], f"{username}:{chunk[0]['shortcode']}") for post in chunk)
+            logger.info(f"Publishing {len(new_posts)} new posts of @{username} as {len(set(digests.values()))} digest(s)")
+        if not instagram.caught_up:
+            # Older new posts are still to be found: the mark stays below them
+            logger.warning(f"Queueing {len(new_posts)} new posts of @{username} without moving the high-water mark")
         for post in new_posts:
-            # Prepare caption with description and link
-            link = f"\nhttps://instagram.com/p/{post['shortcode']}/"
-            caption = ""
-            if post['description']:
-                description = post['description']
-                if len(description) + len(link) > 1024:  # Telegram caption limit
-                    caption = f"{description[:1020 - len(link)]}...{link}"
+            if lease_manager is not None:
+                # The shared high-water mark moves (or, below it, the post is
+                # claimed) first: if the lease has been lost meanwhile, the new
+                # owner handles the post instead
+                if instagram.caught_up:
+                    held = lease_manager.record_mark(username, post['shortcode'], post['timestamp'])
                 else:
-                    caption = f"{description}{link}"
-            else:
-                caption = link
+                    held = lease_manager.claim(username, post['shortcode'], post['timestamp'])
+                if not held:
+                    break
+            # Once queued the post is owned by the outbox, which survives restarts
+            db.enqueue_job(
+                post['shortcode'], username, post['description'], post['timestamp'],
+                stages=JOB_STAGES, digest=digests.get(post['shortcode']),
+            )
+            if instagram.caught_up:
+                instagram.mark_seen(post)
+
+        with profiled_stage('sync'):
+            await sync_published_posts(context, username)
+        checked = True
+
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping check of @{username}: {e}")
+        checked = False
+    except Exception as e:
+        logger.error(f"Error checking new posts of @{username}: {e}")
+        checked = False
+
+    # Also resumes the jobs left unfinished by an earlier run
+    await process_outbox(context, username)
+    return checked
 
-            # Media folder under media_downloads/<shortcode>
-            post_folder = Path("media_downloads") / post['shortcode']
-            if not post_folder.exists():
-                logger.warning(f"Post folder not found: {post_folder}")
-                continue
 
-            jpg_files = sorted(post_folder.glob('*.jpg'))
-            mp4_files = sorted(post_folder.glob('*.mp4'))
+async def _backfill_post(username: str, post: dict, download: bool = True) -> None:
+    """Download a historical post and queue it for publishing. Without download, the outbox fetches its media."""
+    if not download:
+        instagrams[username].forget_post(post['shortcode'])
+        db.enqueue_job(post['shortcode'], username, post['description'], post['timestamp'], stages=JOB_STAGES)
+        return
+    try:
+        media = await _download_media(username, post['shortcode'])
+    except Exception as e:
+        # Queued without its media: the outbox retries the download
+        logger.warning(f"Could not download post {post['shortcode']} during the backfill: {e}")
+        db.enqueue_job(post['shortcode'], username, post['description'], post['timestamp'], stages=JOB_STAGES)
+        return
+    db.enqueue_job(
+        post['shortcode'], username, post['description'], post['timestamp'],
+        done_stages=('fetched', 'downloaded'), stages=JOB_STAGES, results={'downloaded': {'media': media}},
+    )
 
-            media_group = []
-            file_handles = []
 
+async def backfill(username: str, mark_seen_only: bool = False) -> int:
+    """
+    Import the whole history of a page. Returns the number of new posts found.
+
+    Posts are downloaded in parallel and queued in the outbox, which the bot
+    then publishes at its usual pace. Once the media store is full, the
+    remaining posts are queued without media and downloaded by the outbox
+    when it publishes them. With mark_seen_only they are only
+    recorded as published, in one transaction per batch, so they are never
+    sent anywhere. Interrupted backfills resume from the saved feed cursor.
+    """
+    instagram = instagrams[username]
+    loop = asyncio.get_running_loop()
+    batches = instagram.backfill_batches(keep_posts=not mark_seen_only)
+    found = 0
+    while (batch := await loop.run_in_executor(None, next, batches, None)) is not None:
+        if not batch:
+            continue
+        if mark_seen_only:
+            db.insert_posts(((post['shortcode'], post['description'], post['timestamp']) for post in batch), username)
+        else:
+            # Checked per batch, so the store overshoots its budget by one batch at most
+            download = not media_store.is_full()
+            await asyncio.gather(*(_backfill_post(username, post, download) for post in batch))
+        # Regular polls start from the newest post the backfill handled
+        instagram.mark_seen(max(batch, key=lambda post: post['timestamp']))
+        found += len(batch)
+        logger.info(f"Backfill of @{username}: {found} new posts so far")
+    return found
+
+
+async def run_backfill(usernames: list[str], mark_seen_only: bool = False) -> None:
+    """Backfill the given pages one after the other."""
+    try:
+        for username in usernames:
+            found = await backfill(username, mark_seen_only)
+            action = 'marked as seen' if mark_seen_only else 'queued for publishing'
+            logger.info(f"✓ Backfill of @{username} done: {found} posts {action}")
+    finally:
+        await close_services()
+
+
+async def run_once(usernames: list[str], profiler: CycleProfiler = None) -> int:
+    """
+    One poll-and-publish cycle of the given pages, for cron jobs and systemd
+    timers. Returns the exit status: 0 if every page was checked and no
+    outbox stage failed, 1 otherwise. Failed stages are retried by the next run.
+
+    With a profiler, the cycle (not the bot's startup) is profiled, and the
+    pages are checked one after the other so their stages do not overlap.
+    """
+    context = SimpleNamespace(bot=None)
+    if BOT_TOKEN:
+        from telegram import Bot
+        context.bot = Bot(BOT_TOKEN)
+        await context.bot.initialize()
+    failures = FAILURES.total()
+    try:
+        if lease_manager is not None:
+            await asyncio.get_running_loop().run_in_executor(None, lease_manager.sync)
+        if profiler is None:
+            checked = await asyncio.gather(*(check_new_posts(context, username) for username in usernames))
+        else:
+            profiler.start()
             try:
-                # Photos
-                for idx, jpg_file in enumerate(jpg_files):
-                    f = open(jpg_file, 'rb')
-                    file_handles.append(f)
-                    if idx == 0:
-                        media_group.append(InputMediaPhoto(f, caption=caption))
-                    else:
-                        media_group.append(InputMediaPhoto(f))
-
-                # Videos
-                for idx, mp4_file in enumerate(mp4_files):
-                    file_size = mp4_file.stat().st_size / (1024 * 1024)
-                    logger.info(f"Adding video {mp4_file} ({file_size:.2f} MB) to media group")
-                    f = open(mp4_file, 'rb')
-                    file_handles.append(f)
-                    if idx == 0 and len(jpg_files) == 0:
-                        media_group.append(InputMediaVideo(f, caption=caption))
-                    else:
-                        media_group.append(InputMediaVideo(f))
-
-                if media_group:
-                    await context.bot.send_media_group(
-                        chat_id=CHANNEL_ID,
-                        media=media_group,
-                        read_timeout=120,
-                        write_timeout=120,
-                        connect_timeout=60,
-                    )
-                    db.insert_post(post['shortcode'], post['description'])
-                    logger.info(f"Sent media group for post {post['shortcode']} to Telegram channel")
-
-                # Create Ghost post
-                image_paths = [str(p) for p in jpg_files]
-                video_paths = [str(p) for p in mp4_files]
-                title = (
-                    f"{post['description'][:30]}..." if post.get('description')
-                    else f"instagram post {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-                )
-
-                ghost_post = ghost.create_media_post(
-                    title=title,
-                    image_paths=image_paths,
-                    video_paths=video_paths,
-                    description=post.get('description'),
-                    status='published',
-                    tags=['instagram', 'social-media'],
-                )
-
-                if ghost_post:
-                    logger.info(f"✓ Created Ghost post: {ghost_post.get('title')} ({ghost_post.get('url')})")
-                else:
-                    logger.error(f"✗ Failed to create Ghost post for {post['shortcode']}")
-
+                checked = [await check_new_posts(context, username) for username in usernames]
             finally:
-                for f in file_handles:
-                    f.close()
-
-            # Cleanup local media
-            for file in post_folder.iterdir():
-                file.unlink()
-            post_folder.rmdir()
-            logger.info(f"Deleted folder {post_folder} after sending media")
+                profiler.stop()
+    finally:
+        if lease_manager is not None:
+            await lease_manager.stop()
+        if context.bot is not None:
+            await context.bot.shutdown()
+        await close_services()
 
-    except Exception as e:
-        logger.error(f"Error checking new posts: {e}")
+    if not all(checked) or FAILURES.total() > failures:
+        logger.error("✗ Run finished with errors")
+        return 1
+    logger.info(f"✓ Run finished, {len(db.get_jobs())} job(s) left in the outbox")
+    return 0
 
 
 async def post_init(app) -> None:
-    """Check for new posts when the application starts."""
+    """Start the poll scheduler on the bot's event loop, and the metrics endpoint if enabled."""
     logger.info("Checking for new posts at startup")
-    await check_new_posts(app)
+    # The first cycle runs right away (resuming unfinished jobs) in the
+    # background, so the bot answers commands while it publishes.
+    scheduler = AdaptivePollScheduler(
+        db,
+        lambda username: check_new_posts(app, username),
+        list(accounts),
+        min_interval=MIN_CHECK_INTERVAL_MINUTES * 60,
+        max_interval=CHECK_INTERVAL_HOURS * 3600,
+    )
+    app.bot_data['scheduler'] = scheduler
+    if lease_manager is not None:
+        # Claim this node's share of the pages before the first cycle
+        await asyncio.get_running_loop().run_in_executor(None, lease_manager.sync)
+        logger.info(f"Node {lease_manager.node_id} watches: {', '.join(lease_manager.owned()) or 'no pages yet'}")
+        lease_manager.on_acquired = scheduler.poll_now
+        lease_manager.start()
+    scheduler.start()
+    if METRICS_PORT:
+        app.bot_data['metrics_server'] = start_http_server(METRICS_PORT)
+
+
+async def post_shutdown(app) -> None:
+    """Stop the scheduler and release the pooled Ghost HTTP connections."""
+    scheduler = app.bot_data.get('scheduler')
+    if scheduler:
+        await scheduler.stop()
+    if lease_manager is not None:
+        # Hand the pages over now rather than when the leases expire
+        await lease_manager.stop()
+    metrics_server = app.bot_data.get('metrics_server')
+    if metrics_server:
+        metrics_server.shutdown()
+    await close_services()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Instagram post watcher and publisher bot")
+    commands = parser.add_subparsers(dest='command')
+    backfill_parser = commands.add_parser('backfill', help="import the whole history of watched pages, then exit")
+    backfill_parser.add_argument('pages', nargs='*', help="pages to backfill (default: every watched page)")
+    backfill_parser.add_argument('--mark-seen', action='store_true', help="record the history as published without sending it anywhere")
+    run_once_parser = commands.add_parser(
+        'run-once', help="check the watched pages and publish their new posts once, then exit (for cron or systemd timers)",
+        description="Exits with status 0 if every page was checked and published, 1 if something failed.",
+    )
+    run_once_parser.add_argument('pages', nargs='*', help="pages to check (default: every watched page)")
+    run_once_parser.add_argument('--profile', nargs='?', const='profile.txt', metavar='REPORT',
+                                 help="profile the cycle and write the top functions and allocation sites to REPORT (default: %(const)s)")
+    run_once_parser.add_argument('--profile-stacks', metavar='FILE',
+                                 help="with --profile, also write collapsed stacks for flamegraph.pl or speedscope to FILE")
+    args = parser.parse_args()
+    if args.command is None and not BOT_TOKEN:
+        parser.error("BOT_TOKEN is required to run the bot")
+    if args.command == 'run-once' and args.profile_stacks and not args.profile:
+        parser.error("--profile-stacks needs --profile")
+
+    try:
+        init_services()
+    except ValueError as e:
+        parser.error(str(e))
+    if args.command in ('backfill', 'run-once'):
+        unknown = [page for page in args.pages if page not in accounts]
+        if unknown:
+            parser.error(f"not a watched page: {', '.join(unknown)}")
+    if args.command == 'backfill':
+        asyncio.run(run_backfill(args.pages or list(accounts), args.mark_seen))
+        return
+    if args.command == 'run-once':
+        profiler = CycleProfiler() if args.profile else None
+        status = asyncio.run(run_once(args.pages or list(accounts), profiler))
+        if profiler is not None:
+            profiler.write_report(args.profile)
+            if args.profile_stacks:
+                profiler.write_stacks(args.profile_stacks)
+        sys.exit(status)
+
+    from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler
+
     app = ApplicationBuilder().token(BOT_TOKEN).build()
     app.add_handler(CommandHandler("hello", hello))
     app.add_handler(CommandHandler("savedposts", saved_posts))
+    app.add_handler(CommandHandler("search", search_posts))
+    app.add_handler(CallbackQueryHandler(saved_posts_page, pattern=r'^savedposts:(newer|older):\d+$'))
     app.post_init = post_init
+    app.post_shutdown = post_shutdown
 
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(
-        check_new_posts,
-        'interval',
-        hours=CHECK_INTERVAL_HOURS,
-        args=(app,),
-        id='check_instagram_posts',
-        name='Check Instagram Posts Every 1 Hour',
-    )
-    scheduler.start()
-
-    logger.info("Scheduler started. Checking for new posts every 1 hour.")
+    logger.info(f"Checking for new posts every {MIN_CHECK_INTERVAL_MINUTES} minutes to {CHECK_INTERVAL_HOURS} hours, depending on posting activity.")
     app.run_polling()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
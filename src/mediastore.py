@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Only the files that are actually published are kept; instaloader's
+# metadata side files (.txt, .json.xz) are dropped on ingest.
+MEDIA_KINDS = {
+    '.jpg': 'image',
+    '.webp': 'image',
+    '.mp4': 'video',
+}
+
+
+def sha256_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file without loading it into memory."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaStore:
+    """
+    Content-addressed local store for downloaded media.
+
+    Files are kept under <root>/<first two hex digits>/<sha256><ext> and the
+    database remembers, per blob, the Ghost URL and Telegram file_id it was
+    published as, so identical bytes are never uploaded twice. Disk usage is
+    kept under max_bytes by evicting the least recently used blobs.
+    """
+
+    def __init__(self, root: str, db, max_bytes: int):
+        self.root = Path(root)
+        self.db = db
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, sha256: str, ext: str) -> Path:
+        """Location of a blob in the store."""
+        return self.root / sha256[:2] / f"{sha256}{ext}"
+
+    def sha256_of(self, path: str | Path) -> str:
+        """The blob hash of a store path (its file name without extension)."""
+        return Path(path).name.split('.', 1)[0]
+
+    def add_file(self, path: Path) -> dict:
+        """Move a file into the store and return its media entry."""
+        ext = path.suffix.lower()
+        sha256 = sha256_file(path)
+        target = self.path_for(sha256, ext)
+        if target.exists():
+            # Same bytes as a blob we already have (repost, retry, ...)
+            path.unlink()
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(path, target)
+        self.db.put_blob(sha256, ext, target.stat().st_size)
+        return {'sha256': sha256, 'ext': ext, 'kind': MEDIA_KINDS[ext]}
+
+    def ingest_folder(self, folder: Path) -> list[dict]:
+        """
+        Move the media of a downloaded post into the store and delete the folder.
+        Returns the media entries in file name order, which is carousel order.
+        """
+        media = []
+        for path in sorted(folder.iterdir()):
+            if path.suffix.lower() in MEDIA_KINDS:
+                media.append(self.add_file(path))
+        for leftover in folder.iterdir():
+            leftover.unlink()
+        folder.rmdir()
+        return media
+
+    def is_full(self) -> bool:
+        """True if the stored blobs already use up max_bytes."""
+        return self.db.stored_blobs_size() >= self.max_bytes
+
+    def has_all(self, media: list[dict]) -> bool:
+        """True if every blob of a post is still on disk."""
+        return all(self.path_for(m['sha256'], m['ext']).exists() for m in media)
+
+    def paths(self, media: list[dict], kind: str) -> list[str]:
+        """Store paths of the post's media of the given kind."""
+        return [str(self.path_for(m['sha256'], m['ext'])) for m in media if m['kind'] == kind]
+
+    def ghost_urls(self, media: list[dict]) -> dict[str, str]:
+        """Store path -> Ghost URL for the blobs that have already been uploaded."""
+        urls = {}
+        for m in media:
+            blob = self.db.get_blob(m['sha256'])
+            if blob and blob[3]:
+                urls[str(self.path_for(m['sha256'], m['ext']))] = blob[3]
+        return urls
+
+    def record_ghost_urls(self, uploaded: dict[str, str]):
+        """Remember the Ghost URLs returned for store paths."""
+        for path, url in uploaded.items():
+            self.db.set_blob_ghost_url(self.sha256_of(path), url)
+
+    def telegram_file_id(self, sha256: str) -> str | None:
+        """The Telegram file_id a blob was sent as, if any."""
+        blob = self.db.get_blob(sha256)
+        return blob[4] if blob else None
+
+    def record_telegram_file_id(self, sha256: str, file_id: str):
+        """Remember the Telegram file_id a blob was sent as."""
+        self.db.set_blob_telegram_file_id(sha256, file_id)
+
+    def touch(self, media: list[dict]):
+        """Mark the post's blobs as recently used."""
+        self.db.touch_blobs(m['sha256'] for m in media)
+
+    def evict(self, protected: set[str] = frozenset()) -> int:
+        """
+        Delete least recently used blobs until the store fits in max_bytes.
+        Blobs in protected (still needed by queued jobs) are kept. Returns
+        the number of bytes freed.
+        """
+        total = self.db.stored_blobs_size()
+        freed = 0
+        if total <= self.max_bytes:
+            return freed
+
+        for sha256, ext, size in self.db.stored_blobs_lru():
+            if total - freed <= self.max_bytes:
+                break
+            if sha256 in protected:
+                continue
+            try:
+                self.path_for(sha256, ext).unlink()
+            except FileNotFoundError:
+                pass
+            self.db.unstore_blob(sha256)
+            freed += size
+
+        logger.info(f"Evicted {freed / (1024 * 1024):.1f} MB from the media store")
+        return freed
@@ -0,0 +1,232 @@
+import collections
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds between two samples of the thread stacks
+SAMPLE_INTERVAL = 0.005
+# Rows in each table of the report
+TOP_ENTRIES = 25
+# Allocation sites listed under each stage
+TOP_STAGE_SITES = 5
+# Runs of each stage whose allocations are snapshotted. Snapshots cost far
+# more than the stage itself, and the download, publish and cleanup of one
+# post allocate much like those of the next; time and peak memory are
+# recorded for every run.
+SNAPSHOT_RUNS = 3
+# Innermost frames (file, function) of a thread with nothing to do: the
+# event loop waiting in select, executor workers waiting for work. Samples
+# ending in them are not counted.
+IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('thread.py', '_worker'),
+    ('queue.py', 'get'),
+}
+
+# The watcher's own sources, listed apart in the report
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The profiler running, if any: stages are only recorded while one is
+_active = None
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_group(name: str) -> str:
+    """Pool name of a worker thread (asyncio_3 -> asyncio), so each pool is one flamegraph root."""
+    prefix, _, index = name.rpartition('_')
+    return prefix if prefix and index.isdigit() else name
+
+
+def _site(traceback) -> str:
+    frame = traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+class CycleProfiler:
+    """
+    Profiles one watch cycle.
+
+    A background thread samples the stack of every other thread each
+    SAMPLE_INTERVAL, so Instaloader pagination and media downloads running
+    in executor threads show up next to the event loop's own work (cProfile
+    only follows the thread it is enabled in). tracemalloc snapshots taken
+    around the first SNAPSHOT_RUNS runs of each stage (see profiled_stage)
+    attribute allocations to fetch, download, publish, cleanup and sync.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        # (thread group, frames from the outermost) -> samples
+        self.stacks = collections.Counter()
+        # Frame labels of functions defined in SOURCE_DIR
+        self.own_functions = set()
+        self.ticks = 0
+        self.elapsed = 0.0
+        self.peak = 0
+        # Stage -> runs, seconds, peak and net bytes allocated per site by the snapshotted runs
+        self.stages: dict[str, dict] = {}
+        self._depth = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+        self._first = self._last = None
+
+    def start(self) -> None:
+        global _active
+        tracemalloc.start()
+        self._first = self._snapshot()
+        self._stop.clear()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._thread.start()
+        _active = self
+
+    def stop(self) -> None:
+        global _active
+        _active = None
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        self._last = self._snapshot()
+        tracemalloc.stop()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        # Garbage is collected first, so what a stage leaves behind does not
+        # depend on when the collector last ran
+        gc.collect()
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                code = frame.f_code
+                if ident == own or (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    # Snapshots and their diffs are the profiler's own time, not the cycle's
+                    if frame.f_code.co_filename == __file__:
+                        break
+                    label = _frame_label(frame.f_code)
+                    if frame.f_code.co_filename.startswith(SOURCE_DIR):
+                        self.own_functions.add(label)
+                    stack.append(label)
+                    frame = frame.f_back
+                else:
+                    stack.reverse()
+                    self.stacks[(_thread_group(names.get(ident, str(ident))), tuple(stack))] += 1
+            self.ticks += 1
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the time, peak memory and net allocations of one run of a stage."""
+        # Stages nested in another (a download during a sync) share its peak
+        outermost = self._depth == 0
+        if outermost:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        traced = tracemalloc.get_traced_memory()[0]
+        stats = self.stages.setdefault(name, {'runs': 0, 'seconds': 0.0, 'peak': 0, 'sites': collections.Counter()})
+        stats['runs'] += 1
+        before = self._snapshot() if stats['runs'] <= SNAPSHOT_RUNS else None
+        self._depth += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self._depth -= 1
+            stats['seconds'] += seconds
+            if outermost:
+                stats['peak'] = max(stats['peak'], tracemalloc.get_traced_memory()[1] - traced)
+            if before is not None:
+                for diff in self._snapshot().compare_to(before, 'lineno'):
+                    if diff.size_diff:
+                        stats['sites'][_site(diff.traceback)] += diff.size_diff
+
+    def top_functions(self, limit: int = TOP_ENTRIES, by_total: bool = False, own_only: bool = False) -> list[tuple[str, float, float]]:
+        """(function, self seconds, total seconds) of the functions with the most samples."""
+        own, total = collections.Counter(), collections.Counter()
+        for (_, stack), count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        seconds = self.elapsed / self.ticks if self.ticks else self.interval
+        ranked = sorted(total, key=lambda label: (total if by_total else own)[label], reverse=True)
+        if own_only:
+            ranked = [label for label in ranked if label in self.own_functions]
+        return [(label, own[label] * seconds, total[label] * seconds) for label in ranked[:limit]]
+
+    def report(self) -> str:
+        """Text report of the stages, the busiest functions and the top allocation sites."""
+        lines = [
+            f"Watch cycle profile: {self.elapsed:.2f} s, {self.ticks} samples every {self.interval * 1000:g} ms, "
+            f"peak traced memory {self.peak / (1024 * 1024):.1f} MB",
+            '',
+            'Stages:',
+        ]
+        for name, stats in self.stages.items():
+            retained = sum(stats['sites'].values()) / min(stats['runs'], SNAPSHOT_RUNS)
+            lines.append(
+                f"  {name:<10} {stats['runs']:>4} run(s) {stats['seconds']:9.2f} s "
+                f"{stats['peak'] / 1024:10.0f} KB peak {retained / 1024:+10.0f} KB left per run"
+            )
+
+        # Sampled wall time in all threads: a function waiting on a socket counts, an idle thread does not
+        tables = (
+            ('Top functions by self time (sampled in all threads, idle waits excluded):', {}),
+            ('Watcher functions by total time:', {'by_total': True, 'own_only': True}),
+        )
+        for title, options in tables:
+            lines += ['', title, '     self s    total s  function']
+            for label, own, total in self.top_functions(**options):
+                lines.append(f"  {own:9.2f} {total:10.2f}  {label}")
+
+        lines += ['', 'Top allocation sites over the whole cycle (still allocated at its end):']
+        for diff in self._last.compare_to(self._first, 'lineno')[:TOP_ENTRIES]:
+            lines.append(f"  {diff.size_diff / 1024:+10.0f} KB {diff.count_diff:+8d} blocks  {_site(diff.traceback)}")
+        for name, stats in self.stages.items():
+            lines += ['', f"Top allocation sites of stage {name} (left allocated by its first {SNAPSHOT_RUNS} runs):"]
+            for site, size in sorted(stats['sites'].items(), key=lambda item: -abs(item[1]))[:TOP_STAGE_SITES]:
+                lines.append(f"  {size / 1024:+10.0f} KB  {site}")
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, path: str) -> None:
+        with open(path, 'w') as f:
+            f.write(self.report())
+        logger.info(f"Profile report written to {path}")
+
+    def write_stacks(self, path: str) -> None:
+        """Collapsed stacks (thread;outer;...;inner samples), as read by flamegraph.pl and speedscope."""
+        with open(path, 'w') as f:
+            for (group, stack), count in sorted(self.stacks.items()):
+                f.write(f"{';'.join((group, *stack))} {count}\n")
+        logger.info(f"Collapsed stacks written to {path}")
+
+
+@contextmanager
+def profiled_stage(name: str):
+    """Attribute the block to a cycle stage while a CycleProfiler is running; a no-op otherwise."""
+    if _active is None:
+        yield
+    else:
+        with _active.stage(name):
+            yield
@@ -0,0 +1,379 @@
+import logging
+from datetime import datetime
+
+from metrics import TRANSFERRED_BYTES
+from telegram_sender import TelegramSender, split_media_group
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Publisher:
+    """
+    A destination posts are published to.
+
+    Every publisher is one outbox stage (named after it) and runs
+    concurrently with the other publishers of the same post, each with its
+    own timeout and its own retry state.
+    """
+
+    name: str = ''
+    timeout: float = 300
+
+    async def publish(self, context, job: dict, media: list[dict], state: dict) -> dict:
+        """
+        Publish one post and return the result to store for its stage.
+
+        media holds the post's media store entries in carousel order. state
+        starts as the result saved by the previous failed attempt (or empty)
+        and may be updated in place with partial progress, which is kept if
+        this attempt fails too. Failures are raised as exceptions.
+        """
+        raise NotImplementedError
+
+    async def publish_digest(self, context, jobs: list[dict], media: list[list[dict]], state: dict) -> dict:
+        """
+        Publish several posts of one page together, as a digest.
+
+        media holds the media entries of each job; state and the returned
+        result are as in publish, for the digest as a whole.
+        """
+        raise NotImplementedError
+
+    async def update(self, context, post: dict, media: list[dict], ref: dict, previous: dict) -> dict:
+        """
+        Bring a published post up to date after it was edited on Instagram.
+
+        ref is the result publish returned for it; previous holds the
+        description and media it was last published with. Returns the new
+        ref. Failures are raised as exceptions.
+        """
+        raise NotImplementedError
+
+    async def delete(self, context, ref: dict) -> None:
+        """Take down a post that was deleted from Instagram."""
+        raise NotImplementedError
+
+
+def build_caption(post: dict) -> str:
+    """Telegram caption: the post description followed by the Instagram link."""
+    link = f"\nhttps://instagram.com/p/{post['shortcode']}/"
+    if post['description']:
+        description = post['description']
+        if len(description) + len(link) > 1024:  # Telegram caption limit
+            return f"{description[:1020 - len(link)]}...{link}"
+        return f"{description}{link}"
+    return link
+
+
+def build_digest_caption(posts: list[dict]) -> str | None:
+    """Telegram caption of a digest group: a line with the start of each post's description and its link."""
+    if not posts:
+        return None
+    # Telegram caption limit, shared evenly by the posts
+    budget = 1024 // len(posts)
+    lines = []
+    for post in posts:
+        link = f"https://instagram.com/p/{post['shortcode']}/"
+        room = budget - len(link) - 2
+        description = (post['description'] or '').replace('\n', ' ')
+        if len(description) > room:
+            description = f"{description[:max(0, room - 3)]}..."
+        lines.append(f"{description} {link}".strip())
+    return '\n'.join(lines)
+
+
+class TelegramPublisher(Publisher):
+    """
+    Sends the post to the page's Telegram channel.
+
+    Carousels are split into valid media groups (at most 10 items, caption
+    on the first group; a lone item is sent as a plain photo or video).
+    Groups already sent by a failed attempt are not sent again, and every
+    send goes through the per-chat flood-control queue.
+    """
+
+    name = 'telegram'
+
+    def __init__(self, media_store, accounts: dict[str, dict], timeout: float = 300, sender: TelegramSender = None):
+        self.media_store = media_store
+        self.accounts = accounts
+        self.timeout = timeout
+        self.sender = sender or TelegramSender()
+
+    def _input_media(self, item: dict, caption: str | None):
+        """InputMedia for one item, by file_id when Telegram already has the bytes."""
+        # Imported here so that runs publishing only to Ghost never load python-telegram-bot
+        from telegram import InputMediaPhoto, InputMediaVideo
+
+        input_media = InputMediaPhoto if item['kind'] == 'image' else InputMediaVideo
+
+        # Bytes Telegram has already seen are sent by file_id, not uploaded again
+        file_id = self.media_store.telegram_file_id(item['sha256'])
+        if file_id:
+            return input_media(file_id, caption=caption)
+
+        path = self.media_store.path_for(item['sha256'], item['ext'])
+        size = path.stat().st_size
+        TRANSFERRED_BYTES.inc(size, destination='telegram')
+        if item['kind'] == 'video':
+            logger.info(f"Adding video {path} ({size / (1024 * 1024):.2f} MB) to media group")
+        # InputMedia reads the file when it is built, so each handle is
+        # closed right away instead of keeping the whole carousel open
+        with open(path, 'rb') as f:
+            return input_media(f, caption=caption)
+
+    async def _send_group(self, bot, chat_id: int, group: list[dict], caption: str | None):
+        """Send one group and record the file_id of every item."""
+        # Built lazily, so only the group being sent is held in memory
+        async def send():
+            media = [self._input_media(item, caption if idx == 0 else None) for idx, item in enumerate(group)]
+            timeouts = {'read_timeout': 120, 'write_timeout': 120, 'connect_timeout': 60}
+            if len(media) > 1:
+                return await bot.send_media_group(chat_id=chat_id, media=media, **timeouts)
+            # Telegram rejects media groups of one item
+            single = media[0]
+            if group[0]['kind'] == 'image':
+                message = await bot.send_photo(chat_id=chat_id, photo=single.media, caption=single.caption, **timeouts)
+            else:
+                message = await bot.send_video(chat_id=chat_id, video=single.media, caption=single.caption, **timeouts)
+            return [message]
+
+        messages = await self.sender.send(chat_id, send, message_count=len(group))
+
+        for item, message in zip(group, messages):
+            sent = message.photo[-1] if message.photo else message.video
+            if sent is not None:
+                self.media_store.record_telegram_file_id(item['sha256'], sent.file_id)
+        return messages
+
+    async def publish(self, context, job: dict, media: list[dict], state: dict) -> dict:
+        if not media:
+            raise RuntimeError(f"No media found for post {job['shortcode']}")
+
+        chat_id = self.accounts[job['username']]['channel_id']
+        caption = build_caption(job)
+        groups = split_media_group(media)
+
+        # Message ids of each group already delivered, kept across attempts
+        sent_groups = state.setdefault('sent_groups', [])
+        for index, group in enumerate(groups):
+            if index < len(sent_groups):
+                continue
+            messages = await self._send_group(context.bot, chat_id, group, caption if index == 0 else None)
+            sent_groups.append([m.message_id for m in messages])
+
+        logger.info(f"Sent {len(groups)} media group(s) for post {job['shortcode']} to Telegram channel")
+        return {
+            'chat_id': chat_id,
+            'message_ids': [message_id for group in sent_groups for message_id in group],
+            'sent_groups': sent_groups,
+        }
+
+    async def publish_digest(self, context, jobs: list[dict], media: list[list[dict]], state: dict) -> dict:
+        chat_id = self.accounts[jobs[0]['username']]['channel_id']
+        # The items of all the posts, packed into as few media groups as possible
+        items = [(job, item) for job, job_media in zip(jobs, media) for item in job_media]
+        if not items:
+            raise RuntimeError(f"No media found for the digest of {len(jobs)} posts")
+        groups = split_media_group(items)
+
+        sent_groups = state.setdefault('sent_groups', [])
+        started = set()
+        for index, group in enumerate(groups):
+            # Each group's caption links the posts that start in it
+            posts = []
+            for job, _ in group:
+                if job['shortcode'] not in started:
+                    started.add(job['shortcode'])
+                    posts.append(job)
+            if index < len(sent_groups):
+                continue
+            messages = await self._send_group(context.bot, chat_id, [item for _, item in group], build_digest_caption(posts))
+            sent_groups.append([m.message_id for m in messages])
+
+        logger.info(f"Sent a digest of {len(jobs)} posts in {len(groups)} media group(s) to Telegram channel")
+        return {
+            'chat_id': chat_id,
+            'message_ids': [message_id for group in sent_groups for message_id in group],
+            'sent_groups': sent_groups,
+        }
+
+    async def update(self, context, post: dict, media: list[dict], ref: dict, previous: dict) -> dict:
+        from telegram.error import BadRequest
+
+        chat_id = ref['chat_id']
+        # One message per media item, in carousel order
+        message_ids = list(ref['message_ids'])
+
+        if [item['sha256'] for item in media] != [item['sha256'] for item in previous['media']]:
+            # Instagram only lets carousel items be removed: delete their messages
+            kept = {item['sha256'] for item in media}
+            removed = [
+                message_id for message_id, item in zip(message_ids, previous['media'])
+                if item['sha256'] not in kept
+            ]
+            if removed and len(message_ids) - len(removed) == len(media):
+                await self._delete_messages(context.bot, chat_id, removed)
+                message_ids = [message_id for message_id in message_ids if message_id not in removed]
+                logger.info(f"Deleted the messages of {len(removed)} item(s) removed from post {post['shortcode']}")
+            else:
+                logger.warning(f"Media of post {post['shortcode']} changed in a way that cannot be mirrored on Telegram")
+
+        caption = build_caption(post)
+        moved = message_ids[:1] != ref['message_ids'][:1]
+        if message_ids and (moved or caption != build_caption({**post, 'description': previous['description']})):
+            try:
+                await self.sender.send(chat_id, lambda: context.bot.edit_message_caption(chat_id, message_ids[0], caption=caption))
+            except BadRequest as e:
+                # The caption is already the one being sent
+                if 'not modified' not in str(e).lower():
+                    raise
+            logger.info(f"Updated the caption of post {post['shortcode']} on Telegram")
+        return {**ref, 'message_ids': message_ids}
+
+    async def _delete_messages(self, bot, chat_id: int, message_ids: list[int]):
+        from telegram.error import BadRequest
+
+        try:
+            await self.sender.send(chat_id, lambda: bot.delete_messages(chat_id, message_ids))
+        except BadRequest as e:
+            # Old messages cannot always be deleted by a bot: leave them be
+            logger.warning(f"Could not delete messages {message_ids} from chat {chat_id}: {e}")
+
+    async def delete(self, context, ref: dict) -> None:
+        await self._delete_messages(context.bot, ref['chat_id'], ref['message_ids'])
+        logger.info(f"Deleted messages {ref['message_ids']} from chat {ref['chat_id']}")
+
+
+class GhostPublisher(Publisher):
+    """Creates a Ghost post with the post's media."""
+
+    name = 'ghost'
+
+    def __init__(self, ghost, media_store, accounts: dict[str, dict], timeout: float = 600):
+        self.ghost = ghost
+        self.media_store = media_store
+        self.accounts = accounts
+        self.timeout = timeout
+
+    async def _upload_all(self, image_paths: list[str], video_paths: list[str], uploaded: dict[str, str]):
+        """
+        Upload every item before the post is created or updated, so it never
+        goes out with media missing. The stage is retried instead, and only
+        the items that failed are uploaded again.
+        """
+        image_urls, video_urls = await self.ghost.upload_items(image_paths, video_paths, uploaded)
+        missing = len(image_paths) + len(video_paths) - len(image_urls) - len(video_urls)
+        if missing:
+            raise RuntimeError(f"{missing} media item(s) could not be uploaded to Ghost")
+
+    @staticmethod
+    def _title(job: dict) -> str:
+        return (
+            f"{job['description'][:30]}..." if job.get('description')
+            else f"instagram post {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+        )
+
+    async def publish(self, context, job: dict, media: list[dict], state: dict) -> dict:
+        image_paths = self.media_store.paths(media, 'image')
+        video_paths = self.media_store.paths(media, 'video')
+        title = self._title(job)
+
+        # Media uploaded by a failed attempt, or for any earlier post with the
+        # same bytes, is not uploaded again
+        uploaded = state.setdefault('uploaded', {})
+        uploaded.update(self.media_store.ghost_urls(media))
+        try:
+            await self._upload_all(image_paths, video_paths, uploaded)
+            ghost_post = await self.ghost.create_media_post(
+                title=title,
+                image_paths=image_paths,
+                video_paths=video_paths,
+                description=job.get('description'),
+                status='published',
+                tags=self.accounts[job['username']]['tags'],
+                uploaded=uploaded,
+            )
+        finally:
+            self.media_store.record_ghost_urls(uploaded)
+
+        if not ghost_post:
+            raise RuntimeError(f"Failed to create Ghost post for {job['shortcode']}")
+        logger.info(f"✓ Created Ghost post: {ghost_post.get('title')} ({ghost_post.get('url')})")
+        return {
+            'id': ghost_post.get('id'),
+            'url': ghost_post.get('url'),
+            'updated_at': ghost_post.get('updated_at'),
+            'uploaded': uploaded,
+        }
+
+    async def publish_digest(self, context, jobs: list[dict], media: list[list[dict]], state: dict) -> dict:
+        username = jobs[0]['username']
+        uploaded = state.setdefault('uploaded', {})
+        uploaded.update(self.media_store.ghost_urls([item for job_media in media for item in job_media]))
+        posts = [
+            {
+                # Each post keeps its own caption, followed by its Instagram link
+                'description': '\n\n'.join(filter(None, [job['description'], f"https://instagram.com/p/{job['shortcode']}/"])),
+                'image_paths': self.media_store.paths(job_media, 'image'),
+                'video_paths': self.media_store.paths(job_media, 'video'),
+            }
+            for job, job_media in zip(jobs, media)
+        ]
+        try:
+            await self._upload_all(
+                [path for post in posts for path in post['image_paths']],
+                [path for post in posts for path in post['video_paths']],
+                uploaded,
+            )
+            ghost_post = await self.ghost.create_digest_post(
+                title=f"Instagram @{username}: {len(jobs)} post",
+                posts=posts,
+                status='published',
+                tags=self.accounts[username]['tags'],
+                uploaded=uploaded,
+            )
+        finally:
+            self.media_store.record_ghost_urls(uploaded)
+
+        if not ghost_post:
+            raise RuntimeError(f"Failed to create the Ghost digest of {len(jobs)} posts of @{username}")
+        logger.info(f"✓ Created Ghost digest post: {ghost_post.get('title')} ({ghost_post.get('url')})")
+        return {
+            'id': ghost_post.get('id'),
+            'url': ghost_post.get('url'),
+            'updated_at': ghost_post.get('updated_at'),
+            'uploaded': uploaded,
+        }
+
+    async def update(self, context, post: dict, media: list[dict], ref: dict, previous: dict) -> dict:
+        # The media is all uploaded already, unless the carousel changed
+        uploaded = self.media_store.ghost_urls(media)
+        image_paths = self.media_store.paths(media, 'image')
+        video_paths = self.media_store.paths(media, 'video')
+        try:
+            await self._upload_all(image_paths, video_paths, uploaded)
+            ghost_post = await self.ghost.update_media_post(
+                ref['id'],
+                ref.get('updated_at'),
+                image_paths=image_paths,
+                video_paths=video_paths,
+                description=post.get('description'),
+                uploaded=uploaded,
+                # A post without caption keeps the title it was created with
+                title=self._title(post) if post.get('description') else None,
+            )
+        finally:
+            self.media_store.record_ghost_urls(uploaded)
+
+        if not ghost_post:
+            raise RuntimeError(f"Failed to update Ghost post {ref['id']} for {post['shortcode']}")
+        logger.info(f"✓ Updated Ghost post: {ghost_post.get('title')} ({ghost_post.get('url')})")
+        return {**ref, 'updated_at': ghost_post.get('updated_at'), 'uploaded': uploaded}
+
+    async def delete(self, context, ref: dict) -> None:
+        # Unpublished rather than deleted, so it can be restored from the admin
+        ghost_post = await self.ghost.update_post(ref['id'], ref.get('updated_at'), status='draft')
+        if not ghost_post:
+            raise RuntimeError(f"Failed to unpublish Ghost post {ref['id']}")
@@ -0,0 +1,191 @@
+import logging
+import random
+import threading
+import time
+
+import instaloader
+
+from metrics import RETRIES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Requests per minute and burst size for each bucket. Every Instaloader call
+# draws one token from its endpoint class and one from the host it talks to.
+DEFAULT_LIMITS = {
+    'host:www.instagram.com': (20, 5),
+    'host:cdninstagram.com': (120, 20),
+    'endpoint:profile': (6, 2),
+    'endpoint:feed': (12, 3),
+    'endpoint:post': (10, 3),
+    'endpoint:media': (60, 10),
+}
+
+# Host each endpoint class is served from
+ENDPOINT_HOSTS = {
+    'profile': 'www.instagram.com',
+    'feed': 'www.instagram.com',
+    'post': 'www.instagram.com',
+    'media': 'cdninstagram.com',
+}
+
+# The breaker trips after this many throttled calls in a row, and stays open
+# for a cooldown that doubles on every trip up to the maximum.
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 15 * 60
+BREAKER_MAX_COOLDOWN = 6 * 3600
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Instagram while the circuit breaker is open."""
+
+
+def is_throttled(error: BaseException) -> bool:
+    """True if an Instaloader error means Instagram is rate limiting us (429 or a login wall)."""
+    while error is not None:
+        if isinstance(error, (instaloader.TooManyRequestsException, instaloader.LoginRequiredException)):
+            return True
+        text = str(error)
+        if '429' in text or 'Please wait a few minutes' in text:
+            return True
+        error = error.__cause__
+    return False
+
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second, holding at most capacity."""
+
+    def __init__(self, rate: float, capacity: float, tokens: float = None, updated_at: float = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity if tokens is None else min(tokens, capacity)
+        self.updated_at = time.time() if updated_at is None else updated_at
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, now: float) -> float:
+        """Take a token, returning how long to wait before it may be used."""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class InstagramRateLimiter:
+    """
+    Paces every Instaloader call and reacts to throttling.
+
+    Calls draw from per-host and per-endpoint token buckets, are retried with
+    exponential backoff and jitter when Instagram throttles them, and trip a
+    circuit breaker that rejects calls outright for a cooldown once throttling
+    persists. Bucket and breaker state is stored in the database so a restart
+    does not reset it. Thread-safe: calls come from the default executor.
+    """
+
+    def __init__(self, db, limits: dict[str, tuple[float, float]] = None, max_retries: int = 3, backoff: float = 30.0):
+        self.db = db
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._lock = threading.Lock()
+
+        saved = db.get_rate_limit_state()
+        self.buckets = {}
+        for key, (per_minute, burst) in (limits or DEFAULT_LIMITS).items():
+            tokens, updated_at = saved.get(key, (None, None))[:2]
+            self.buckets[key] = TokenBucket(per_minute / 60, burst, tokens, updated_at)
+
+        _, _, self.failures, self.open_until, self.trips = saved.get('breaker', (None, None, 0, 0.0, 0))
+
+    def _save(self):
+        state = {key: (bucket.tokens, bucket.updated_at, 0, 0.0, 0) for key, bucket in self.buckets.items()}
+        state['breaker'] = (None, None, self.failures, self.open_until, self.trips)
+        self.db.save_rate_limit_state(state)
+
+    def is_open(self) -> bool:
+        """True while the circuit breaker pauses all Instagram calls."""
+        return time.time() < self.open_until
+
+    def acquire(self, endpoint: str):
+        """Block until the endpoint and its host both have a token available."""
+        with self._lock:
+            if self.is_open():
+                raise CircuitOpenError(
+                    f"Instagram is throttling us, calls paused until {time.strftime('%H:%M', time.localtime(self.open_until))}"
+                )
+            now = time.time()
+            wait = 0.0
+            for key in (f'host:{ENDPOINT_HOSTS[endpoint]}', f'endpoint:{endpoint}'):
+                if key in self.buckets:
+                    wait = max(wait, self.buckets[key].reserve(now))
+            self._save()
+        if wait > 0:
+            logger.debug(f"Rate limit: waiting {wait:.1f}s before {endpoint} request")
+            time.sleep(wait)
+
+    def _record_success(self):
+        with self._lock:
+            if self.failures or self.trips:
+                self.failures = 0
+                self.trips = 0
+                self._save()
+
+    def _record_throttle(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= BREAKER_THRESHOLD:
+                cooldown = min(BREAKER_MAX_COOLDOWN, BREAKER_COOLDOWN * 2 ** self.trips)
+                self.open_until = time.time() + cooldown
+                self.trips += 1
+                self.failures = 0
+                logger.error(f"Instagram keeps throttling us: pausing all requests for {cooldown / 60:.0f} minutes")
+            self._save()
+
+    def call(self, endpoint: str, fn, *args, **kwargs):
+        """Run an Instaloader call under the limits, retrying it while it is throttled."""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(endpoint)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_throttled(e):
+                    raise
+                self._record_throttle()
+                if attempt == self.max_retries or self.is_open():
+                    raise
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.warning(f"Instagram throttled a {endpoint} request, retrying in {delay:.0f}s: {e}")
+                RETRIES.inc(destination='instagram')
+                time.sleep(delay)
+            else:
+                self._record_success()
+                return result
+
+    def iterate(self, endpoint: str, iterator):
+        """Yield from an Instaloader NodeIterator, drawing a token for every page it fetches."""
+        page_length = iterator.page_length()
+        while True:
+            # The first page arrives with the profile or when the iterator is
+            # created (under the caller's own call); later pages cost a
+            # request each. Pages are counted from the iterator's own
+            # position, so a thawed (resumed) iterator is paced correctly.
+            index = iterator.total_index
+            if index and index % page_length == 0:
+                item = self.call(endpoint, next, iterator, None)
+            else:
+                item = next(iterator, None)
+            if item is None:
+                return
+            yield item
+
+
+class RaisingRateController(instaloader.RateController):
+    """
+    Instaloader rate controller that lets InstagramRateLimiter handle 429s.
+
+    Instaloader would otherwise sleep for minutes inside the call; raising
+    hands the decision (backoff or circuit breaker) back to our limiter.
+    """
+
+    def handle_429(self, query_type: str) -> None:
+        raise instaloader.TooManyRequestsException(f"429 Too Many Requests ({query_type})")
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import random
+import statistics
+from datetime import datetime
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How many polls to spread over the typical gap between two posts
+POLLS_PER_POST = 4
+# Number of recent posts used to estimate the posting cadence
+CADENCE_SAMPLE = 20
+
+
+class AdaptivePollScheduler:
+    """
+    Poll scheduler that runs on the application's event loop.
+
+    Each account is polled at an interval derived from its posting cadence:
+    a fraction of the typical gap between its recent posts, stretched when
+    the account has been quiet for longer than usual, clamped between
+    min_interval and max_interval and spread with random jitter. Different
+    accounts are polled concurrently, but an account never has two cycles
+    running at the same time.
+    """
+
+    def __init__(self, db, poll, accounts: list[str], min_interval: float, max_interval: float, jitter: float = 0.1):
+        self.db = db
+        self.poll = poll
+        self.accounts = list(accounts)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self._next_due: dict[str, float] = {}
+        self._running: dict[str, asyncio.Task] = {}
+        self._task: asyncio.Task | None = None
+        self._wake = asyncio.Event()
+
+    def interval_for(self, username: str) -> float:
+        """Seconds to wait before polling the account again."""
+        dates = self.db.recent_publication_dates(username, CADENCE_SAMPLE)
+        if len(dates) < 2:
+            # Not enough history to tell: poll at the slowest rate
+            interval = self.max_interval
+        else:
+            gaps = [(newer - older).total_seconds() for newer, older in zip(dates, dates[1:])]
+            typical_gap = statistics.median(gaps)
+            # Back off when the account has been silent for longer than usual
+            quiet_for = (datetime.now() - dates[0]).total_seconds()
+            interval = max(typical_gap, quiet_for) / POLLS_PER_POST
+
+        interval = min(self.max_interval, max(self.min_interval, interval))
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def run_cycle(self, username: str) -> None:
+        """Poll one account and schedule its next cycle."""
+        try:
+            await self.poll(username)
+        except Exception as e:
+            logger.error(f"Error polling @{username}: {e}")
+
+        interval = self.interval_for(username)
+        self._next_due[username] = asyncio.get_running_loop().time() + interval
+        logger.info(f"Next check of @{username} in {interval / 60:.1f} minutes")
+
+    async def run(self) -> None:
+        """Poll every account once right away, then each whenever it is due."""
+        loop = asyncio.get_running_loop()
+        for username in self.accounts:
+            self._next_due.setdefault(username, loop.time())
+
+        while True:
+            now = loop.time()
+            for username, due in self._next_due.items():
+                if due <= now and username not in self._running:
+                    self._running[username] = loop.create_task(self.run_cycle(username))
+
+            # Sleep until the next idle account is due, a running cycle ends
+            # or poll_now() asks for an early cycle
+            idle = [due for username, due in self._next_due.items() if username not in self._running]
+            timeout = max(0.0, min(idle) - loop.time()) if idle else self.max_interval
+            wake = loop.create_task(self._wake.wait())
+            await asyncio.wait([*self._running.values(), wake], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            wake.cancel()
+            self._wake.clear()
+
+            for username, task in list(self._running.items()):
+                if task.done():
+                    del self._running[username]
+
+    def poll_now(self, username: str) -> None:
+        """Make the account due right away (e.g. when this node has just taken it over)."""
+        if username in self._next_due:
+            self._next_due[username] = asyncio.get_running_loop().time()
+            self._wake.set()
+
+    def start(self) -> asyncio.Task:
+        """Start the scheduler as a task on the running event loop."""
+        self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Cancel the scheduler task and the cycles it is running."""
+        tasks = list(self._running.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._running.clear()
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import math
+from datetime import timedelta
+
+from metrics import RETRIES, STAGE_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Telegram accepts 2 to 10 items in one media group
+MEDIA_GROUP_LIMIT = 10
+# Telegram lets a bot post about 20 messages per minute to the same chat
+SECONDS_PER_MESSAGE = 3.0
+# Flood-control waits honoured for one send before the attempt is failed
+MAX_FLOOD_RETRIES = 5
+
+
+def split_media_group(items: list, limit: int = MEDIA_GROUP_LIMIT) -> list[list]:
+    """Split a carousel into as few groups as possible, balanced so no group is left with one item."""
+    if not items:
+        return []
+    groups = math.ceil(len(items) / limit)
+    size, extra = divmod(len(items), groups)
+    chunks = []
+    start = 0
+    for index in range(groups):
+        end = start + size + (1 if index < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def _retry_after_seconds(error) -> float:
+    value = error.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class TelegramSender:
+    """
+    Sends messages through a per-chat queue that respects Telegram's flood control.
+
+    Sends to one chat are serialised and spaced at SECONDS_PER_MESSAGE per
+    message; a RetryAfter pauses that chat's queue for the time Telegram
+    asks, then the same send is retried. Other chats keep going meanwhile.
+    """
+
+    def __init__(self, seconds_per_message: float = SECONDS_PER_MESSAGE):
+        self.seconds_per_message = seconds_per_message
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._not_before: dict[int, float] = {}
+
+    async def send(self, chat_id: int, send, message_count: int = 1):
+        """Run send() (a coroutine factory) for chat_id once the chat's queue allows it."""
+        from telegram.error import RetryAfter
+
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        loop = asyncio.get_running_loop()
+        async with lock:
+            for attempt in range(MAX_FLOOD_RETRIES + 1):
+                delay = self._not_before.get(chat_id, 0) - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    with STAGE_SECONDS.time(stage='telegram_send'):
+                        result = await send()
+                except RetryAfter as e:
+                    wait = _retry_after_seconds(e)
+                    self._not_before[chat_id] = loop.time() + wait
+                    if attempt == MAX_FLOOD_RETRIES:
+                        raise
+                    logger.warning(f"Telegram flood control on chat {chat_id}: waiting {wait:.0f}s")
+                    RETRIES.inc(destination='telegram')
+                    continue
+                self._not_before[chat_id] = loop.time() + self.seconds_per_message * message_count
+                return result
@@ -0,0 +1,45 @@
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# The watcher's modules import each other as siblings, as when run from src/
+sys.path[:0] = [str(ROOT / 'src'), str(ROOT / 'bench')]
+
+from db import Database  # noqa: E402
+from fixtures import FixtureInstagram, FixturePost, FixtureProfile  # noqa: E402
+
+START = datetime(2024, 1, 1)
+
+
+def post(shortcode: str, hour: int) -> FixturePost:
+    """A one-image fixture post published hour hours after START."""
+    return FixturePost({
+        'shortcode': shortcode,
+        'caption': f'Post {shortcode}',
+        'timestamp': (START + timedelta(hours=hour)).isoformat(),
+        'items': [{'kind': 'image', 'size': 1000}],
+    }, 'http://cdn.invalid')
+
+
+def timeline(count: int) -> list[FixturePost]:
+    """count posts p0 (oldest) to p<count-1>, newest first as the feed lists them."""
+    return [post(f'p{hour}', hour) for hour in reversed(range(count))]
+
+
+class FeedInstagram(FixtureInstagram):
+    """Instagram client whose feed is listed exactly as given, pinned posts first."""
+
+    def __init__(self, username, db, feed, **kwargs):
+        super().__init__(username, db, [], None, **kwargs)
+        self.feed = feed
+
+    def _get_profile(self):
+        return FixtureProfile(self.feed)
+
+
+@pytest.fixture
+def db(tmp_path):
+    return Database(str(tmp_path / 'posts.db'))
@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+class Bot:
+    """Answers get_chat_member from {channel: {user: status}}; unknown channels fail like a kicked bot."""
+
+    def __init__(self, members):
+        self.members = members
+        self.asked = []
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.asked.append(chat_id)
+        if chat_id not in self.members:
+            raise RuntimeError('Forbidden: bot is not a member of the channel chat')
+        return SimpleNamespace(status=self.members[chat_id].get(user_id, 'member'))
+
+
+@pytest.fixture
+def routed_pages(monkeypatch):
+    """Pages routed only through ACCOUNTS_CONFIG, with CHANNEL_ID unset."""
+    monkeypatch.setattr(main, 'CHANNEL_ID', 0)
+    monkeypatch.setattr(main, 'accounts', {
+        'first': {'channel_id': -100, 'tags': []},
+        'second': {'channel_id': -200, 'tags': []},
+        'third': {'channel_id': -200, 'tags': []},
+    })
+
+
+def is_admin(bot, user_id):
+    return asyncio.run(main._is_admin_of_channel(SimpleNamespace(bot=bot), user_id))
+
+
+def test_admin_of_any_page_channel_is_accepted(routed_pages):
+    bot = Bot({-100: {}, -200: {42: 'administrator'}})
+
+    assert is_admin(bot, 42)
+    assert bot.asked == [-100, -200]
+
+
+def test_other_users_are_rejected(routed_pages):
+    bot = Bot({-100: {}, -200: {42: 'administrator'}})
+
+    assert not is_admin(bot, 7)
+
+
+def test_a_channel_that_cannot_be_checked_is_skipped(routed_pages):
+    assert is_admin(Bot({-200: {42: 'creator'}}), 42)
@@ -0,0 +1,16 @@
+def test_insert_posts_counts_only_the_rows_inserted(db):
+    assert db.insert_posts([('p1', 'Post p1', None), ('p2', 'Post p2', None), ('p3', 'Post p3', None)], 'page') == 3
+    assert db.insert_posts([('p3', 'Post p3', None), ('p4', 'Post p4', None), ('p5', None, None)], 'page') == 2
+    assert db.insert_posts([('p1', 'Post p1', None)], 'page') == 0
+
+
+def test_queued_blobs_are_the_downloaded_media_of_other_jobs(db):
+    for shortcode, hashes in (('p1', ['a', 'b']), ('p2', ['b', 'c']), ('p3', ['d'])):
+        db.enqueue_job(
+            shortcode, 'page', done_stages=('fetched', 'downloaded'),
+            results={'downloaded': {'media': [{'sha256': sha256, 'ext': '.jpg', 'kind': 'image'} for sha256 in hashes]}},
+        )
+    db.enqueue_job('p4', 'page')
+
+    assert db.queued_blobs() == {'a', 'b', 'c', 'd'}
+    assert db.queued_blobs(exclude='p3') == {'a', 'b', 'c'}
@@ -0,0 +1,140 @@
+import pytest
+
+import instagram
+from conftest import FeedInstagram, post, timeline
+from fixtures import FixtureInstagram
+
+
+def mark(db, hour: int):
+    db.update_high_water_mark('page', f'p{hour}', post(f'p{hour}', hour).date_utc.isoformat())
+
+
+def shortcodes(posts: list[dict]) -> list[str]:
+    return [p['shortcode'] for p in posts]
+
+
+def test_first_run_without_mark_scans_initial_depth(db):
+    page = FeedInstagram('page', db, timeline(20))
+
+    assert shortcodes(page.fetch_new_posts()) == ['p19', 'p18', 'p17', 'p16', 'p15']
+    assert page.caught_up
+
+
+def test_scan_stops_at_the_mark(db):
+    mark(db, 10)
+    page = FeedInstagram('page', db, timeline(20))
+
+    assert shortcodes(page.fetch_new_posts()) == [f'p{hour}' for hour in range(19, 10, -1)]
+
+
+def test_old_pinned_post_does_not_hide_new_posts(db):
+    mark(db, 10)
+    page = FeedInstagram('page', db, [post('pinned', -1000), post('p11', 11), *timeline(11)])
+
+    assert shortcodes(page.fetch_new_posts()) == ['p11']
+
+
+def test_every_pinned_slot_is_skipped(db):
+    mark(db, 10)
+    pinned = [post(f'pinned{index}', -1000 - index) for index in range(instagram.MAX_PINNED_POSTS)]
+    page = FeedInstagram('page', db, [*pinned, post('p11', 11), *timeline(11)])
+
+    assert shortcodes(page.fetch_new_posts()) == ['p11']
+
+
+def test_pinned_post_newer_than_the_mark_is_new(db):
+    mark(db, 10)
+    page = FeedInstagram('page', db, [post('p12', 12), post('p11', 11), *timeline(11)])
+
+    assert shortcodes(page.fetch_new_posts()) == ['p12', 'p11']
+
+
+def test_catch_up_goes_on_from_the_queued_posts(db, monkeypatch):
+    monkeypatch.setattr(instagram, 'MAX_CATCHUP_DEPTH', 4)
+    mark(db, 0)
+    page = FeedInstagram('page', db, timeline(11))
+
+    queued = []
+    while True:
+        new_posts = page.fetch_new_posts()
+        if not new_posts:
+            break
+        assert len(new_posts) <= 4
+        for new_post in new_posts:
+            db.enqueue_job(new_post['shortcode'], 'page', new_post['description'], new_post['timestamp'])
+        queued += shortcodes(new_posts)
+        # The mark only moves once the gap up to it is closed
+        assert db.get_high_water_mark('page')[0] == 'p0'
+
+    assert sorted(queued) == sorted(f'p{hour}' for hour in range(1, 11))
+    assert page.caught_up
+
+
+def test_mark_starts_at_the_newest_stored_post_not_the_pinned_one(db):
+    feed = [post('pinned', -1000), *timeline(20)]
+    db.insert_posts((p.shortcode, p.caption, p.date_utc.isoformat()) for p in feed)
+    page = FeedInstagram('page', db, feed)
+
+    assert page.fetch_new_posts() == []
+    assert db.get_high_water_mark('page')[0] == 'p19'
+
+
+def test_recheck_window_is_not_stretched_by_an_old_pinned_post(db):
+    mark(db, 19)
+    page = FeedInstagram('page', db, [post('pinned', -1000), *timeline(40)], recheck_window=12)
+    page.fetch_new_posts()
+
+    assert len(page.recent_posts) == 12
+    # The window's last post, not the pinned one
+    assert page.recent_since == post('p29', 29).date_utc.isoformat()
+
+
+def test_recheck_window_reaches_past_the_pinned_slots(db):
+    mark(db, 19)
+    page = FeedInstagram('page', db, [post('pinned', -1000), *timeline(40)], recheck_window=2)
+    page.fetch_new_posts()
+
+    assert len(page.recent_posts) == instagram.MAX_PINNED_POSTS + 1
+    assert page.recent_since == post('p37', 37).date_utc.isoformat()
+
+
+def test_recheck_window_covers_a_short_feed(db):
+    page = FeedInstagram('page', db, timeline(3))
+    page.fetch_new_posts()
+
+    assert page.recent_since is None
+
+
+def test_download_retry_reuses_the_cached_post(db, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    class FlakyDownloader:
+        attempts = 0
+
+        def download(self, items, target):
+            self.attempts += 1
+            if self.attempts == 1:
+                raise ConnectionError('503 Service Unavailable')
+
+    def lookup(*args):
+        raise AssertionError("the cached Post was looked up again")
+
+    mark(db, 0)
+    page = FeedInstagram('page', db, timeline(20))
+    monkeypatch.setattr(page, '_lookup_post', lookup)
+    page.downloader = FlakyDownloader()
+    # Found by the scan, below the recheck window
+    assert page.fetch_new_posts()[-1]['shortcode'] == 'p1'
+    with pytest.raises(ConnectionError):
+        page.download_post('p1')
+    page.download_post('p1')
+
+    assert page.downloader.attempts == 2
+
+
+def test_fixture_lookups_never_reach_instagram(db):
+    page = FixtureInstagram('page', db, timeline(3), None)
+
+    assert page._lookup_post('p1').shortcode == 'p1'
+    assert not page.is_deleted('p1')
+    assert page.is_deleted('gone')
@@ -0,0 +1,56 @@
+import time
+
+import instagram
+from conftest import FeedInstagram, post, timeline
+from db import Database
+from leases import LeaseManager, SQLiteLeaseBackend
+
+TTL = 0.2
+
+
+def test_failover_during_catch_up_does_not_queue_posts_twice(tmp_path, monkeypatch):
+    monkeypatch.setattr(instagram, 'MAX_CATCHUP_DEPTH', 4)
+    backend = SQLiteLeaseBackend(str(tmp_path / 'leases.db'))
+    feed = timeline(11)
+    queued = {}
+    for node in ('a', 'b'):
+        queued[node] = Database(str(tmp_path / f'{node}.db'))
+        queued[node].update_high_water_mark('page', 'p0', post('p0', 0).date_utc.isoformat())
+
+    # Node a catches up on the newest posts, below the shared mark
+    a = LeaseManager(backend, queued['a'], ['page'], 'a', TTL)
+    a.sync()
+    page = FeedInstagram('page', queued['a'], feed)
+    for new_post in page.fetch_new_posts():
+        assert not page.caught_up
+        assert a.claim('page', new_post['shortcode'], new_post['timestamp'])
+        queued['a'].enqueue_job(new_post['shortcode'], 'page', new_post['description'], new_post['timestamp'])
+
+    # ... and dies: its heartbeat and lease expire, node b takes the page over
+    time.sleep(TTL * 1.5)
+    b = LeaseManager(backend, queued['b'], ['page'], 'b', TTL)
+    assert b.sync() == ['page']
+    assert not a.claim('page', 'p6', post('p6', 6).date_utc.isoformat())
+
+    page = FeedInstagram('page', queued['b'], feed)
+    found = []
+    while new_posts := page.fetch_new_posts():
+        found += [new_post['shortcode'] for new_post in new_posts]
+        for new_post in new_posts:
+            queued['b'].enqueue_job(new_post['shortcode'], 'page', new_post['description'], new_post['timestamp'])
+
+    claimed = {job['shortcode'] for job in queued['a'].get_jobs()}
+    assert claimed == {'p10', 'p9', 'p8', 'p7'}
+    assert sorted(found) == sorted(f'p{hour}' for hour in range(1, 7))
+
+
+def test_claims_covered_by_the_shared_mark_are_dropped(tmp_path):
+    backend = SQLiteLeaseBackend(str(tmp_path / 'leases.db'))
+    manager = LeaseManager(backend, Database(str(tmp_path / 'a.db')), ['page'], 'a', 60)
+    manager.sync()
+
+    assert manager.claim('page', 'p5', post('p5', 5).date_utc.isoformat())
+    assert manager.claim('page', 'p9', post('p9', 9).date_utc.isoformat())
+    assert manager.record_mark('page', 'p7', post('p7', 7).date_utc.isoformat())
+
+    assert backend.get_claims('page') == ['p9']
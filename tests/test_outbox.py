@@ -0,0 +1,42 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from conftest import FeedInstagram
+from mediastore import MediaStore
+
+
+class Publisher:
+    name = 'ghost'
+    timeout = None
+
+    async def publish(self, context, job, media, state):
+        raise AssertionError("nothing can be published without the media")
+
+
+@pytest.fixture
+def outbox(db, tmp_path, monkeypatch):
+    async def download_fails(context, job):
+        raise RuntimeError('503 Service Unavailable')
+
+    monkeypatch.setattr(main, 'db', db)
+    monkeypatch.setattr(main, 'instagrams', {'page': FeedInstagram('page', db, [])})
+    monkeypatch.setattr(main, 'media_store', MediaStore(str(tmp_path / 'store'), db, 10 ** 6))
+    monkeypatch.setattr(main, 'publishers', [Publisher()])
+    monkeypatch.setattr(main, 'JOB_STAGES', ('fetched', 'downloaded', 'ghost', 'cleanup'))
+    monkeypatch.setattr(main, 'OUTBOX_MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(main, 'OUTBOX_RETRY_BACKOFF_SECONDS', 0)
+    monkeypatch.setattr(main, '_download_stage', download_fails)
+    return db
+
+
+def test_given_up_post_is_settled_without_being_listed_as_published(outbox):
+    outbox.enqueue_job('p1', 'page', 'Post p1', '2024-01-01T00:00:00', stages=main.JOB_STAGES)
+    for _ in range(main.OUTBOX_MAX_ATTEMPTS):
+        asyncio.run(main.process_outbox(SimpleNamespace(bot=None), 'page'))
+
+    assert outbox.get_jobs() == []
+    assert outbox.get_all_posts() == []
+    assert outbox.existing_shortcodes(['p1']) == {'p1'}
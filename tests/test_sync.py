@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+import main
+from conftest import FeedInstagram, post, timeline
+from instagram import content_hash, media_kinds
+
+
+@pytest.fixture
+def watcher(db, monkeypatch):
+    """The watcher's services, with one page whose whole timeline was published."""
+    published = [post('pinned', -1000), *timeline(40)]
+    for p in published:
+        db.save_publication(
+            p.shortcode, 'page', p.date_utc.isoformat(), content_hash(p.caption, media_kinds(p)),
+            [], {'ghost': {'id': p.shortcode}},
+        )
+    taken_down = []
+
+    async def take_down(context, publication):
+        taken_down.append(publication['shortcode'])
+
+    monkeypatch.setattr(main, 'db', db)
+    monkeypatch.setattr(main, 'instagrams', {})
+    monkeypatch.setattr(main, '_take_down', take_down)
+    return taken_down
+
+
+def sync(page: FeedInstagram):
+    main.instagrams['page'] = page
+    page.fetch_new_posts()
+
+    async def run():
+        main.fetch_semaphore = asyncio.Semaphore(1)
+        await main.sync_published_posts(None, 'page')
+
+    asyncio.run(run())
+
+
+class LookupInstagram(FeedInstagram):
+    """Answers post lookups from a set of shortcodes deleted on Instagram."""
+
+    def __init__(self, *args, deleted=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deleted = set(deleted)
+        self.lookups = []
+
+    def is_deleted(self, shortcode):
+        self.lookups.append(shortcode)
+        return shortcode in self.deleted
+
+
+def test_old_pinned_post_does_not_take_down_live_posts(db, watcher):
+    page = LookupInstagram('page', db, [post('pinned', -1000), *timeline(40)])
+    db.update_high_water_mark('page', 'p39', post('p39', 39).date_utc.isoformat())
+    sync(page)
+
+    assert page.lookups == []
+    assert watcher == []
+
+
+def test_deleted_post_in_the_window_is_taken_down(db, watcher):
+    feed = [p for p in [post('pinned', -1000), *timeline(40)] if p.shortcode != 'p35']
+    page = LookupInstagram('page', db, feed, deleted={'p35'})
+    db.update_high_water_mark('page', 'p39', post('p39', 39).date_utc.isoformat())
+    sync(page)
+
+    assert page.lookups == ['p35']
+    assert watcher == ['p35']
+
+
+def test_post_missing_from_the_feed_but_still_on_instagram_is_kept(db, watcher):
+    feed = [p for p in [post('pinned', -1000), *timeline(40)] if p.shortcode != 'p35']
+    page = LookupInstagram('page', db, feed)
+    db.update_high_water_mark('page', 'p39', post('p39', 39).date_utc.isoformat())
+    sync(page)
+
+    assert page.lookups == ['p35']
+    assert watcher == []